@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+"""用户接口的asyncio版本, 接口的参数和返回与server.py相同
+
+一个进程用一个事件循环处理所有请求, 等待redis和发布服务时不占用线程, 一个进程可以同时处理几千个请求
+推荐算法和同步版本共用, 只有redis/http/celery调用换成 recommend.tools.aio 里的asyncio版本
+会阻塞的初始化(读取配置, 加载热门视频)在启动时放到线程池里完成
+
+    python async_server.py
+    gunicorn async_server:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:30002
+"""
+import time
+import asyncio
+import logging
+import functools
+
+import ujson
+from aiohttp import web
+
+from recommend import (
+    configure,
+    middleware,
+)
+from recommend.const import ReturnCode
+from recommend.tools.args import (
+    load_args,
+    ParamException,
+    behavior_args,
+    recommend_args,
+)
+from recommend.tools.aio import (
+    AsyncScript,
+    AsyncPublishClient,
+    blocking_executor,
+    create_redis,
+    enqueue_video_recommendations,
+)
+from recommend.tools.trace import (
+    span,
+    metrics,
+)
+from recommend.algorithm.video.lua import (
+    POP_RECOMMEND_LUA,
+    needs_fill,
+    popped_videos,
+)
+from recommend.algorithm.video.v1 import algorithm1
+
+logger = logging.getLogger('recommend.file')
+
+pop_recommend_script = AsyncScript(POP_RECOMMEND_LUA)
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=ujson.dumps)
+
+
+def params_error():
+    return json_response({'ret': -1, 'msg': 'params error'}, status=400)
+
+
+async def device_video_behavior(request):
+    try:
+        args = load_args(behavior_args, await request.json(loads=ujson.loads))
+    except (ParamException, ValueError):
+        return params_error()
+
+    device = args['device']
+    video_id = args['video_id']
+    operation = args['operation']
+    if video_id:
+        redis = request.app['redis']
+        redis_key = 'operation|{}|{}|{}'.format(device, video_id, operation)
+        if not await redis.get(redis_key):
+            await enqueue_video_recommendations(redis, [(device, video_id, operation)])
+            await redis.set(redis_key, 1, expire=300)
+    return json_response({
+        "code": ReturnCode.success,
+        "result": "ok",
+    })
+
+
+async def device_video_recommend(request):
+    try:
+        args = load_args(recommend_args, dict(request.query))
+    except ParamException:
+        return params_error()
+
+    device = args['device']
+    size = args.get('size', 10)
+    version = args.get('version', 0)
+    keys, script_args = algorithm1.pop_recommend_request(device, size)
+    with span('recommend_list.pop', 'redis'):
+        recommend_videos = await pop_recommend_script(request.app['redis'], keys, script_args)
+        if needs_fill(recommend_videos):
+            # 启动时没有加载到热门视频的话, 抽取时会同步地从redis/es重新加载, 放到线程池里, 不阻塞事件循环
+            keys, script_args = await asyncio.get_event_loop().run_in_executor(
+                blocking_executor,
+                functools.partial(algorithm1.pop_recommend_request, device, size, fill=True))
+            recommend_videos = await pop_recommend_script(request.app['redis'], keys, script_args)
+    videos = popped_videos(recommend_videos)
+    if version >= 11300:
+        with span('query_publish_id', 'publish'):
+            pub_map = await request.app['publish'].query(videos)
+        videos = [{'video_id': k, 'publish_id': v} for k, v in pub_map.items()]
+    return json_response({
+        "code": ReturnCode.success,
+        "result": "ok",
+        "data": videos,
+    })
+
+
+async def device_metrics(request):
+    data, status, headers = metrics()
+    return web.Response(body=data, status=status, headers=headers)
+
+
+@web.middleware
+async def monitor(request, handler):
+    """和flask的MonitorMiddleware记录同样的指标"""
+    start = time.time()
+    resource = request.match_info.route.resource
+    label = {
+        'method': request.method,
+        'endpoint': resource.canonical if resource else request.path,
+        'instance': middleware.instance_id,
+    }
+    try:
+        resp = await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(e)
+        middleware.err_counter.labels(**label).inc()
+        resp = json_response({'ret': -2, 'msg': 'unknown error'}, status=500)
+
+    if label['endpoint'] != middleware.metric_url:
+        time_used = int((time.time() - start) * 1000)
+        logger.info('{} {} {}'.format(resp.status, label['endpoint'], time_used))
+        middleware.req_counter.labels(**label).inc()
+        middleware.resp_latency.labels(**label).observe(time_used)
+    return resp
+
+
+def warm_up():
+    """在线程池里完成会阻塞的初始化"""
+    configure.get('REDIS_URL')
+    configure.get('PUBLISH_QUERY_URL')
+    middleware.instance_id  # 第一次访问时查询ec2实例id
+    algorithm1.hot_pool.get_videos()
+
+
+def create_app(redis_factory=create_redis):
+    """
+    Args:
+        redis_factory (callable): 返回aioredis连接池的协程函数
+    """
+    async def on_startup(app):
+        await asyncio.get_event_loop().run_in_executor(None, warm_up)
+        app['redis'] = await redis_factory()
+        app['publish'] = AsyncPublishClient()
+        await app['publish'].start()
+
+    async def on_cleanup(app):
+        await app['publish'].close()
+        app['redis'].close()
+        await app['redis'].wait_closed()
+
+    app = web.Application(middlewares=[monitor])
+    app.router.add_post('/recommend/device/video/behavior', device_video_behavior)
+    app.router.add_get('/recommend/device/video/recommend', device_video_recommend)
+    app.router.add_get(middleware.metric_url, device_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=30002)
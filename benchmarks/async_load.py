@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""在本地替身上对比flask(多线程)和asyncio版本(async_server.py)接口的吞吐和延迟
+
+    python -m benchmarks.async_load
+    python -m benchmarks.async_load --concurrency 50 500 2000 --duration 10 --output load.json
+
+每个服务在单独的子进程里运行, 各自一套替身(见 benchmarks/stubs.py), 都是单进程
+压测客户端用aiohttp, 在当前进程里保持固定个数的请求同时在处理中
+请求中90%是带发布id的推荐请求(version=11300), 10%是行为上报
+发布服务替身默认有20ms延迟, 同步版本等待http时一直占用线程
+"""
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from collections import OrderedDict
+
+import aiohttp
+
+from benchmarks.stubs import (
+    StubEnvironment,
+    make_videos,
+)
+from benchmarks.suite import (
+    percentile,
+    git_commit,
+)
+
+
+def serve(name, port, videos, publish_delay):
+    """在子进程中启动服务"""
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    env = StubEnvironment(videos, publish_delay=publish_delay).install()
+    if name == 'flask':
+        import server
+        server.flask_app.run(host='127.0.0.1', port=port, threaded=True)
+        return
+
+    from aiohttp import web
+    from benchmarks.stubs import FakeAsyncRedis
+    import async_server
+
+    async def redis_factory():
+        return FakeAsyncRedis(env.redis)
+
+    app = async_server.create_app(redis_factory)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+async def run_load(base_url, concurrency, duration, video_ids):
+    """保持concurrency个请求同时在处理中, 持续duration秒, 返回(每个成功请求的耗时, 失败个数)"""
+    loop = asyncio.get_event_loop()
+    timings, errors = [], [0]
+    deadline = loop.time() + duration
+
+    async def worker(session, index):
+        i = index
+        while loop.time() < deadline:
+            start = time.perf_counter()
+            try:
+                if i % 10 == 0:
+                    request = session.post(base_url + '/recommend/device/video/behavior', json={
+                        'device': 'load-{}'.format(i % 5000),
+                        'video_id': video_ids[i % len(video_ids)],
+                        'operation': 1,
+                    })
+                else:
+                    request = session.get(base_url + '/recommend/device/video/recommend', params={
+                        'device': 'load-{}'.format(i % 5000), 'size': 10, 'version': 11300})
+                async with request as resp:
+                    await resp.read()
+                    ok = resp.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            if ok:
+                timings.append((time.perf_counter() - start) * 1000)
+            else:
+                errors[0] += 1
+            i += concurrency
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(worker(session, i) for i in range(concurrency)))
+    return timings, errors[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='flask vs asyncio load comparison')
+    parser.add_argument('--serve', choices=['flask', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--duration', type=float, default=10.0, help='每一轮压测的时间(秒)')
+    parser.add_argument('--videos', type=int, default=5000, help='合成视频个数')
+    parser.add_argument('--publish-delay', type=float, default=0.02, help='发布服务的延迟(秒)')
+    parser.add_argument('--output', help='结果json文件')
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.port, args.videos, args.publish_delay)
+        return
+
+    video_ids = sorted(make_videos(args.videos))
+
+    results = []
+    for name in ('flask', 'async'):
+        port = free_port()
+        process = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.async_load', '--serve', name, '--port', str(port),
+            '--videos', str(args.videos), '--publish-delay', str(args.publish_delay)])
+        try:
+            wait_port(port)
+            base_url = 'http://127.0.0.1:{}'.format(port)
+            # 预热: 加载热门视频池, 建立连接
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(run_load(base_url, 10, 1.0, video_ids))
+            for concurrency in args.concurrency:
+                timings, errors = loop.run_until_complete(
+                    run_load(base_url, concurrency, args.duration, video_ids))
+                timings.sort()
+                result = OrderedDict([
+                    ('server', name),
+                    ('concurrency', concurrency),
+                    ('requests', len(timings)),
+                    ('errors', errors),
+                    ('rps', round(len(timings) / args.duration, 1)),
+                    ('p50_ms', round(percentile(timings, 0.5), 2) if timings else None),
+                    ('p99_ms', round(percentile(timings, 0.99), 2) if timings else None),
+                ])
+                results.append(result)
+                print('{server:<6} concurrency {concurrency:>5}  {rps:>8} req/s  p50 {p50_ms} ms  '
+                      'p99 {p99_ms} ms  errors {errors}'.format(**result), file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('commit', git_commit()),
+            ('timestamp', int(time.time())),
+            ('duration', args.duration),
+            ('videos', args.videos),
+            ('publish_delay', args.publish_delay),
+        ])),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
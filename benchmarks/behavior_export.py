@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""在本地sqlite上对比从数据库读取行为和读取导出的列式快照(recommend.models.behavior_snapshot)
+
+    python -m benchmarks.behavior_export
+    python -m benchmarks.behavior_export --rows 2000000 --days 20
+
+合成行为按时间顺序写入, 其中少量行为的时间比前面的行为早(模拟写入延迟)
+先导出除最后一天以外的所有天, 再写入两天新的行为做一次增量导出
+最后分别用sql和快照统计每天每种操作的条数, 检查结果一致并比较耗时
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+from collections import Counter
+
+import numpy as np
+from sqlalchemy.engine import create_engine
+
+from recommend.models import (
+    BaseModel,
+    DBSession,
+)
+from recommend.models.video_model import VideoBehavior
+from recommend.models.behavior_snapshot import (
+    BehaviorSnapshot,
+    BehaviorSnapshotWriter,
+)
+
+
+def insert_days(engine, first_day, days, rows_per_day, rng):
+    """写入days天的行为, 每天rows_per_day条"""
+    for i in range(days):
+        day_start = datetime.datetime.combine(first_day + datetime.timedelta(days=i), datetime.time())
+        rows = []
+        for j in range(rows_per_day):
+            created_at = day_start + datetime.timedelta(seconds=86400.0 * j / rows_per_day)
+            if rng.random() < 0.001:
+                created_at -= datetime.timedelta(seconds=rng.randint(1, 600))
+            rows.append({
+                'device': '{:032x}'.format(rng.getrandbits(64) % 200000),
+                'video': 'v{:010d}'.format(int(rng.paretovariate(1.1)) % 100000),
+                'operation': rng.choice([1, 1, 1, 1, 2, 3, 4, 5]),
+                'created_at': created_at,
+            })
+        with engine.begin() as conn:
+            conn.execute(VideoBehavior.__table__.insert(), rows)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, x)) for root, _, files in os.walk(path) for x in files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='video_behavior export benchmark')
+    parser.add_argument('--rows', type=int, default=1000000, help='行为条数')
+    parser.add_argument('--days', type=int, default=10, help='天数')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(1)
+    rows_per_day = args.rows // args.days
+    first_day = datetime.date.today() - datetime.timedelta(days=args.days + 2)
+    data_dir = tempfile.mkdtemp(prefix='recommend-benchmark-')
+    try:
+        db_path = os.path.join(data_dir, 'behavior.db')
+        engine = create_engine('sqlite:///{}'.format(db_path))
+        BaseModel.metadata.create_all(engine)
+        DBSession.configure(bind=engine)
+        insert_days(engine, first_day, args.days, rows_per_day, rng)
+        print('{} rows over {} days'.format(rows_per_day * args.days, args.days), file=sys.stderr)
+
+        # 全量导出, 最后一天当作今天, 不导出
+        snapshot_path = os.path.join(data_dir, 'snapshot')
+        until = first_day + datetime.timedelta(days=args.days - 1)
+        writer = BehaviorSnapshotWriter(snapshot_path)
+        start = time.time()
+        count = writer.export(VideoBehavior.stream_since(writer.last_id), until)
+        seconds = time.time() - start
+        print('export                  {} rows, {:.0f} rows/s'.format(count, count / seconds))
+
+        # 增量导出: 再写入两天, 导出到最后一天之前
+        insert_days(engine, first_day + datetime.timedelta(days=args.days), 2, rows_per_day, rng)
+        writer = BehaviorSnapshotWriter(snapshot_path)
+        start = time.time()
+        count = writer.export(VideoBehavior.stream_since(writer.last_id), until + datetime.timedelta(days=2))
+        seconds = time.time() - start
+        print('incremental export      {} rows, {:.0f} rows/s'.format(count, count / seconds))
+
+        snapshot = BehaviorSnapshot(snapshot_path)
+        days = snapshot.days()
+        size = directory_size(snapshot_path)
+        print('snapshot size           {:.1f} MB, {:.1f} bytes/row (sqlite {:.1f} MB), {} days, dropped {}'.format(
+            size / 1e6, size / float(snapshot.meta['rows']), os.path.getsize(db_path) / 1e6,
+            len(days), snapshot.meta['dropped']))
+
+        # 每天每种操作的条数: sql流式读取 vs 快照
+        start = time.time()
+        expected = Counter()
+        for id_, _, _, operation, created_at in VideoBehavior.stream_since(0):
+            day = created_at.date().isoformat()
+            if id_ <= snapshot.meta['last_id'] and day in days:
+                expected[day, operation] += 1
+        sql_seconds = time.time() - start
+
+        start = time.time()
+        found, total = Counter(), 0
+        for day, data in snapshot.scan():
+            for operation, count in enumerate(np.bincount(data['operation']).tolist()):
+                if count:
+                    found[day, operation] = count
+            total += len(data['operation'])
+        snapshot_seconds = time.time() - start
+        print('count by day/operation  sql {:.2f} s, snapshot {:.4f} s ({:.0f}M rows/s)'.format(
+            sql_seconds, snapshot_seconds, total / snapshot_seconds / 1e6))
+        dropped = sum(expected.values()) - sum(found.values())
+        print('results match           {} (late rows dropped: {})'.format(
+            all(found[x] <= expected[x] for x in expected) and dropped == snapshot.meta['dropped'], dropped))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""在本地sqlite上对比逐条提交和批量写入行为记录, 以及按设备查询历史行为
+
+    python -m benchmarks.behavior_writer
+"""
+import os
+import time
+import random
+import tempfile
+from sqlalchemy.engine import create_engine
+from recommend.models import (
+    BaseModel,
+    DBSession,
+)
+from recommend.models.video_model import (
+    VideoBehavior,
+    VideoBehaviorWriter,
+)
+
+
+def main(count=5000):
+    path = os.path.join(tempfile.mkdtemp(), 'behavior.db')
+    engine = create_engine('sqlite:///{}'.format(path))
+    BaseModel.metadata.create_all(engine)
+    DBSession.configure(bind=engine)
+    devices = ['device{}'.format(i) for i in range(50)]
+
+    begin = time.time()
+    for i in range(count):
+        VideoBehavior.add(random.choice(devices), 'video{}'.format(i), 1)
+    seconds = time.time() - begin
+    print('VideoBehavior.add       {:.1f} us/row'.format(seconds * 1000000 / count))
+
+    writer = VideoBehaviorWriter(engine=engine, max_size=500, max_delay=60)
+    begin = time.time()
+    for i in range(count):
+        writer.add(random.choice(devices), 'video{}'.format(i), 1)
+    writer.flush()
+    seconds = time.time() - begin
+    print('VideoBehaviorWriter.add {:.1f} us/row'.format(seconds * 1000000 / count))
+
+    begin = time.time()
+    for device in devices:
+        VideoBehavior.query_by_device(device)
+    seconds = time.time() - begin
+    print('query_by_device         {:.2f} ms/device'.format(seconds * 1000 / len(devices)))
+
+    begin = time.time()
+    rows = 0
+    for device in devices:
+        rows += sum(1 for _ in VideoBehavior.iter_by_device(device))
+    seconds = time.time() - begin
+    print('iter_by_device          {:.2f} ms/device ({} rows/device)'.format(
+        seconds * 1000 / len(devices), rows // len(devices)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""在本地sqlite上生成合成行为, 跑协同过滤相似视频的离线任务(recommend.jobs.build_co_watch)
+
+    python -m benchmarks.co_watch
+    python -m benchmarks.co_watch --devices 100000 --processes 4
+
+合成数据: 每个视频属于一个兴趣组, 每个设备有一个兴趣组, 80%的行为落在自己的兴趣组里(组内按zipf分布)
+输出按设备顺序读取的速度, 任务耗时, 主进程和子进程的最大内存, 以及相似视频和种子视频同组的比例
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import resource
+import tempfile
+from multiprocessing import cpu_count
+
+from sqlalchemy.engine import create_engine
+
+from recommend.const import Operation
+from recommend.models import (
+    BaseModel,
+    DBSession,
+)
+from recommend.models.video_model import VideoBehavior
+
+operation_weights = [
+    (Operation.watch, 80),
+    (Operation.collect, 5),
+    (Operation.share, 5),
+    (Operation.star, 5),
+    (Operation.dislike, 5),
+]
+
+
+def make_behaviors(engine, devices, groups, group_videos, seed=1):
+    """写入合成行为, 返回(视频id -> 兴趣组, 行为条数)"""
+    rng = random.Random(seed)
+    video_group = {}
+    for group in range(groups):
+        for i in range(group_videos):
+            video_group['g{}v{}'.format(group, i)] = group
+    group_weights = [1.0 / (i + 1) for i in range(group_videos)]
+    operations, op_weights = zip(*operation_weights)
+    now = datetime.datetime.now()
+
+    total, rows = 0, []
+    for device in range(devices):
+        group = rng.randrange(groups)
+        for _ in range(rng.randint(5, 60)):
+            video_group_id = group if rng.random() < 0.8 else rng.randrange(groups)
+            video = rng.choices(range(group_videos), group_weights)[0]
+            rows.append({
+                'device': 'device{}'.format(device),
+                'video': 'g{}v{}'.format(video_group_id, video),
+                'operation': rng.choices(operations, op_weights)[0],
+                'created_at': now - datetime.timedelta(seconds=rng.randint(0, 30 * 86400)),
+            })
+        if len(rows) >= 50000:
+            total += len(rows)
+            with engine.begin() as conn:
+                conn.execute(VideoBehavior.__table__.insert(), rows)
+            rows = []
+    if rows:
+        total += len(rows)
+        with engine.begin() as conn:
+            conn.execute(VideoBehavior.__table__.insert(), rows)
+    return video_group, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='item-item collaborative filtering job benchmark')
+    parser.add_argument('--devices', type=int, default=20000, help='设备个数')
+    parser.add_argument('--groups', type=int, default=100, help='兴趣组个数')
+    parser.add_argument('--group-videos', type=int, default=500, help='每个兴趣组的视频个数')
+    parser.add_argument('--processes', type=int, default=cpu_count())
+    parser.add_argument('--chunk-devices', type=int, default=5000, help='每个分块的设备个数')
+    args = parser.parse_args(argv)
+
+    from recommend.algorithm.video.co_watch import CoWatchTable
+    from recommend.jobs.build_co_watch import build_co_watch
+
+    data_dir = tempfile.mkdtemp(prefix='recommend-benchmark-')
+    try:
+        engine = create_engine('sqlite:///{}'.format(os.path.join(data_dir, 'behavior.db')))
+        BaseModel.metadata.create_all(engine)
+        DBSession.configure(bind=engine)
+        video_group, total = make_behaviors(engine, args.devices, args.groups, args.group_videos)
+        print('{} rows, {} devices'.format(total, args.devices), file=sys.stderr)
+
+        start = time.time()
+        count = sum(1 for _ in VideoBehavior.scan_by_device(batch_size=10000))
+        seconds = time.time() - start
+        print('scan_by_device          {:.0f} rows/s'.format(count / seconds))
+
+        start = time.time()
+        hots = {x: 1000000 for x in video_group}
+        build_co_watch(VideoBehavior.scan_by_device(batch_size=10000), hots,
+                       os.path.join(data_dir, 'co_watch'), chunk_devices=args.chunk_devices,
+                       processes=args.processes)
+        print('build_co_watch          {:.1f} s ({} processes)'.format(time.time() - start, args.processes))
+        print('max rss                 main {:.0f} MB, children {:.0f} MB'.format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0))
+
+        table = CoWatchTable(os.path.join(data_dir, 'co_watch'))
+        seeds = random.Random(2).sample(sorted(video_group), 1000)
+        start = time.perf_counter()
+        results = [table.get(x, 16) for x in seeds]
+        seconds = time.perf_counter() - start
+        same = sum(video_group[x] == video_group[seed]
+                   for seed, result in zip(seeds, results) for x in result)
+        found = sum(len(x) for x in results)
+        print('lookup                  {:.1f} us/video, {:.1f} neighbours/video, {:.1%} same group'.format(
+            seconds * 1000000 / len(seeds), found / float(len(seeds)), same / float(found or 1)))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""对比冷启动抽取热门视频的旧实现(random.sample)和加权抽样表, 并检查抽样分布按热度加权
+
+    python -m benchmarks.hot_sampler
+"""
+import random
+import timeit
+from collections import Counter
+from recommend.tools.sampler import WeightedSampler
+
+
+def make_pool(size):
+    """构造热门视频池, 得分和 query_hot_videos 一样是播放量的log10"""
+    return {'video{}'.format(i): random.uniform(7.3, 10.0) for i in range(size)}
+
+
+def check_distribution(videos, sampler, rounds=2000):
+    """得分最高的10%视频被抽中的比例应该明显高于10%"""
+    top = set(sorted(videos, key=videos.get, reverse=True)[:len(videos) // 10])
+    counter = Counter()
+    for _ in range(rounds):
+        counter.update(sampler.sample(20))
+    share = sum(counter[x] for x in top) / float(sum(counter.values()))
+    print('top 10% share {:.3f}'.format(share))
+
+
+def main(count=200, number=1000):
+    for size in (1000, 10000, 100000):
+        videos = make_pool(size)
+        items = list(videos)
+        sampler = WeightedSampler(items, [videos[x] for x in items])
+        cases = (
+            ('random.sample', lambda: random.sample(list(videos), count)),
+            ('sampler', lambda: sampler.sample(count)),
+        )
+        for name, func in cases:
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            print('pool {:<7} {:<14} {:.1f} us/call'.format(size, name, seconds * 1000000 / number))
+
+    videos = make_pool(1000)
+    items = list(videos)
+    check_distribution(videos, WeightedSampler(items, [videos[x] for x in items]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""测量worker进程的启动(import)耗时, 每次都在新的python进程中import
+
+    python -m benchmarks.import_time
+"""
+import sys
+import subprocess
+
+modules = (
+    'recommend.tasks',
+    'server',
+)
+
+script = '''
+import time
+begin = time.time()
+import {}
+print(time.time() - begin)
+'''
+
+
+def measure(module, repeat=5):
+    """返回多次import耗时的最小值(秒)
+
+    Args:
+        module (str): 模块名
+        repeat (int): 次数
+    """
+    result = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script.format(module)])
+        result.append(float(output.decode('utf8').strip().splitlines()[-1]))
+    return min(result)
+
+
+def main():
+    for module in modules:
+        print('{:<20} {:.1f} ms'.format(module, measure(module) * 1000))
+
+
+if __name__ == '__main__':
+    main()
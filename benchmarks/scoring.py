@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""对比推荐列表合并的旧实现(dict逐个累加 + 全排序)和向量化实现的CPU时间, 并校验结果一致
+
+    python -m benchmarks.scoring
+"""
+import random
+import timeit
+from math import log10
+from recommend.algorithm.video.scoring import (
+    collect_scores,
+    merge_scores,
+    top_k,
+)
+
+weights = [0.1, 0.2, 0.3, 0.2, -0.5]
+
+
+def legacy_merge(recommend_map, events, max_size=500):
+    """原来 _collect_candidates + _merge_recommend_list 的计算逻辑(不含redis读写)"""
+    seeds, candidates = [], {}
+    for video, weight, video_map in events:
+        seeds.append(video)
+        for key, value in video_map.items():
+            value = log10(value)
+            if key in candidates:
+                init, incr = candidates[key]
+                candidates[key] = (init + weight * value, incr + weight * value)
+            else:
+                candidates[key] = (value, weight * value)
+    for video in seeds:
+        candidates.pop(video, None)
+
+    recommend_map = dict(recommend_map)
+    for video in seeds:
+        recommend_map.pop(video, None)
+    for key, (value, incr) in candidates.items():
+        if key in recommend_map:
+            recommend_map[key] += incr
+        else:
+            recommend_map[key] = value
+
+    recommend_list = sorted(recommend_map.items(), key=lambda kv: kv[1], reverse=True)
+    result = {}
+    for key, value in recommend_list[:max_size]:
+        if value < 0:
+            break
+        result[key] = value
+    return result
+
+
+def vectorized_merge(list_ids, list_scores, events, max_size=500):
+    seeds = [x[0] for x in events]
+    ids, init, incr = collect_scores(
+        [x[2] for x in events], [x[1] for x in events], exclude=seeds)
+    merged_ids, scores = merge_scores(list_ids, list_scores, ids, init, incr, drop=seeds)
+    return top_k(merged_ids, scores, max_size)
+
+
+def make_case(candidates, seeds=16):
+    """推荐列表和候选视频各有candidates个, 一半候选视频已在推荐列表中"""
+    recommend_map = {'video{}'.format(i): random.uniform(1, 10) for i in range(candidates)}
+    events = []
+    per_seed = candidates // seeds
+    for i in range(seeds):
+        start = candidates // 2 + i * per_seed
+        video_map = {'video{}'.format(j): random.randint(100001, 100000000)
+                     for j in range(start, start + per_seed)}
+        events.append(('seed{}'.format(i), random.choice(weights), video_map))
+    return recommend_map, events
+
+
+def main(number=20):
+    for candidates in (1000, 10000, 100000):
+        recommend_map, events = make_case(candidates)
+        list_ids, list_scores = list(recommend_map), list(recommend_map.values())
+
+        expected = legacy_merge(recommend_map, events)
+        ids, scores = vectorized_merge(list_ids, list_scores, events)
+        result = dict(zip(ids.tolist(), scores.tolist()))
+        assert result.keys() == expected.keys()
+        assert all(abs(result[x] - expected[x]) < 1e-9 for x in expected)
+
+        cases = (
+            ('legacy', lambda: legacy_merge(recommend_map, events)),
+            ('vectorized', lambda: vectorized_merge(list_ids, list_scores, events)),
+        )
+        for name, func in cases:
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            print('candidates={:<7d} {:<11} {:.3f} ms/update'.format(
+                candidates, name, seconds * 1000 / number))
+
+
+if __name__ == '__main__':
+    main()
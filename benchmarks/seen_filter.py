@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""对比已推荐视频记在推荐列表(负分)里和记在过滤器里时每个设备占用的redis内存,
+并测量过滤器在不同视频数时的误判率和视频数估算值(estimate_items)
+
+    python -m benchmarks.seen_filter
+
+redis不支持 MEMORY USAGE 时(比如测试用的内存redis), 按redis默认编码估算:
+超过128个元素的zset是skiplist编码, 每个元素约 id长度 + 80字节; 字符串约 长度 + 60字节
+"""
+import random
+import string
+from redis.exceptions import ResponseError
+from recommend.models import redis_client
+from recommend.algorithm.video.seen_filter import (
+    seen_keys,
+    seen_filter_bits,
+    seen_filter_capacity,
+    is_seen,
+    mark_seen,
+    estimate_items,
+)
+
+
+def random_video_id():
+    return ''.join(random.choice(string.ascii_letters + string.digits + '-_') for _ in range(11))
+
+
+def key_memory(key):
+    """返回(占用字节数, 是否是估算值)"""
+    try:
+        return redis_client.memory_usage(key) or 0, False
+    except (ResponseError, AttributeError):
+        pass
+
+    key_type = redis_client.type(key)
+    if key_type == b'zset':
+        members = redis_client.zrange(key, 0, -1)
+        return sum(len(x) + 80 for x in members), True
+    if key_type == b'string':
+        return redis_client.strlen(key) + 60, True
+    return 0, True
+
+
+def measure_false_positive(recommended, devices=20, probes=50000):
+    """每个设备记录recommended个视频, 返回(误判率, 平均估算视频数)"""
+    filters = []
+    for i in range(devices):
+        device = 'benchmark{}'.format(i)
+        pipe = redis_client.pipeline()
+        mark_seen(pipe, device, [random_video_id() for _ in range(recommended)])
+        pipe.execute()
+        keys = seen_keys(device)
+        filters.append(redis_client.mget(keys))
+        redis_client.delete(*keys)
+
+    false_positive = sum(
+        is_seen(filters[i % devices], random_video_id()) for i in range(probes))
+    estimated = sum(estimate_items(x[0]) for x in filters) / float(devices)
+    return false_positive / float(probes), estimated
+
+
+def main(devices=100, recommending=500, recommended=500):
+    totals, estimated = [0, 0, 0], False
+    for i in range(devices):
+        device = 'benchmark{}'.format(i)
+        candidates = [random_video_id() for _ in range(recommending)]
+        seen = [random_video_id() for _ in range(recommended)]
+        old_key = 'device|{}|recommend_old'.format(device)
+        new_key = 'device|{}|recommend'.format(device)
+
+        # 旧格式: 待推荐视频是正分, 已推荐视频是当前时间戳的负值
+        old_args, new_args = [], []
+        for video in candidates:
+            old_args += [random.uniform(1, 10), video]
+            new_args += [random.uniform(1, 10), video]
+        for video in seen:
+            old_args += [random.uniform(-11, -10), video]
+
+        pipe = redis_client.pipeline()
+        pipe.zadd(old_key, *old_args)
+        pipe.zadd(new_key, *new_args)
+        mark_seen(pipe, device, seen)
+        pipe.execute()
+
+        keys = seen_keys(device)
+        for index, key in enumerate((old_key, new_key, keys[0])):
+            size, guess = key_memory(key)
+            estimated = estimated or guess
+            totals[index] += size
+        redis_client.delete(old_key, new_key, *keys)
+
+    old_zset, new_zset, seen_filter = [x / 1024.0 / devices for x in totals]
+    print('memory per device with {} seen videos ({}):'.format(
+        recommended, 'estimated' if estimated else 'MEMORY USAGE'))
+    print('  before: zset with seen videos   {:>6.1f} KB'.format(old_zset))
+    print('  after:  zset {:.1f} KB + filter {:.1f} KB = {:>6.1f} KB (at most two filter windows)'.format(
+        new_zset, seen_filter, new_zset + seen_filter))
+
+    print('filter {} bits, capacity {}:'.format(seen_filter_bits, seen_filter_capacity))
+    for count in (500, seen_filter_capacity, seen_filter_capacity * 2):
+        rate, items = measure_false_positive(count)
+        print('  {:>5} seen videos  false positive rate {:.4%}  estimated items {:.0f}'.format(
+            count, rate, items))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""基准测试用的本地替身, 不需要consul/redis/es/mysql/发布服务
+
+    redis       fakeredis(lua脚本需要安装lupa)
+    es          StubElasticsearch, 实现本项目用到的 search/msearch/get/mget/exists/index
+    mysql       sqlite内存库
+    发布服务     本地线程里的http服务, 和线上一样走 publish_client 的连接池
+    consul      直接写入配置缓存, 不会连接consul
+    aioredis    FakeAsyncRedis, 和同步代码共用同一个fakeredis
+
+用法: 在调用任何会访问配置或连接的代码之前执行 StubEnvironment().install()
+依赖见 benchmarks/requirements.txt (pip install -r requirements.txt -r benchmarks/requirements.txt)
+"""
+import os
+import json
+import asyncio
+import hashlib
+import functools
+import random
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from socketserver import ThreadingMixIn
+
+import fakeredis
+from elasticsearch.exceptions import NotFoundError
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer 在python 3.7才加入"""
+    daemon_threads = True
+
+
+# es中分词的字段, term查询按小写单词匹配
+analyzed_fields = ('tag', 'title')
+
+# 热门视频池查询的标签, 合成数据里出现得更频繁
+hot_words = ['india', 'bollywood', 'series', 'funny', 'cricket', 'status']
+
+
+def make_words(count, rng):
+    """生成不在停用词表里的假单词"""
+    syllables = ['ka', 'ri', 'mo', 'na', 'te', 'lu', 'sa', 'vi', 'do', 'pe', 'ra', 'zu', 'ho', 'ge']
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_videos(count, seed=1):
+    """生成合成视频文档, 字段和es中的youtube视频一致
+    标签按zipf分布抽取, 播放量在1万到10亿之间按对数均匀分布
+
+    Args:
+        count (int): 视频个数
+        seed (int): 随机种子, 同一个种子生成的数据完全一样
+    """
+    rng = random.Random(seed)
+    words = hot_words + make_words(800, rng)
+    weights = [1.0 / (i + 1) for i in range(len(words))]
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'
+
+    videos = {}
+    while len(videos) < count:
+        video_id = ''.join(rng.choice(alphabet) for _ in range(11))
+        tags = rng.choices(words, weights, k=rng.randint(2, 6))
+        title = ' '.join(rng.choices(words, weights, k=rng.randint(4, 8)))
+        videos[video_id] = {
+            'id': video_id,
+            'type': 'mv',
+            'genre': ['youtube'],
+            'title': title.capitalize(),
+            'tag': tags,
+            'hot': int(10 ** rng.uniform(4, 9)),
+            'runtime': rng.randint(30, 600) if rng.random() < 0.9 else rng.randint(601, 3600),
+            'status': 1,
+            'poster': 'https://i.ytimg.com/vi/{}/maxresdefalut.jpg'.format(video_id),
+        }
+    return videos
+
+
+def eligible_docs(videos, with_title=False):
+    """可推荐视频的(视频id, 标签集合, 播放量)列表, 和离线任务扫描es的结果一致
+
+    Args:
+        videos (dict): make_videos 生成的视频
+        with_title (bool): 标签集合是否包含标题里的单词
+    """
+    from recommend.algorithm.video.tokenizer import tokenize
+    docs = []
+    for video_id in sorted(videos):
+        source = videos[video_id]
+        if source['runtime'] <= 600 and source['hot'] > 100000:
+            tags = tokenize(source['title'] if with_title else '', source['tag'])
+            if tags:
+                docs.append((video_id, tags, source['hot']))
+    return docs
+
+
+class StubElasticsearch(object):
+    """内存中的es, 只支持本项目用到的查询
+
+    打分方式: bool/should里每命中一个term得10分, must里的range条件得1分, 其它条件只过滤不打分
+    """
+
+    def __init__(self, videos):
+        self.docs = {}
+        self.terms = {}
+        self.postings = {}  # tag中的单词 -> 视频id集合, should查询先用它缩小范围
+        for video_id, source in videos.items():
+            self.index(None, None, source, id=video_id)
+
+    @staticmethod
+    def _field_terms(source, field):
+        value = source.get(field)
+        values = value if isinstance(value, list) else [value]
+        if field in analyzed_fields:
+            return {word for x in values if x for word in str(x).lower().split()}
+        return set(values)
+
+    def _evaluate(self, video_id, query):
+        """返回(是否匹配, 得分)"""
+        (kind, body), = query.items()
+        if kind == 'term':
+            (field, value), = body.items()
+            terms = self.terms[video_id].get(field)
+            if terms is None:
+                terms = self.terms[video_id][field] = self._field_terms(self.docs[video_id], field)
+            return value in terms, 10.0
+
+        if kind == 'range':
+            (field, conditions), = body.items()
+            value = self.docs[video_id].get(field)
+            if value is None:
+                return False, 0.0
+            checks = {
+                'gt': lambda x: value > x,
+                'gte': lambda x: value >= x,
+                'lt': lambda x: value < x,
+                'lte': lambda x: value <= x,
+            }
+            return all(checks[op](x) for op, x in conditions.items()), 1.0
+
+        if kind == 'bool':
+            score = 0.0
+            for clause in body.get('must', []) + body.get('filter', []):
+                matched, clause_score = self._evaluate(video_id, clause)
+                if not matched:
+                    return False, 0.0
+                if 'range' in clause or 'bool' in clause:
+                    score += clause_score
+            should = body.get('should', [])
+            if should:
+                scores = [s for matched, s in (self._evaluate(video_id, x) for x in should) if matched]
+                if not scores:
+                    return False, 0.0
+                score += sum(scores)
+            return True, score
+
+        if kind == 'match_all':
+            return True, 1.0
+        raise NotImplementedError('stub es does not support {} query'.format(kind))
+
+    def _should_tags(self, query):
+        """查询里bool/should的tag单词, 没有should时返回None"""
+        (kind, body), = query.items()
+        if kind != 'bool':
+            return None
+        if body.get('should'):
+            tags = set()
+            for clause in body['should']:
+                if list(clause) != ['term'] or list(clause['term']) != ['tag']:
+                    return None
+                tags.add(clause['term']['tag'])
+            return tags
+        for clause in body.get('must', []) + body.get('filter', []):
+            tags = self._should_tags(clause)
+            if tags is not None:
+                return tags
+        return None
+
+    def search(self, index=None, doc_type=None, body=None, **kwargs):
+        body = body or {}
+        query = body.get('query', {'match_all': {}})
+        min_score = body.get('min_score', 0)
+        tags = self._should_tags(query)
+        if tags is None:
+            candidates = self.docs
+        else:
+            # 得分最多是 命中标签数 * 10 + 1, 达不到min_score的不用再匹配
+            counter = Counter()
+            for tag in tags:
+                counter.update(self.postings.get(tag, ()))
+            candidates = [x for x, count in counter.items() if count * 10.0 + 1.0 >= min_score]
+
+        hits = []
+        for video_id in candidates:
+            matched, score = self._evaluate(video_id, query)
+            if matched and score >= min_score:
+                hits.append((score, video_id))
+
+        if body.get('sort'):
+            (field, order), = body['sort'][0].items()
+            hits.sort(key=lambda x: self.docs[x[1]][field], reverse=order.get('order') == 'desc')
+        else:
+            hits.sort(reverse=True)
+
+        fields = body.get('_source')
+        result = []
+        for score, video_id in hits[:body.get('size', 10)]:
+            source = self.docs[video_id]
+            if fields is not None:
+                source = {x: source[x] for x in fields if x in source}
+            result.append({
+                '_index': index, '_type': doc_type, '_id': video_id,
+                '_score': score, '_source': dict(source)})
+        return {'hits': {'total': len(hits), 'hits': result}}
+
+    def msearch(self, body, **kwargs):
+        responses = []
+        for header, query in zip(body[0::2], body[1::2]):
+            responses.append(self.search(header.get('index'), header.get('type'), body=query))
+        return {'responses': responses}
+
+    def get(self, index, doc_type, id, ignore=None, **kwargs):
+        source = self.docs.get(id)
+        if source is not None:
+            return {'_index': index, '_type': doc_type, '_id': id,
+                    'found': True, '_source': dict(source)}
+
+        ignore = ignore if isinstance(ignore, (list, tuple)) else (ignore,)
+        if 404 in ignore:
+            return {'_index': index, '_type': doc_type, '_id': id, 'found': False}
+        raise NotFoundError(404, 'not_found', {'_id': id, 'found': False})
+
+    def mget(self, body, index=None, doc_type=None, **kwargs):
+        docs = body.get('docs') or [{'_id': x} for x in body.get('ids', [])]
+        result = []
+        for doc in docs:
+            item = self.get(doc.get('_index', index), doc.get('_type', doc_type), doc['_id'],
+                            ignore=404)
+            result.append(item)
+        return {'docs': result}
+
+    def exists(self, index, doc_type, id, **kwargs):
+        return id in self.docs
+
+    def index(self, index, doc_type, body, id=None, **kwargs):
+        old = self.docs.get(id)
+        if old is not None:
+            for word in self._field_terms(old, 'tag'):
+                self.postings[word].discard(id)
+        self.docs[id] = dict(body)
+        self.terms[id] = {}
+        for word in self._field_terms(body, 'tag'):
+            self.postings.setdefault(word, set()).add(id)
+        return {'_index': index, '_type': doc_type, '_id': id, 'result': 'created'}
+
+
+class PublishStub(object):
+    """发布服务替身, 每5个视频里有4个有发布id
+
+    Args:
+        delay (float): 每次请求的额外延迟(秒), 模拟网络耗时
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length).decode('utf8'))
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+
+                data = []
+                for item in body.get('resources', []):
+                    video_id = item['res_id']
+                    published = sum(video_id.encode('utf8')) % 5 != 0
+                    data.append({
+                        'res_id': video_id,
+                        'pub_ids': ['pub-{}'.format(video_id)] if published else [],
+                    })
+                content = json.dumps({'data': data}).encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/publish/query'.format(self.server.server_port)
+        self._thread = threading.Thread(target=self.server.serve_forever, name='publish-stub')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeAsyncRedis(object):
+    """aioredis连接池的替身, 只实现 async_server.py 用到的命令
+    fakeredis在一个单独的线程里执行命令(和redis服务一样单线程), lua脚本执行时不会阻塞事件循环
+
+    Args:
+        client (FakeStrictRedis): 和同步代码共用的fakeredis
+    """
+
+    SET_IF_NOT_EXIST = 'SET_IF_NOT_EXIST'
+
+    def __init__(self, client):
+        self.client = client
+        self._scripts = {}
+        self._executor = ThreadPoolExecutor(1)
+
+    def _call(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def _set(self, client, key, value, expire=0, exist=None):
+        return client.set(key, value, ex=expire or None, nx=exist == self.SET_IF_NOT_EXIST)
+
+    async def get(self, key):
+        return await self._call(self.client.get, key)
+
+    async def set(self, key, value, expire=0, exist=None):
+        return await self._call(self._set, self.client, key, value, expire, exist)
+
+    async def evalsha(self, sha, keys=(), args=()):
+        import aioredis
+        script = self._scripts.get(sha)
+        if script is None:
+            raise aioredis.ReplyError('NOSCRIPT No matching script. Please use EVAL.')
+        return await self.eval(script, keys, args)
+
+    async def eval(self, script, keys=(), args=()):
+        self._scripts[hashlib.sha1(script.encode('utf8')).hexdigest()] = script
+        return await self._call(self.client.eval, script, len(keys), *(list(keys) + list(args)))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def wait_closed(self):
+        pass
+
+
+class StubEnvironment(object):
+    """把项目里所有外部连接替换成本地替身
+
+    Args:
+        video_count (int): 合成视频个数
+        seed (int): 随机种子
+        publish_delay (float): 发布服务每次请求的额外延迟(秒)
+    """
+
+    def __init__(self, video_count=5000, seed=1, publish_delay=0.0):
+        self.videos = make_videos(video_count, seed)
+        self.video_ids = sorted(self.videos)
+        self.data_dir = tempfile.mkdtemp(prefix='recommend-benchmark-')
+        self.es = StubElasticsearch(self.videos)
+        self.redis = fakeredis.FakeStrictRedis()
+        self.db_engine = create_engine(
+            'sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        self.publish = PublishStub(publish_delay)
+
+    def install(self):
+        from recommend import configure
+        configure.config_handler._values.update({
+            'MYSQL_URL': 'sqlite://',
+            'REDIS_URL': 'redis://127.0.0.1:6379/0',
+            'AMQP_URL': 'memory://',
+            'ES_HOSTS': '[]',
+            'PUBLISH_QUERY_URL': self.publish.url,
+        })
+
+        from recommend import models
+        from recommend.models import video_model
+        self.redis.flushall()
+        object.__setattr__(models.redis_client, '_wrapped', self.redis)
+        object.__setattr__(models.es_client, '_wrapped', self.es)
+        object.__setattr__(models.db_engine, '_wrapped', self.db_engine)
+        models.BaseModel.metadata.create_all(self.db_engine, tables=[video_model.VideoBehavior.__table__])
+
+        # 本地索引和热门视频快照都放到临时目录, 不读取机器上已有的文件
+        from recommend.algorithm.video import tag_index
+        tag_index.tag_index_path = os.path.join(self.data_dir, 'tag_index')
+        tag_index._tag_index, tag_index._checked_at = None, 0
+        from recommend.algorithm.video import tag_vectors
+        tag_vectors.tag_vector_index_path = os.path.join(self.data_dir, 'tag_vectors')
+        tag_vectors._tag_vector_index, tag_vectors._checked_at = None, 0
+        from recommend.algorithm.video import co_watch
+        co_watch.co_watch_path = os.path.join(self.data_dir, 'co_watch')
+        co_watch._co_watch_table, co_watch._checked_at = None, 0
+        from recommend.algorithm.video.v1 import algorithm1
+        from recommend.algorithm.video.v2 import algorithm2
+        for algorithm in (algorithm1, algorithm2):
+            algorithm.hot_pool.snapshot_path = os.path.join(
+                self.data_dir, '{}.json'.format(algorithm.hot_pool.redis_key))
+
+        # 不查询ec2的实例id
+        from recommend import middleware
+        middleware.instance_id = 'benchmark'
+        return self
+
+    def build_tag_index(self):
+        """用合成视频建立本地倒排索引, 之后 _query_videos_by_tag 不再查询es"""
+        from recommend.algorithm.video import tag_index
+        tag_index.build_tag_index(eligible_docs(self.videos), tag_index.tag_index_path)
+        tag_index._tag_index, tag_index._checked_at = None, 0
+
+    def build_tag_vectors(self, clusters=None):
+        """用合成视频建立标签向量索引, 之后 _compute_similar_videos 不再查询倒排索引或es"""
+        from recommend.algorithm.video import tag_vectors
+        from recommend.jobs.build_tag_vectors import build_tag_vector_index
+        build_tag_vector_index(
+            eligible_docs(self.videos, with_title=True), tag_vectors.tag_vector_index_path, clusters)
+        tag_vectors._tag_vector_index, tag_vectors._checked_at = None, 0
+
+    def close(self):
+        self.publish.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""用本地替身(见 benchmarks/stubs.py)跑推荐服务的真实代码路径, 结果输出为json, 方便和之前的结果对比
+
+    python -m benchmarks.suite --output result.json
+    python -m benchmarks.suite --filter v1. --number 500
+    python -m benchmarks.suite --baseline last.json --output result.json
+
+--baseline 指定之前的结果文件时, 打印每个用例p50的变化
+每个用例先执行 --warmup 次不计时, 再执行 --number 次逐次计时
+用例的准备工作(比如填充推荐列表, 删除缓存)不计入耗时
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from collections import OrderedDict
+
+from benchmarks.stubs import StubEnvironment
+
+
+class Case(object):
+    """一个基准测试用例
+
+    Args:
+        name (str): 用例名
+        func (callable): 被测函数, 参数是第几次执行
+        prepare (callable): 每次执行前调用, 不计时, 参数是第几次执行
+        setup (callable): 预热之前调用一次, 不计时
+    """
+
+    def __init__(self, name, func, prepare=None, setup=None):
+        self.name = name
+        self.func = func
+        self.prepare = prepare
+        self.setup = setup
+
+    def run(self, number, warmup):
+        if self.setup:
+            self.setup()
+        for i in range(warmup):
+            if self.prepare:
+                self.prepare(i)
+            self.func(i)
+
+        timings = []
+        for i in range(warmup, warmup + number):
+            if self.prepare:
+                self.prepare(i)
+            start = time.perf_counter()
+            self.func(i)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+
+def percentile(timings, ratio):
+    """已排序的耗时列表的分位数"""
+    return timings[min(len(timings) - 1, int(round(ratio * (len(timings) - 1))))]
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    return OrderedDict([
+        ('name', name),
+        ('number', len(timings)),
+        ('mean_ms', round(sum(timings) / len(timings), 4)),
+        ('p50_ms', round(percentile(timings, 0.5), 4)),
+        ('p95_ms', round(percentile(timings, 0.95), 4)),
+        ('p99_ms', round(percentile(timings, 0.99), 4)),
+        ('min_ms', round(timings[0], 4)),
+        ('max_ms', round(timings[-1], 4)),
+    ])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fill_recommend_list(device, video_ids, seen=()):
+    """直接写入设备的推荐列表和已推荐过滤器"""
+    from recommend.models import redis_client
+    from recommend.algorithm.video.seen_filter import (
+        seen_keys,
+        mark_seen,
+    )
+    zset_args = []
+    for i, video_id in enumerate(video_ids):
+        zset_args.append(10.0 - i * 0.001)
+        zset_args.append(video_id)
+    pipe = redis_client.pipeline()
+    pipe.delete('device|{}|recommend'.format(device), *seen_keys(device))
+    if zset_args:
+        pipe.zadd('device|{}|recommend'.format(device), *zset_args)
+    mark_seen(pipe, device, list(seen))
+    pipe.execute()
+
+
+def algorithm_cases(env, prefix, algorithm):
+    """VideoAlgorithmV1/V2 的各个热路径"""
+    from recommend.const import Operation
+    from recommend.algorithm.video import video_cache
+    from recommend.tools.publish import publish_client
+
+    video_ids = env.video_ids
+    seeds = video_ids[:50]
+    operations = [Operation.watch, Operation.collect, Operation.share, Operation.star, Operation.dislike]
+    device = '{}-benchmark'.format(prefix)
+    cases = []
+
+    def warm_similar():
+        for video_id in seeds:
+            algorithm.get_similar_videos(video_id, 16)
+
+    # 更新推荐列表: 种子视频的相似视频已缓存, 只测量合并和写入
+    for atomic_update in (True, False):
+        def prepare_update(i, atomic_update=atomic_update):
+            algorithm.atomic_update = atomic_update
+            if i % 50 == 0:
+                fill_recommend_list(device, video_ids[1000:1200], video_ids[1200:1400])
+
+        def update(i):
+            algorithm.update_recommend_list(device, seeds[i % len(seeds)], operations[i % len(operations)])
+
+        cases.append(Case('{}.update_recommend_list.{}'.format(
+            prefix, 'atomic' if atomic_update else 'merge'), update, prepare_update, warm_similar))
+
+    # 推荐列表非空时直接弹出, 为空时从热门视频池填充
+    def prepare_warm(i):
+        fill_recommend_list(device, video_ids[2000:2200], video_ids[2200:2400])
+
+    cases.append(Case('{}.get_recommend_videos.warm'.format(prefix),
+                      lambda i: algorithm.get_recommend_videos(device, 10), prepare_warm))
+    cases.append(Case('{}.get_recommend_videos.cold'.format(prefix),
+                      lambda i: algorithm.get_recommend_videos('{}-cold-{}'.format(prefix, i), 10)))
+
+    # 相似视频: 命中缓存 / 删除两级缓存后重新计算
+    cases.append(Case('{}.get_similar_videos.cached'.format(prefix),
+                      lambda i: algorithm.get_similar_videos(seeds[i % len(seeds)], 16),
+                      setup=warm_similar))
+
+    def prepare_similar(i):
+        algorithm.similar_cache.delete('{} {}'.format(video_ids[i % len(video_ids)], 16))
+
+    cases.append(Case('{}.get_similar_videos.uncached'.format(prefix),
+                      lambda i: algorithm.get_similar_videos(video_ids[i % len(video_ids)], 16),
+                      prepare_similar))
+
+    cases.append(Case('{}._get_video_tag.cached'.format(prefix),
+                      lambda i: algorithm._get_video_tag(seeds[i % len(seeds)])))
+    cases.append(Case('{}._get_video_tag.uncached'.format(prefix),
+                      lambda i: algorithm._get_video_tag(video_ids[i % len(video_ids)]),
+                      lambda i: video_cache.delete(video_ids[i % len(video_ids)])))
+
+    # 发布id: 一次查询一页推荐结果(50个视频)
+    def publish_chunk(i):
+        begin = i * 50 % len(video_ids)
+        return video_ids[begin: begin + 50]
+
+    def prepare_publish(i):
+        for video_id in publish_chunk(i):
+            publish_client._cache.delete(video_id)
+
+    cases.append(Case('{}.query_publish_id.cached'.format(prefix),
+                      lambda i: algorithm.query_publish_id(seeds)))
+    cases.append(Case('{}.query_publish_id.uncached'.format(prefix),
+                      lambda i: algorithm.query_publish_id(publish_chunk(i)), prepare_publish))
+    return cases
+
+
+def endpoint_cases(env):
+    """flask接口, 用test_client发请求, 包含参数解析和中间件"""
+    import server
+    client = server.flask_app.test_client()
+    video_ids = env.video_ids
+
+    def check(resp):
+        assert resp.status_code == 200, resp.data
+
+    def behavior(i):
+        check(client.post('/recommend/device/video/behavior', json={
+            'device': 'http-benchmark', 'video_id': video_ids[i % len(video_ids)], 'operation': 1}))
+
+    def behavior_bulk(i):
+        check(client.post('/recommend/device/video/behavior/bulk', json=[
+            {'device': 'http-bulk-{}'.format(j % 20), 'video_id': video_ids[(i * 100 + j) % len(video_ids)],
+             'operation': 1}
+            for j in range(100)]))
+
+    def prepare_recommend(i):
+        fill_recommend_list('http-benchmark', video_ids[3000:3200])
+
+    def recommend(i):
+        check(client.get('/recommend/device/video/recommend',
+                         query_string={'device': 'http-benchmark', 'size': 10, 'version': 11300}))
+
+    def recommend_batch(i):
+        check(client.post('/recommend/device/video/recommend/batch', json={
+            'devices': [{'device': 'http-batch-{}'.format(j), 'size': 10} for j in range(20)],
+            'version': 11300}))
+
+    return [
+        Case('http.behavior', behavior),
+        Case('http.behavior_bulk', behavior_bulk),
+        Case('http.recommend', recommend, prepare_recommend),
+        Case('http.recommend_batch', recommend_batch),
+    ]
+
+
+def compare(results, baseline_path):
+    """打印和之前结果相比p50的变化"""
+    with open(baseline_path, 'r') as f:
+        baseline = {x['name']: x for x in json.load(f)['results']}
+    for result in results:
+        old = baseline.get(result['name'])
+        if not old:
+            continue
+        change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0.0
+        print('{:<45} {:>10.3f} -> {:>10.3f} ms  {:+.1%}'.format(
+            result['name'], old['p50_ms'], result['p50_ms'], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='recommend benchmark suite')
+    parser.add_argument('--number', type=int, default=200, help='每个用例计时的次数')
+    parser.add_argument('--warmup', type=int, default=20, help='每个用例不计时的预热次数')
+    parser.add_argument('--filter', default='', help='只运行名字包含该字符串的用例')
+    parser.add_argument('--videos', type=int, default=5000, help='合成视频个数')
+    parser.add_argument('--tag-index', action='store_true', help='使用本地倒排索引代替es查询')
+    parser.add_argument('--tag-vectors', action='store_true', help='使用标签向量索引召回相似视频')
+    parser.add_argument('--publish-delay', type=float, default=0.0, help='发布服务的额外延迟(秒)')
+    parser.add_argument('--output', help='结果json文件, 不指定时输出到标准输出')
+    parser.add_argument('--baseline', help='之前的结果json文件')
+    args = parser.parse_args(argv)
+
+    env = StubEnvironment(args.videos, publish_delay=args.publish_delay).install()
+    try:
+        if args.tag_index:
+            env.build_tag_index()
+        if args.tag_vectors:
+            env.build_tag_vectors()
+
+        from recommend.algorithm.video.v1 import algorithm1
+        from recommend.algorithm.video.v2 import algorithm2
+        cases = (algorithm_cases(env, 'v1', algorithm1) +
+                 algorithm_cases(env, 'v2', algorithm2) +
+                 endpoint_cases(env))
+
+        results = []
+        for case in cases:
+            if args.filter not in case.name:
+                continue
+            result = summarize(case.name, case.run(args.number, args.warmup))
+            results.append(result)
+            print('{name:<45} mean {mean_ms:>9.3f}  p50 {p50_ms:>9.3f}  p95 {p95_ms:>9.3f} ms'.format(
+                **result), file=sys.stderr)
+    finally:
+        env.close()
+
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('commit', git_commit()),
+            ('timestamp', int(time.time())),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('cpu_count', os.cpu_count()),
+            ('number', args.number),
+            ('warmup', args.warmup),
+            ('videos', args.videos),
+            ('tag_index', args.tag_index),
+            ('tag_vectors', args.tag_vectors),
+            ('publish_delay', args.publish_delay),
+        ])),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""标签向量索引(见 recommend.algorithm.video.tag_vectors)的建索引耗时, 查询延迟和召回率
+
+    python -m benchmarks.tag_vectors
+    python -m benchmarks.tag_vectors --videos 500000 --nprobe 4 8 16
+
+召回率是返回结果中精确余弦相似度不低于真实第size名的比例(合成数据里相似度相同的视频很多, 不按视频id比较)
+同时给出本地倒排索引(tag_index)的查询延迟作为对比
+"""
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmarks.stubs import (
+    make_videos,
+    eligible_docs,
+)
+from benchmarks.suite import percentile
+
+
+def exact_threshold(matrix, row, size):
+    """精确计算所有视频和第row个视频的余弦相似度, 返回(相似度数组, 第size高的相似度)"""
+    scores = matrix.dot(matrix[row].T).toarray().ravel()
+    scores[row] = -1
+    top = np.partition(-scores, size - 1)[:size]
+    return scores, max(-top.max(), 1e-9)
+
+
+def timed(func, queries):
+    timings, results = [], []
+    for item in queries:
+        start = time.perf_counter()
+        results.append(func(item))
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='tag vector index benchmark')
+    parser.add_argument('--videos', type=int, default=200000, help='合成视频个数')
+    parser.add_argument('--queries', type=int, default=1000, help='查询次数')
+    parser.add_argument('--size', type=int, default=16, help='每次查询的相似视频个数')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--clusters', type=int, help='簇个数')
+    args = parser.parse_args(argv)
+
+    from recommend.algorithm.video.tag_index import (
+        TagIndex,
+        build_tag_index,
+    )
+    from recommend.algorithm.video.tag_vectors import TagVectorIndex
+    from recommend.jobs.build_tag_vectors import (
+        tfidf_matrix,
+        build_tag_vector_index,
+    )
+
+    docs = eligible_docs(make_videos(args.videos), with_title=True)
+    data_dir = tempfile.mkdtemp(prefix='recommend-benchmark-')
+    try:
+        start = time.time()
+        build_tag_vector_index(docs, data_dir + '/tag_vectors', args.clusters)
+        print('build {} videos: {:.1f} s'.format(len(docs), time.time() - start), file=sys.stderr)
+        build_tag_index(docs, data_dir + '/tag_index')
+        index = TagVectorIndex(data_dir + '/tag_vectors')
+        tag_index = TagIndex(data_dir + '/tag_index')
+
+        _, _, matrix, videos, _ = tfidf_matrix(docs)
+        rows = random.Random(1).sample(range(len(videos)), args.queries)
+        tag_map = {video_id: tags for video_id, tags, _ in docs}
+        queries = [(videos[row], tag_map[videos[row]]) for row in rows]
+        rank = {video_id: i for i, video_id in enumerate(videos)}
+        expected = [exact_threshold(matrix, row, args.size) for row in rows]
+
+        for nprobe in args.nprobe:
+            timings, results = timed(
+                lambda x: index.query(x[1], args.size, exclude=x[0], min_similarity=0, nprobe=nprobe), queries)
+            found = total = 0
+            for (scores, threshold), result in zip(expected, results):
+                # 量化误差内的相似度视为相同
+                found += sum(1 for x in result if scores[rank[x]] >= threshold - 0.01)
+                total += min(args.size, int((scores >= threshold - 0.01).sum()))
+            recall = found / float(total or 1)
+            print('tag_vectors nprobe {:>3}  p50 {:.3f}  p99 {:.3f} ms  recall@{} {:.3f}'.format(
+                nprobe, percentile(timings, 0.5), percentile(timings, 0.99), args.size, recall))
+
+        timings, _ = timed(lambda x: tag_index.query(x[1], args.size, min_score=0), queries)
+        print('tag_index               p50 {:.3f}  p99 {:.3f} ms'.format(
+            percentile(timings, 0.5), percentile(timings, 0.99)))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""对比标签分词的旧实现(连续str.replace)和转换表实现, 结果一致性见 tests/test_tokenizer.py
+
+    python -m benchmarks.tokenizer
+"""
+import re
+import random
+import timeit
+from recommend.algorithm.video import stop_words_set
+from recommend.algorithm.video.tokenizer import (
+    punctuations,
+    tokenize,
+    tokenize_batch,
+)
+
+emoji_pattern = re.compile('[\U0001F300-\U0001F64F\U0001F680-\U0001F6FF☀-⭕]+')
+
+
+def legacy_tokenize(title, tags):
+    """原来 VideoAlgorithmV1._get_video_tag 的分词逻辑"""
+    video_tag = list(tags)
+    video_tag.append(title)
+    sentence = ' '.join(video_tag)
+    sentence = sentence.lower()
+    sentence = emoji_pattern.sub(' ', sentence)
+    sentence = sentence.replace(",", " ").replace("|", " ").replace("#", " "). \
+        replace("@", " ").replace("~", " ").replace("'", " ").replace("\"", " "). \
+        replace("\\", " ").replace("/", " ").replace("_", " ").replace("-", " "). \
+        replace("[", " ").replace("]", " ").replace("+", " ").replace("*", " "). \
+        replace("{", " ").replace("}", " ").replace(";", " ").replace(":", " "). \
+        replace("`", " ").replace("=", " ").replace("【", " ").replace("】", " "). \
+        replace("(", " ").replace(")", " ").replace(".", " ").replace("’", " "). \
+        replace("?", " ")
+    words = sentence.split(' ')
+
+    tags = set()
+    for word in words:
+        if not word:
+            continue
+
+        if len(word) == 1 or len(word) > 30:
+            continue
+
+        if word in stop_words_set:
+            continue
+
+        tags.add(word)
+    return tags
+
+
+def make_docs(count):
+    """构造测试文档, 大约五分之一包含非ascii字符"""
+    words = ['Bollywood', 'Songs', 'Funny', 'Video', 'HD', 'Full', 'Movie', 'Hindi',
+             'Official', 'Trailer', 'The', 'and', 'of', 'x' * 31, 'a']
+    unicode_words = ['Σίσυφος', 'गाना', '\U0001F600', '❤']
+    chars = list(punctuations) + [' ', ' ', ' ', '\t']
+    docs = []
+    for i in range(count):
+        choices = words + unicode_words if i % 5 == 0 else words
+        separators = chars if i % 5 == 0 else [x for x in chars if ord(x) < 128]
+        title = ''.join(random.choice(choices) + random.choice(separators) for _ in range(12))
+        tags = [random.choice(choices) + random.choice(separators) + random.choice(choices)
+                for _ in range(random.randint(0, 15))]
+        docs.append((title, tags))
+    return docs
+
+
+def main(count=10000):
+    docs = make_docs(count)
+
+    cases = (
+        ('legacy', lambda: [legacy_tokenize(title, tags) for title, tags in docs]),
+        ('tokenize', lambda: [tokenize(title, tags) for title, tags in docs]),
+        ('tokenize_batch', lambda: tokenize_batch(docs)),
+    )
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print('{:<16} {:.2f} us/doc'.format(name, seconds * 1000000 / count))
+
+
+if __name__ == '__main__':
+    main()
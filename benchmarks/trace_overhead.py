@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""测量分阶段耗时统计(span)每次调用增加的开销
+
+    python -m benchmarks.trace_overhead
+"""
+import timeit
+from recommend.tools.trace import span
+
+
+def noop():
+    pass
+
+
+@span('benchmark.decorator')
+def decorated():
+    pass
+
+
+def with_block():
+    with span('benchmark.context'):
+        pass
+
+
+def main(number=200000):
+    base = min(timeit.repeat(noop, number=number, repeat=3))
+    for name, func in (('decorator', decorated), ('context manager', with_block)):
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{:<16} {:.2f} us/call overhead'.format(name, (seconds - base) * 1000000 / number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""对比推荐列表的两种更新方式
+
+    python -m benchmarks.update_recommend
+"""
+import random
+import timeit
+from recommend.const import Operation
+from recommend.models import redis_client
+from recommend.algorithm.video.v1 import algorithm1
+from recommend.algorithm.video.seen_filter import (
+    seen_keys,
+    mark_seen,
+)
+
+device = 'benchmark'
+device_key = 'device|{}|recommend'.format(device)
+
+
+def prepare(list_size):
+    """构造一个有list_size个待推荐视频的推荐列表, 并把另外list_size个视频记为已推荐"""
+    zset_args = []
+    for i in range(list_size):
+        zset_args.append(random.uniform(1, 10))
+        zset_args.append('video{}'.format(i * 2 + 1))
+    pipe = redis_client.pipeline()
+    pipe.delete(device_key, *seen_keys(device))
+    pipe.zadd(device_key, *zset_args)
+    mark_seen(pipe, device, ['video{}'.format(i * 2) for i in range(list_size)])
+    pipe.execute()
+
+
+def main(number=1000):
+    # 相似视频一半已在列表中, 一半已推荐过
+    similar_videos = {'video{}'.format(i): random.randint(100001, 100000000) for i in range(16)}
+    algorithm1.get_similar_videos = lambda video, size: similar_videos
+
+    for list_size in (100, 1000):
+        for atomic_update in (False, True):
+            prepare(list_size)
+            algorithm1.atomic_update = atomic_update
+            seconds = timeit.timeit(
+                lambda: algorithm1.update_recommend_list(device, 'video1', Operation.watch),
+                number=number)
+            print('list_size={:<6d} atomic_update={:<6} {:.3f} ms/update'.format(
+                list_size, str(atomic_update), seconds * 1000 / number))
+    redis_client.delete(device_key, *seen_keys(device))
+
+
+if __name__ == '__main__':
+    main()
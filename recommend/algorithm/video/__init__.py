@@ -1,13 +1,15 @@
 # -*- coding: utf8 -*-
-from youtube_dl import (
-    DateRange,
-    YoutubeDL,
-)
+from youtube_dl import DateRange
 from recommend.const import (
     video_index,
     video_type,
 )
 from recommend.models import es_client
+from recommend.tools.cache import TieredCache
+from recommend.tools.trace import span
+
+# 视频文档缓存, 进程内缓存1分钟, redis缓存1小时
+video_cache = TieredCache('video', max_size=20000, ttl=60, redis_ttl=3600)
 
 
 ydl_opts = {
@@ -245,6 +247,30 @@ stop_words_set = {
 }
 
 
+def get_video_sources(video_ids):
+    """批量查询视频文档, 先查缓存, 未命中的用一次mget查询es
+
+    Args:
+        video_ids (list): 视频id列表
+    """
+    sources = video_cache.get_many(video_ids)
+    misses = [x for x in video_ids if x not in sources]
+    if not misses:
+        return sources
+
+    query = {'docs': [{'_index': video_index, '_type': video_type, '_id': x} for x in misses]}
+    with span('get_video_sources', 'es'):
+        query_result = es_client.mget(query)
+    fetched = {}
+    for item in query_result['docs']:
+        source = item.get('_source')
+        if source:
+            fetched[item['_id']] = source
+    video_cache.set_many(fetched)
+    sources.update(fetched)
+    return sources
+
+
 def get_videos(video_ids):
     """批量查询视频id
 
@@ -254,15 +280,13 @@ def get_videos(video_ids):
     if not video_ids:
         return
 
-    query = {'docs': [{'_index': video_index, '_type': video_type, '_id': x} for x in video_ids]}
-    query_result = es_client.mget(query)
-    docs = query_result['docs']
-
+    sources = get_video_sources(video_ids)
     result = []
-    for item in docs:
-        source = item.get('_source', {})
+    for video_id in video_ids:
+        source = sources.get(video_id)
         if not source:
             continue
+        source = dict(source)
         source.pop('tag', None)
         source.pop('genre')
         source['poster'] = source['poster'].replace('maxresdefalut', 'hqdefault')
@@ -270,40 +294,30 @@ def get_videos(video_ids):
     return result
 
 
-def extract_youtube_info(url):
-    """解析youtube详情页
+class VideoPending(Exception):
+    """视频不在es中, 已提交爬取任务, 爬完之后才能使用"""
 
-    Args:
-        url (str): 视频播放页
-    """
-    with YoutubeDL(ydl_opts) as ydl:
-        return ydl.extract_info(url)
+    def __init__(self, video_id):
+        super(VideoPending, self).__init__(video_id)
+        self.video_id = video_id
 
 
 def get_video(video_id):
-    """查询youtube视频详情
-    如果视频不存在es中,需要爬一次
+    """查询youtube视频详情, 先查缓存
+    如果视频不存在es中, 抛出VideoPending, 由调用方提交爬取任务(见crawler模块)
 
     Args:
         video_id (str): 视频id
     """
-    if es_client.exists(video_index, video_type, video_id):
-        video = es_client.get(video_index, video_type, id=video_id)
-        return video['_source']
+    source = video_cache.get(video_id)
+    if source is not None:
+        return dict(source)
+
+    with span('get_video', 'es'):
+        video = es_client.get(video_index, video_type, id=video_id, ignore=404)
+    if video.get('found'):
+        source = video['_source']
+        video_cache.set(video_id, source)
+        return dict(source)
 
-    play_url = 'https://youtube.com/watch?v={}'.format(video_id)
-    data = extract_youtube_info(play_url)
-    body = {
-        'id': video_id,
-        'type': 'mv',
-        'p_type': 'video',
-        'slate': play_url,
-        'poster': data['thumbnail'],
-        'runtime': data['duration'],
-        'hot': data['view_count'],
-        'genre': ['youtube'],
-        'title': data['title'],
-        'tag': data['tags']
-    }
-    es_client.index(video_index, video_type, body, id=video_id)
-    return body
+    raise VideoPending(video_id)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""离线计算的协同过滤相似视频: 和一个视频被同一批设备操作过的其它视频
+由 recommend.jobs.build_co_watch 从video_behavior计算
+
+目录下的文件:
+    videos.npy      排好序的视频id, 查询时二分查找
+    offsets.npy     每个视频的相似视频在neighbours中的起止位置
+    neighbours.npy  相似视频的编号(videos中的下标), 按相似度从高到低排列
+    scores.npy      相似度(操作得分向量的余弦)
+    hots.npy        视频编号 -> 播放量, 只有可推荐的视频才会出现在neighbours中
+
+和tag_index一样, 目录是指向实际数据目录的软链接, 所有文件都是mmap方式加载
+"""
+import os
+import time
+
+import numpy as np
+
+from recommend.const import co_watch_path
+
+
+def _load(path):
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+class CoWatchTable(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.videos = _load(os.path.join(path, 'videos.npy'))
+        self.offsets = _load(os.path.join(path, 'offsets.npy'))
+        self.neighbours = _load(os.path.join(path, 'neighbours.npy'))
+        self.scores = _load(os.path.join(path, 'scores.npy'))
+        self.hots = _load(os.path.join(path, 'hots.npy'))
+
+    def get(self, video_id, size=10):
+        """查询视频的相似视频, 返回 视频id -> 播放量, 按相似度从高到低排列
+
+        Args:
+            video_id (str): 视频id
+            size (int): 最多返回个数
+        """
+        video_map = {}
+        key = video_id.encode('utf8')
+        i = int(np.searchsorted(self.videos, key))
+        if i == len(self.videos) or self.videos[i] != key:
+            return video_map
+
+        begin = self.offsets[i]
+        end = min(self.offsets[i + 1], begin + size)
+        for doc in self.neighbours[begin:end].tolist():
+            video_map[self.videos[doc].decode('utf8')] = int(self.hots[doc])
+        return video_map
+
+
+_co_watch_table = None
+_checked_at = 0
+
+
+def get_co_watch_table(check_interval=60):
+    """获取协同过滤相似视频表, 不存在时返回None
+    每隔check_interval秒检查一次是否被重新计算
+
+    Args:
+        check_interval (int): 检查间隔(秒)
+    """
+    global _co_watch_table, _checked_at
+    now = time.time()
+    if now - _checked_at < check_interval:
+        return _co_watch_table
+
+    _checked_at = now
+    if not os.path.exists(co_watch_path):
+        _co_watch_table = None
+        return None
+
+    data_path = os.path.realpath(co_watch_path)
+    if _co_watch_table is None or _co_watch_table.path != data_path:
+        _co_watch_table = CoWatchTable(data_path)
+    return _co_watch_table
+
+
+def get_co_watched_videos(video_id, size=10):
+    """查询视频的协同过滤相似视频, 没有计算结果时返回空字典
+
+    Args:
+        video_id (str): 视频id
+        size (int): 最多返回个数
+    """
+    table = get_co_watch_table()
+    if table is None:
+        return {}
+    return table.get(video_id, size)
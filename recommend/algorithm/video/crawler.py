@@ -0,0 +1,161 @@
+# -*- coding: utf8 -*-
+"""爬取不在es中的视频
+
+推荐更新时遇到不在es中的视频不再同步爬取, 而是登记等待爬取的(设备, 操作), 立即返回
+同一个视频在爬取完成之前只提交一次爬取任务, 爬完写入es后再用登记的行为更新推荐列表
+
+爬取任务在单独的celery队列 crawl 中执行, 由并发数固定的worker消费:
+    celery -A recommend worker -Q crawl -c 4
+每个worker进程只创建一次YoutubeDL并一直复用
+"""
+import os
+import logging
+
+from youtube_dl import YoutubeDL
+
+from recommend.const import (
+    video_index,
+    video_type,
+)
+from recommend.models import (
+    es_client,
+    redis_client,
+)
+from recommend.algorithm.video import (
+    ydl_opts,
+    video_cache,
+)
+from recommend.tools.trace import span
+
+logger = logging.getLogger('recommend.file')
+
+
+def create_youtube_extractor():
+    return YoutubeDL(ydl_opts)
+
+
+def build_video_source(video_id, data):
+    """把youtube详情页的解析结果转换成es文档
+
+    Args:
+        video_id (str): 视频id
+        data (dict): extract_info 的返回值
+    """
+    play_url = 'https://youtube.com/watch?v={}'.format(video_id)
+    return {
+        'id': video_id,
+        'type': 'mv',
+        'p_type': 'video',
+        'slate': play_url,
+        'poster': data['thumbnail'],
+        'runtime': data['duration'],
+        'hot': data['view_count'],
+        'genre': ['youtube'],
+        'title': data['title'],
+        'tag': data['tags']
+    }
+
+
+class VideoCrawler(object):
+
+    def __init__(self, extractor_factory=None, lock_ttl=600, failure_ttl=300):
+        """
+        Args:
+            extractor_factory (callable): 创建解析器, 解析器需要有 extract_info(url) 方法
+            lock_ttl (int): 爬取标记的过期时间(秒), 任务丢失时过期后可以重新提交
+            failure_ttl (int): 爬取失败后多久之内不再重试(秒)
+        """
+        self.extractor_factory = extractor_factory or create_youtube_extractor
+        self.lock_ttl = lock_ttl
+        self.failure_ttl = failure_ttl
+        self._pid = None
+        self._extractor = None
+
+    @staticmethod
+    def _lock_key(video_id):
+        return 'crawl|{}'.format(video_id)
+
+    @staticmethod
+    def _waiting_key(video_id):
+        return 'crawl|{}|waiting'.format(video_id)
+
+    @property
+    def extractor(self):
+        """每个进程只创建一次解析器"""
+        if self._pid != os.getpid():
+            self._extractor = self.extractor_factory()
+            self._pid = os.getpid()
+        return self._extractor
+
+    def request(self, video_id, device=None, operation=None):
+        """登记等待视频爬取完成的行为, 返回是否需要提交爬取任务
+        同一个视频正在爬取时只登记行为
+
+        Args:
+            video_id (str): 视频id
+            device (str): 设备id
+            operation (int): 操作类型
+        """
+        waiting_key = self._waiting_key(video_id)
+        pipe = redis_client.pipeline()
+        if device is not None:
+            pipe.rpush(waiting_key, '{} {}'.format(device, operation))
+            pipe.expire(waiting_key, self.lock_ttl)
+        pipe.set(self._lock_key(video_id), 1, ex=self.lock_ttl, nx=True)
+        return bool(pipe.execute()[-1])
+
+    def is_failed(self, video_id):
+        """视频最近是否爬取失败过
+
+        Args:
+            video_id (str): 视频id
+        """
+        return redis_client.get(self._lock_key(video_id)) == b'failed'
+
+    def _pop_waiting(self, video_id, failed=False):
+        """取出所有等待中的行为, 同时释放爬取标记(失败时把标记改成failed, 保留failure_ttl秒)"""
+        pipe = redis_client.pipeline()
+        pipe.lrange(self._waiting_key(video_id), 0, -1)
+        pipe.delete(self._waiting_key(video_id))
+        if failed:
+            pipe.set(self._lock_key(video_id), 'failed', ex=self.failure_ttl)
+        else:
+            pipe.delete(self._lock_key(video_id))
+        events = pipe.execute()[0]
+
+        # 操作类型是整数, 从右边切分, 设备id里有空格也不会出错
+        events = [x.decode('utf8').rsplit(' ', 1) for x in events]
+        return [(device, int(operation)) for device, operation in events]
+
+    def crawl(self, video_id):
+        """爬取视频并写入es和缓存, 返回(视频文档, 等待中的(设备, 操作)列表)
+        视频已经在es中时不再爬取, 爬取失败时返回的视频文档为None
+
+        Args:
+            video_id (str): 视频id
+        """
+        source = video_cache.get(video_id)
+        if source is None:
+            video = es_client.get(video_index, video_type, id=video_id, ignore=404)
+            if video.get('found'):
+                source = video['_source']
+                video_cache.set(video_id, source)
+
+        if source is None:
+            play_url = 'https://youtube.com/watch?v={}'.format(video_id)
+            try:
+                with span('crawl_video.extract', 'youtube'):
+                    data = self.extractor.extract_info(play_url)
+                source = build_video_source(video_id, data)
+            except Exception as e:
+                logger.warning('crawl video {} failed: {}'.format(video_id, e))
+                self._pop_waiting(video_id, failed=True)
+                return None, []
+
+            es_client.index(video_index, video_type, source, id=video_id)
+            video_cache.set(video_id, source)
+
+        return source, self._pop_waiting(video_id)
+
+
+video_crawler = VideoCrawler()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""热门视频池
+
+第一次使用时加载, 依次尝试: 本地快照 -> redis中的热门视频 -> 查询es
+redis中没有热门视频时, 同一台机器上只有拿到文件锁的进程查询es, 其它进程等它写入redis后直接读取
+每个进程有一个后台线程定期从redis重新加载热门视频, 整体替换, 不阻塞请求
+整个集群每隔 refresh_interval 只有拿到redis锁的一个进程重新查询es
+加载时按播放量得分建好抽样表, 冷启动时按热度加权抽取热门视频
+"""
+import os
+import time
+import fcntl
+import random
+import logging
+import threading
+from math import log10
+
+import ujson
+
+from recommend.const import (
+    video_index,
+    video_type,
+    hot_video_snapshot_path,
+)
+from recommend.models import (
+    es_client,
+    redis_client,
+)
+from recommend.tools.sampler import WeightedSampler
+
+logger = logging.getLogger('recommend.file')
+
+
+def _hot_video_query(tag=None, size=100):
+    """查询指定标签热门视频的es语句
+
+    Args:
+        tag (str): 标签
+        size (int): 个数
+    """
+    query = {
+        'size': size,
+        'query': {
+            'bool': {
+                'must': [
+                    {'term': {'type': 'mv'}},
+                    {'term': {'genre': 'youtube'}},
+                ]
+            }
+        },
+        '_source': ['hot'],
+        'sort': [{"hot": {"order": "desc"}}]
+    }
+    if tag:
+        query['query']['bool']['must'].append({'term': {'tag': tag}})
+    return query
+
+
+def query_hot_videos(tags):
+    """用一次msearch查询多个标签的热门视频, 返回(视频id -> 得分, 视频id -> 标签)
+    一个视频属于多个标签时算作第一个标签, 不限标签的算作空字符串
+
+    Args:
+        tags (list): (标签, 个数)列表, 标签为None表示不限标签
+    """
+    body = []
+    for tag, size in tags:
+        body.append({'index': video_index, 'type': video_type})
+        body.append(_hot_video_query(tag, size))
+    query_result = es_client.msearch(body=body)
+
+    video_map, video_tags = {}, {}
+    for (tag, _), response in zip(tags, query_result['responses']):
+        for item in response['hits']['hits']:
+            view_count = item['_source']['hot']
+            if view_count < 20000000:  # 热门视频的标准是观看数必须超过两千万
+                continue
+            video_map[item['_id']] = log10(view_count)
+            video_tags.setdefault(item['_id'], tag or '')
+    return video_map, video_tags
+
+
+class HotVideoPool(object):
+
+    def __init__(self, redis_key, tags, refresh_interval=3600, retry_interval=60):
+        """
+        Args:
+            redis_key (str): 热门视频在redis中的key
+            tags (list): (标签, 个数)列表
+            refresh_interval (int): 重新查询es的间隔(秒)
+            retry_interval (int): 没有加载到热门视频时, 多久之后再试(秒)
+        """
+        self.redis_key = redis_key
+        self.tags = tags
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._retry_at = 0
+        self.tag_key = '{}|tag'.format(redis_key)
+        self.snapshot_path = hot_video_snapshot_path.format(redis_key)
+        self.videos = None
+        self.sampler = None
+        self._refresher_pid = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            if not self._load_snapshot() and not self._load_redis():
+                self._build_with_host_lock()
+        except Exception as e:
+            logger.exception('load hot videos {} failed: {}'.format(self.redis_key, e))
+        if self.videos is None:
+            # 不在每个请求里重试, 避免es出问题时所有请求都去查询es
+            self._retry_at = time.time() + self.retry_interval
+
+    def _should_load(self):
+        return self.videos is None and time.time() >= self._retry_at
+
+    def get_videos(self):
+        """获取热门视频, 第一次调用时加载, 当前进程第一次调用时启动后台刷新线程
+        没有加载到时返回空字典, retry_interval秒之后的调用会重新加载
+        """
+        if self._refresher_pid != os.getpid() or self._should_load():
+            with self._lock:
+                if self._should_load():
+                    self._load()
+                if self._refresher_pid != os.getpid():
+                    self._refresher_pid = os.getpid()
+                    self._start_refresher()
+        return self.videos or {}
+
+    def sample(self, count, exclude=None, quotas=None):
+        """按热度得分加权抽取不重复的热门视频
+
+        Args:
+            count (int): 个数
+            exclude (iterable): 不能抽到的视频id
+            quotas (dict): 标签 -> 个数, 不限标签的热门视频用空字符串
+        """
+        self.get_videos()
+        sampler = self.sampler
+        if sampler is None:
+            return []
+        return sampler.sample(count, exclude, quotas)
+
+    def _swap(self, videos, video_tags=None):
+        """整体替换热门视频和抽样表, 先建好抽样表再替换, 请求线程不会看到不一致的状态"""
+        video_tags = video_tags or {}
+        items = list(videos)
+        sampler = WeightedSampler(
+            items, [videos[x] for x in items], [video_tags.get(x, '') for x in items])
+        self.sampler = sampler
+        self.videos = videos
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = ujson.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if not snapshot or 'videos' not in snapshot:
+            return False
+        self._swap(snapshot['videos'], snapshot.get('tags'))
+        return True
+
+    def _save_snapshot(self, videos, video_tags):
+        tmp_path = '{}.{}'.format(self.snapshot_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                ujson.dump({'videos': videos, 'tags': video_tags}, f)
+            os.rename(tmp_path, self.snapshot_path)
+        except IOError as e:
+            logger.warning('save hot video snapshot failed: {}'.format(e))
+
+    def _load_redis(self):
+        pipe = redis_client.pipeline()
+        pipe.zrangebyscore(self.redis_key, '-inf', '+inf', withscores=True)
+        pipe.hgetall(self.tag_key)
+        videos, video_tags = pipe.execute()
+        if not videos:
+            return False
+
+        videos = {key.decode('utf8'): value for key, value in videos}
+        video_tags = {key.decode('utf8'): value.decode('utf8') for key, value in video_tags.items()}
+        self._swap(videos, video_tags)
+        self._save_snapshot(videos, video_tags)
+        return True
+
+    def _rebuild(self):
+        """查询es并整体替换redis中的热门视频"""
+        videos, video_tags = query_hot_videos(self.tags)
+        if not videos:
+            return
+
+        zset_args = []
+        for key, value in videos.items():
+            zset_args.append(value)
+            zset_args.append(key)
+        pipe = redis_client.pipeline()
+        pipe.delete(self.redis_key, self.tag_key)
+        pipe.zadd(self.redis_key, *zset_args)
+        pipe.hmset(self.tag_key, video_tags)
+        pipe.execute()
+
+    def _build_with_host_lock(self):
+        """redis中没有热门视频时, 同一台机器上只有一个进程查询es"""
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        with open('{}.lock'.format(self.snapshot_path), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not self._load_redis():
+                    self._rebuild()
+                    self._load_redis()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """拿到集群锁的进程重新查询es, 所有进程从redis重新加载"""
+        lock_key = '{}|lock'.format(self.redis_key)
+        if redis_client.set(lock_key, 1, ex=self.refresh_interval, nx=True):
+            self._rebuild()
+        self._load_redis()
+
+    def _start_refresher(self):
+        def run():
+            while True:
+                # 加随机量, 避免所有进程同时刷新
+                time.sleep(self.refresh_interval / 6.0 * random.uniform(0.8, 1.2))
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.exception(e)
+
+        thread = threading.Thread(target=run, name='hot-video-refresher')
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""推荐列表的redis lua脚本
+
+脚本在redis服务端原子执行, 多个worker同时处理同一个设备时不会互相覆盖结果
+"""
+from recommend.models import redis_client
+from recommend.tools.lazy import LazyObject
+from recommend.algorithm.video.seen_filter import (
+    seen_filter_bits,
+    seen_filter_hashes,
+)
+
+# 已推荐视频过滤器, 和 seen_filter.py 中的实现一致
+# KEYS[2]: 当前窗口的过滤器, KEYS[3]: 上一个窗口的过滤器
+SEEN_FILTER_LUA = """
+local seen_bits = SEEN_FILTER_BITS
+local seen_hashes = SEEN_FILTER_HASHES
+
+local function seen_offsets(video)
+    local h1, h2 = 0, 0
+    for i = 1, #video do
+        local byte = string.byte(video, i)
+        h1 = (h1 * 257 + byte) % 2147483629
+        h2 = (h2 * 131 + byte) % 2147483587
+    end
+    h2 = h2 % (seen_bits - 1) + 1
+    local offsets = {}
+    for i = 0, seen_hashes - 1 do
+        offsets[i + 1] = (h1 + i * h2) % seen_bits
+    end
+    return offsets
+end
+
+local function is_seen(video)
+    local offsets = seen_offsets(video)
+    for k = 2, 3 do
+        local found = true
+        for _, offset in ipairs(offsets) do
+            if redis.call('GETBIT', KEYS[k], offset) == 0 then
+                found = false
+                break
+            end
+        end
+        if found then
+            return true
+        end
+    end
+    return false
+end
+
+local function mark_seen(video)
+    for _, offset in ipairs(seen_offsets(video)) do
+        redis.call('SETBIT', KEYS[2], offset, 1)
+    end
+end
+""".replace('SEEN_FILTER_BITS', str(seen_filter_bits)).replace(
+    'SEEN_FILTER_HASHES', str(seen_filter_hashes))
+
+
+# 增量更新推荐列表, 推荐列表里只有待推荐视频
+# KEYS[1]: 设备推荐列表
+# KEYS[2], KEYS[3]: 当前窗口和上一个窗口的已推荐过滤器
+# ARGV[1]: 过滤器的过期时间
+# ARGV[2]: 推荐列表的过期时间
+# ARGV[3]: 最多推荐视频个数
+# ARGV[4]: 种子视频个数n
+# ARGV[5...4+n]: 种子视频id
+# ARGV[5+n...]: 候选视频id, 不在推荐列表中时的分值, 已在推荐列表中时的增量, ...
+# 返回当前窗口过滤器里为1的位数(用来监控过滤器的填充程度), 设备没有推荐列表和过滤器时不更新, 返回-1
+UPDATE_RECOMMEND_LUA = SEEN_FILTER_LUA + """
+local key = KEYS[1]
+if redis.call('EXISTS', key) == 0 and redis.call('EXISTS', KEYS[2]) == 0
+        and redis.call('EXISTS', KEYS[3]) == 0 then
+    return -1
+end
+
+local seed_count = tonumber(ARGV[4])
+for i = 5, 4 + seed_count do
+    redis.call('ZREM', key, ARGV[i])
+    mark_seen(ARGV[i])
+end
+if seed_count > 0 then
+    redis.call('EXPIRE', KEYS[2], ARGV[1])
+end
+for i = 5 + seed_count, #ARGV, 3 do
+    if not is_seen(ARGV[i]) then
+        if redis.call('ZADD', key, 'NX', ARGV[i + 1], ARGV[i]) == 0 then
+            redis.call('ZINCRBY', key, ARGV[i + 2], ARGV[i])
+        end
+    end
+end
+
+-- 得分小于0的视频不会被推荐(包括旧数据里用负分记录的已推荐视频)
+redis.call('ZREMRANGEBYSCORE', key, '-inf', '(0')
+local recommending = redis.call('ZCARD', key)
+local max_recommending = tonumber(ARGV[3])
+if recommending > max_recommending then
+    redis.call('ZREMRANGEBYRANK', key, 0, recommending - max_recommending - 1)
+end
+if recommending > 0 then
+    redis.call('EXPIRE', key, ARGV[2])
+end
+return redis.call('BITCOUNT', KEYS[2])
+"""
+
+update_recommend_script = LazyObject(lambda: redis_client.register_script(UPDATE_RECOMMEND_LUA))
+
+# 取出推荐视频, 从推荐列表中删除并写入已推荐过滤器
+# 推荐列表为空时用热门视频填充, 跳过已推荐过的视频
+# 没有传热门视频时返回0, 调用方带上热门视频再调用一次, 推荐列表不为空时不用每次都传热门视频
+# KEYS[1]: 设备推荐列表
+# KEYS[2], KEYS[3]: 当前窗口和上一个窗口的已推荐过滤器
+# ARGV[1]: 推荐视频个数
+# ARGV[2]: 过滤器的过期时间
+# ARGV[3]: 填充后推荐列表的过期时间
+# ARGV[4...]: 用于填充的热门视频id
+POP_RECOMMEND_LUA = SEEN_FILTER_LUA + """
+local key = KEYS[1]
+local size = tonumber(ARGV[1])
+local videos = redis.call('ZREVRANGEBYSCORE', key, '+inf', 0, 'LIMIT', 0, size)
+
+if #videos > 0 then
+    redis.call('ZREM', key, unpack(videos))
+elseif #ARGV == 3 then
+    return 0
+else
+    redis.call('DEL', key)
+    local zset_args = {}
+    for i = 4, #ARGV do
+        if not is_seen(ARGV[i]) then
+            if #videos < size then
+                table.insert(videos, ARGV[i])
+            else
+                table.insert(zset_args, 1.0)
+                table.insert(zset_args, ARGV[i])
+            end
+        end
+    end
+    if #zset_args > 0 then
+        redis.call('ZADD', key, unpack(zset_args))
+        redis.call('EXPIRE', key, ARGV[3])
+    end
+end
+
+if #videos > 0 then
+    for _, video in ipairs(videos) do
+        mark_seen(video)
+    end
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return videos
+"""
+
+pop_recommend_script = LazyObject(lambda: redis_client.register_script(POP_RECOMMEND_LUA))
+
+
+# 把设备的行为缓存到合并窗口里, 返回需要提交更新任务的设备序号(从1开始)
+# 每个设备的标记不存在时才提交任务, 任务丢失时标记会过期, 之后的行为会重新提交任务
+# KEYS[2i-1]: 设备i缓存的行为, KEYS[2i]: 设备i已经提交任务的标记
+# ARGV[1]: 合并窗口(秒)
+# ARGV[2...]: 每个设备依次是 行为个数, 行为1, 行为2...
+COALESCE_EVENTS_LUA = """
+local window = tonumber(ARGV[1])
+local scheduled = {}
+local pos = 2
+for i = 1, #KEYS / 2 do
+    local count = tonumber(ARGV[pos])
+    local events_key = KEYS[2 * i - 1]
+    redis.call('RPUSH', events_key, unpack(ARGV, pos + 1, pos + count))
+    redis.call('EXPIRE', events_key, window * 10)
+    if redis.call('SET', KEYS[2 * i], 1, 'EX', window * 3, 'NX') then
+        table.insert(scheduled, i)
+    end
+    pos = pos + count + 1
+end
+return scheduled
+"""
+
+coalesce_events_script = LazyObject(lambda: redis_client.register_script(COALESCE_EVENTS_LUA))
+
+
+def needs_fill(result):
+    """POP_RECOMMEND_LUA 的结果是否表示推荐列表为空, 需要带上热门视频重新调用"""
+    return not isinstance(result, list)
+
+
+def popped_videos(result):
+    """POP_RECOMMEND_LUA 的结果转换成视频id列表
+    带上热门视频之后仍然返回0(热门视频池为空或者没有加载到)时没有可推荐的视频, 返回空列表
+    """
+    if needs_fill(result):
+        return []
+    return [x.decode('utf8') for x in result]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""推荐列表的打分和截断
+
+视频id用字典编号成整数下标, 得分放在numpy数组里, 累加和合并都是按下标的向量化操作
+截断只需要得分最高的k个, 用argpartition代替全排序
+"""
+from itertools import repeat
+
+import numpy as np
+
+
+def _object_array(items):
+    array = np.empty(len(items), dtype=object)
+    array[:] = items
+    return array
+
+
+def collect_scores(similar_maps, weights, exclude=None):
+    """合并多个种子视频的相似视频得分
+    增量是各个种子视频 权重 * log10(播放量) 之和
+    分值是第一次出现时的 log10(播放量) 加上之后各次出现的增量
+
+    Args:
+        similar_maps (list): 每个种子视频的相似视频, 视频id -> 播放量
+        weights (list): 每个种子视频的操作权重
+        exclude (list): 不作为候选的视频id
+
+    Returns:
+        (视频id数组, 不在推荐列表中时的分值数组, 已在推荐列表中时的增量数组)
+    """
+    keys, hots, row_weights = [], [], []
+    for weight, video_map in zip(weights, similar_maps):
+        keys.extend(video_map.keys())
+        hots.extend(video_map.values())
+        row_weights.append(np.full(len(video_map), weight, dtype=np.float64))
+    if not keys:
+        return _object_array([]), np.empty(0), np.empty(0)
+
+    # 每个视频编号为第一次出现的位置, 倒序建字典时先出现的位置会覆盖后出现的
+    size = len(keys)
+    vocab = dict(zip(reversed(keys), range(size - 1, -1, -1)))
+    codes = np.fromiter(map(vocab.__getitem__, keys), np.int64, size)
+    first = np.flatnonzero(codes == np.arange(size))
+    if exclude:
+        first = first[~np.isin(first, [vocab[x] for x in exclude if x in vocab])]
+
+    values = np.log10(np.array(hots, dtype=np.float64))
+    contrib = np.concatenate(row_weights) * values
+    incr = np.bincount(codes, weights=contrib, minlength=size)[first]
+    init = incr + values[first] - contrib[first]
+    return _object_array(keys)[first], init, incr
+
+
+def merge_scores(list_ids, list_scores, ids, init, incr, drop=None, new_excluded=None):
+    """把候选视频合并进推荐列表
+    已在列表中的视频加上增量, 不在列表中的视频用分值加入
+
+    Args:
+        list_ids (list): 推荐列表中的视频id, 不能重复
+        list_scores (list): 推荐列表中的得分
+        ids (array): 候选视频id, 不能重复
+        init (array): 候选视频不在推荐列表中时的分值
+        incr (array): 候选视频已在推荐列表中时的增量
+        drop (list): 从推荐列表中删除的视频id, 候选视频里不能有这些视频
+        new_excluded (list): 不在推荐列表中时不能加入的视频id
+
+    Returns:
+        (视频id数组, 得分数组)
+    """
+    size = len(list_ids)
+    vocab = dict(zip(list_ids, range(size)))
+    codes = np.fromiter(map(vocab.get, ids, repeat(-1)), np.int64, len(ids))
+    # 不在列表中的候选视频编号接在列表后面
+    in_list = codes >= 0
+    new_count = len(ids) - np.count_nonzero(in_list)
+    codes[~in_list] = np.arange(size, size + new_count)
+    merged_ids = np.concatenate([_object_array(list_ids), ids[~in_list]])
+    scores = np.zeros(len(merged_ids), dtype=np.float64)
+    scores[:size] = list_scores
+    present = np.zeros(len(merged_ids), dtype=bool)
+    present[:size] = True
+
+    if new_excluded:
+        new_excluded = set(new_excluded)
+        accept = in_list | ~np.fromiter((x in new_excluded for x in ids), bool, len(ids))
+        codes, in_list, init, incr = codes[accept], in_list[accept], init[accept], incr[accept]
+    scores[codes] = np.where(in_list, scores[codes] + incr, init)
+    present[codes] = True
+    present[[vocab[x] for x in drop or () if x in vocab]] = False
+    return merged_ids[present], scores[present]
+
+
+def top_k(ids, scores, k, min_score=0.0):
+    """选出得分不低于min_score的前k个视频, 结果不保证有序
+
+    Args:
+        ids (array): 视频id
+        scores (array): 得分
+        k (int): 个数
+        min_score (float): 最低得分
+    """
+    index = np.flatnonzero(scores >= min_score)
+    if len(index) > k:
+        index = index[np.argpartition(-scores[index], k - 1)[:k]]
+    return ids[index], scores[index]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""设备已推荐视频的过滤器
+
+推荐列表(zset)里只保存待推荐的视频, 推荐过和看过的视频记在按时间窗口轮换的Bloom过滤器里
+每个设备每个窗口一个redis字符串, 用SETBIT/GETBIT读写, 窗口过期后整个key自动删除
+判断时同时查当前窗口和上一个窗口, 所以推荐过的视频至少 seen_window 秒内不会重复推荐
+
+过滤器的大小按每个窗口的容量计算, 超过容量后误判率快速上升(容量的2倍时约5%), 好的候选视频会被当作推荐过而丢掉
+更新推荐列表时估算当前窗口的视频数, 记录在 recommend_seen_filter_items 里, 用来监控有多少设备超过容量
+
+lua脚本(lua.py)里有同样的哈希函数, 修改时两边必须一致
+"""
+import time
+from math import (
+    ceil,
+    log,
+)
+
+from prometheus_client import Histogram
+
+seen_filter_capacity = 2000  # 每个窗口的容量(视频数)
+seen_filter_error = 0.001  # 达到容量时的误判率
+# 位数 m = -n*ln(p)/ln(2)^2, 即28756位(约3.5KB); 哈希函数个数 k = m/n*ln(2), 即10个
+seen_filter_bits = int(ceil(-seen_filter_capacity * log(seen_filter_error) / log(2) ** 2))
+seen_filter_hashes = int(round(seen_filter_bits / float(seen_filter_capacity) * log(2)))
+seen_window = 7 * 86400  # 窗口长度(秒)
+
+seen_filter_items = Histogram(
+    'recommend_seen_filter_items',
+    'Estimated videos in the current seen filter window of a device',
+    buckets=(50, 100, 250, 500, 1000, 1500, 2000, 3000, 5000, float('inf')))
+
+# 两个多项式哈希的模数, 乘积不超过2^53, lua 5.1只有double也能精确计算
+_hash_mod1 = 2147483629
+_hash_mod2 = 2147483587
+
+
+def seen_keys(device, now=None):
+    """设备当前窗口和上一个窗口的过滤器key
+
+    Args:
+        device (str): 设备id
+        now (float): 当前时间戳
+    """
+    # key里带上位数, 修改容量后不会用新的哈希位置去读旧的过滤器
+    window = int((now or time.time()) // seen_window)
+    return [
+        'device|{}|seen|{}|{}'.format(device, seen_filter_bits, window),
+        'device|{}|seen|{}|{}'.format(device, seen_filter_bits, window - 1),
+    ]
+
+
+def seen_offsets(video_id):
+    """视频在过滤器中的位置, 用两个哈希值组合出 seen_filter_hashes 个位置
+
+    Args:
+        video_id (str): 视频id
+    """
+    h1, h2 = 0, 0
+    for byte in video_id.encode('utf8'):
+        h1 = (h1 * 257 + byte) % _hash_mod1
+        h2 = (h2 * 131 + byte) % _hash_mod2
+    h2 = h2 % (seen_filter_bits - 1) + 1
+    return [(h1 + i * h2) % seen_filter_bits for i in range(seen_filter_hashes)]
+
+
+def is_seen(bitmaps, video_id):
+    """判断视频是否推荐过
+
+    Args:
+        bitmaps (list): 当前和上一个窗口的过滤器, 即 mget(seen_keys(device)) 的结果
+        video_id (str): 视频id
+    """
+    offsets = seen_offsets(video_id)
+    for bitmap in bitmaps:
+        if not bitmap:
+            continue
+        # redis的第0位是第一个字节的最高位
+        if all(offset >> 3 < len(bitmap) and bitmap[offset >> 3] >> (7 - (offset & 7)) & 1
+               for offset in offsets):
+            return True
+    return False
+
+
+def estimate_items(bitmap):
+    """根据置位的比例估算过滤器里的视频数
+
+    Args:
+        bitmap (bytes): 过滤器, 为空表示没有视频
+    """
+    if not bitmap:
+        return 0
+    return estimate_bit_count(bin(int.from_bytes(bitmap, 'big')).count('1'))
+
+
+def estimate_bit_count(ones):
+    """根据为1的位数估算过滤器里的视频数: n = -m/k * ln(1 - X/m)
+
+    Args:
+        ones (int): 过滤器里为1的位数
+    """
+    if ones >= seen_filter_bits:
+        return float('inf')
+    return -seen_filter_bits / float(seen_filter_hashes) * log(1 - ones / float(seen_filter_bits))
+
+
+def observe_seen(bitmaps):
+    """合并推荐列表时记录当前窗口的视频数, 监控超过容量的设备
+
+    Args:
+        bitmaps (list): 当前和上一个窗口的过滤器
+    """
+    if bitmaps and bitmaps[0]:
+        seen_filter_items.observe(estimate_items(bitmaps[0]))
+
+
+def observe_seen_bits(ones):
+    """增量更新推荐列表时记录当前窗口的视频数, 为1的位数由lua脚本(UPDATE_RECOMMEND_LUA)返回
+
+    Args:
+        ones (int): 当前窗口过滤器里为1的位数, 没有过滤器时为0, 没有更新时为-1
+    """
+    if ones > 0:
+        seen_filter_items.observe(estimate_bit_count(ones))
+
+
+def mark_seen(pipe, device, video_ids):
+    """在pipeline中把视频写入设备当前窗口的过滤器
+
+    Args:
+        pipe (Pipeline): redis pipeline
+        device (str): 设备id
+        video_ids (list): 视频id列表
+    """
+    if not video_ids:
+        return
+
+    key = seen_keys(device)[0]
+    for video_id in video_ids:
+        for offset in seen_offsets(video_id):
+            pipe.setbit(key, offset, 1)
+    pipe.expire(key, seen_window * 2)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""离线计算好的相似视频表
+
+相似视频存在redis的hash中, 字段是视频id, 值是按相似度排好序的"视频id 播放量 视频id 播放量..."
+值为空字符串表示该视频没有相似视频
+"""
+import struct
+import hashlib
+from recommend.const import similar_video_key
+from recommend.models import redis_client
+
+similar_top_k = 20  # 每个视频保存的相似视频个数
+
+
+def encode_similar_videos(video_map):
+    """把相似视频编码成字符串
+
+    Args:
+        video_map (dict): 视频id -> 播放量, 按相似度排序
+    """
+    return ' '.join('{} {}'.format(key, value) for key, value in video_map.items())
+
+
+def decode_similar_videos(data, size=None):
+    """解码相似视频
+
+    Args:
+        data (bytes): 编码后的相似视频
+        size (int): 最多返回个数
+    """
+    items = data.decode('utf8').split()
+    if size is not None:
+        items = items[:size * 2]
+    return {items[i]: int(items[i + 1]) for i in range(0, len(items), 2)}
+
+
+similar_item = struct.Struct('<BQ')  # 视频id长度, 播放量
+
+
+def pack_similar_videos(video_map):
+    """把相似视频编码成紧凑的二进制, 每个视频是 1字节id长度 + 8字节播放量 + id
+
+    Args:
+        video_map (dict): 视频id -> 播放量
+    """
+    parts = []
+    for key, value in video_map.items():
+        key = key.encode('utf8')
+        parts.append(similar_item.pack(len(key), int(value)))
+        parts.append(key)
+    return b''.join(parts)
+
+
+def unpack_similar_videos(data):
+    """解码 pack_similar_videos 的结果
+
+    Args:
+        data (bytes): 编码后的相似视频
+    """
+    video_map = {}
+    offset, total = 0, len(data)
+    while offset < total:
+        length, value = similar_item.unpack_from(data, offset)
+        offset += similar_item.size
+        video_map[data[offset: offset + length].decode('utf8')] = value
+        offset += length
+    return video_map
+
+
+def tag_digest(tags):
+    """计算标签集合的摘要, 用于增量计算时判断标签是否变化
+
+    Args:
+        tags (set): 标签集合
+    """
+    return hashlib.md5(' '.join(sorted(tags)).encode('utf8')).hexdigest()[:16]
+
+
+def get_precomputed_similar_videos(video_id, size=10):
+    """查询离线计算好的相似视频, 没有计算过返回None
+
+    Args:
+        video_id (str): 视频id
+        size (int): 数量
+    """
+    if size > similar_top_k:
+        return
+
+    data = redis_client.hget(similar_video_key, video_id)
+    if data is None:
+        return
+    return decode_similar_videos(data, size)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""视频标签倒排索引
+
+索引目录下的文件:
+    vocab.json      标签 -> 倒排表编号
+    offsets.npy     每个标签的倒排表在postings中的起止位置
+    postings.npy    倒排表, 视频编号
+    weights.npy     倒排表中每个视频的BM25得分
+    videos.npy      视频编号 -> 视频id
+    hots.npy        视频编号 -> 播放量
+
+索引目录是指向实际数据目录的软链接, 重建时替换软链接, 正在使用旧索引的进程不受影响
+除vocab.json外都是mmap方式加载, 同一台机器上的所有进程共享一份内存
+打分方式与es的bool/should查询接近: 命中标签的BM25得分之和, 加上must里的range条件的常数1分
+"""
+import os
+import time
+import shutil
+from collections import Counter
+from math import log
+
+import numpy as np
+import ujson
+
+from recommend.const import tag_index_path
+
+k1, b = 1.2, 0.75    # es默认的BM25参数
+
+
+class TagIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'vocab.json'), 'r') as f:
+            self.vocab = ujson.load(f)
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.postings = np.load(os.path.join(path, 'postings.npy'), mmap_mode='r')
+        self.weights = np.load(os.path.join(path, 'weights.npy'), mmap_mode='r')
+        self.videos = np.load(os.path.join(path, 'videos.npy'), mmap_mode='r')
+        self.hots = np.load(os.path.join(path, 'hots.npy'), mmap_mode='r')
+
+    def query(self, tags, size=100, min_score=20.0):
+        """根据标签召回视频
+
+        Args:
+            tags (set): 标签集合
+            size (int): 视频个数
+            min_score (float): 最低得分
+        """
+        postings, weights = [], []
+        for tag in tags:
+            i = self.vocab.get(tag)
+            if i is None:
+                continue
+            begin, end = self.offsets[i], self.offsets[i + 1]
+            postings.append(self.postings[begin:end])
+            weights.append(self.weights[begin:end])
+
+        video_map = {}
+        if not postings:
+            return video_map
+
+        docs, inverse = np.unique(np.concatenate(postings), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)) + 1.0
+        matched = np.flatnonzero(scores >= min_score)
+        if len(matched) > size:
+            matched = matched[np.argpartition(-scores[matched], size - 1)[:size]]
+
+        for doc in docs[matched]:
+            video_map[self.videos[doc].decode('utf8')] = int(self.hots[doc])
+        return video_map
+
+
+def build_tag_index(docs, path):
+    """建立倒排索引
+
+    Args:
+        docs (iterable): (视频id, 标签集合, 播放量)序列
+        path (str): 索引目录
+    """
+    videos, hots, doc_tags = [], [], []
+    for video_id, tags, hot in docs:
+        videos.append(video_id)
+        hots.append(hot)
+        doc_tags.append(tags)
+
+    doc_count = len(videos)
+    avg_len = sum(len(x) for x in doc_tags) / float(doc_count or 1)
+    df = Counter(tag for tags in doc_tags for tag in tags)
+    vocab = {tag: i for i, tag in enumerate(sorted(df))}
+
+    # 标签都只计一次(tf=1), 得分只取决于idf和文档长度
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for tag, i in vocab.items():
+        offsets[i + 1] = df[tag]
+    offsets = np.cumsum(offsets)
+    postings = np.zeros(offsets[-1], dtype=np.int32)
+    weights = np.zeros(offsets[-1], dtype=np.float32)
+    cursor = offsets[:-1].copy()
+    for doc, tags in enumerate(doc_tags):
+        norm = k1 * (1 - b + b * len(tags) / avg_len)
+        for tag in tags:
+            i = vocab[tag]
+            idf = log(1 + (doc_count - df[tag] + 0.5) / (df[tag] + 0.5))
+            postings[cursor[i]] = doc
+            weights[cursor[i]] = idf * (k1 + 1) / (1 + norm)
+            cursor[i] += 1
+
+    data_path = '{}.{}'.format(path, int(time.time() * 1000))
+    os.makedirs(data_path)
+    with open(os.path.join(data_path, 'vocab.json'), 'w') as f:
+        ujson.dump(vocab, f)
+    np.save(os.path.join(data_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(data_path, 'postings.npy'), postings)
+    np.save(os.path.join(data_path, 'weights.npy'), weights)
+    np.save(os.path.join(data_path, 'videos.npy'), np.array(videos, dtype='S16'))
+    np.save(os.path.join(data_path, 'hots.npy'), np.array(hots, dtype=np.int64))
+    swap_index_link(data_path, path)
+
+
+def swap_index_link(data_path, path):
+    """把索引软链接指向新的数据目录, 保留上一个数据目录, 删除更早的数据目录
+    进程最多每隔check_interval秒才切换到新索引, 切换之前还在读上一个数据目录, 下一次重建时才删除
+
+    Args:
+        data_path (str): 新的数据目录, 即 索引软链接.时间戳
+        path (str): 索引软链接
+    """
+    old_path = os.path.realpath(path) if os.path.islink(path) else None
+    link_path = '{}.link'.format(data_path)
+    os.symlink(data_path, link_path)
+    os.rename(link_path, path)
+
+    keep = {os.path.realpath(data_path), old_path}
+    directory, name = os.path.split(os.path.abspath(path))
+    for item in os.listdir(directory):
+        prefix, _, suffix = item.rpartition('.')
+        item_path = os.path.join(directory, item)
+        if prefix == name and suffix.isdigit() and os.path.realpath(item_path) not in keep:
+            shutil.rmtree(item_path, ignore_errors=True)
+
+
+_tag_index = None
+_checked_at = 0
+
+
+def get_tag_index(check_interval=60):
+    """获取本地倒排索引, 索引不存在时返回None
+    每隔check_interval秒检查一次索引是否被重建
+
+    Args:
+        check_interval (int): 检查间隔(秒)
+    """
+    global _tag_index, _checked_at
+    now = time.time()
+    if now - _checked_at < check_interval:
+        return _tag_index
+
+    _checked_at = now
+    if not os.path.exists(tag_index_path):
+        _tag_index = None
+        return None
+
+    data_path = os.path.realpath(tag_index_path)
+    if _tag_index is None or _tag_index.path != data_path:
+        _tag_index = TagIndex(data_path)
+    return _tag_index
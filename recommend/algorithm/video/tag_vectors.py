@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""视频标签的TF-IDF向量和近似最近邻索引(倒排文件, IVF)
+
+标签集合和 _get_video_tag 一样来自 tokenize(标题, 标签), 每个标签只计一次,
+所以向量的每一维就是标签的idf, 再做L2归一化, 两个视频的相似度是向量的余弦
+离线用球面k-means把视频分成若干簇(见 recommend.jobs.build_tag_vectors),
+查询时先算和所有簇中心的相似度, 只在最接近的nprobe个簇里逐个计算余弦
+
+索引目录下的文件:
+    vocab.json          标签 -> 标签编号
+    idf.npy             标签编号 -> idf
+    center_offsets.npy  每个标签的簇中心倒排表在center_ids中的起止位置
+    center_ids.npy      簇中心倒排表, 簇编号
+    center_weights.npy  簇中心倒排表中的权重, 每个簇中心只保留权重最高的若干个标签
+    list_offsets.npy    每个簇的视频编号起止位置, 同一个簇的视频编号连续
+    indptr.npy          视频向量(CSR)每一行在indices中的起止位置
+    indices.npy         视频向量的标签编号
+    data.npy            视频向量的权重, 量化成uint8(乘以255)
+    videos.npy          视频编号 -> 视频id
+    hots.npy            视频编号 -> 播放量
+
+和tag_index一样, 索引目录是指向实际数据目录的软链接, 除vocab.json外都是mmap方式加载
+查询只用numpy, 建索引用到的scipy只在离线任务里导入
+"""
+import os
+import time
+
+import numpy as np
+import ujson
+
+from recommend.const import tag_vector_index_path
+
+default_nprobe = 8      # 默认查询的簇个数
+quantize_scale = 255.0  # 视频向量权重的量化倍数
+
+
+def _load(path):
+    """mmap方式加载数组, 去掉np.memmap子类, 切片时没有额外的python开销"""
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+class TagVectorIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'vocab.json'), 'r') as f:
+            self.vocab = ujson.load(f)
+        self.idf = _load(os.path.join(path, 'idf.npy'))
+        self.center_offsets = _load(os.path.join(path, 'center_offsets.npy'))
+        self.center_ids = _load(os.path.join(path, 'center_ids.npy'))
+        self.center_weights = _load(os.path.join(path, 'center_weights.npy'))
+        self.list_offsets = _load(os.path.join(path, 'list_offsets.npy'))
+        self.indptr = _load(os.path.join(path, 'indptr.npy'))
+        self.indices = _load(os.path.join(path, 'indices.npy'))
+        self.data = _load(os.path.join(path, 'data.npy'))
+        self.videos = _load(os.path.join(path, 'videos.npy'))
+        self.hots = _load(os.path.join(path, 'hots.npy'))
+
+    def vectorize(self, tags):
+        """计算标签集合的向量, 返回(按编号排序的标签编号数组, 归一化的权重数组), 没有已知标签时返回None
+
+        Args:
+            tags (set): 标签集合
+        """
+        terms = sorted(i for i in map(self.vocab.get, tags) if i is not None)
+        if not terms:
+            return None
+        terms = np.array(terms, dtype=np.int32)
+        weights = self.idf[terms].astype(np.float32)
+        weights /= np.sqrt(np.dot(weights, weights))
+        return terms, weights
+
+    def _probe(self, terms, weights, nprobe):
+        """和查询向量最接近的nprobe个簇"""
+        ids, contrib = [], []
+        for term, weight in zip(terms.tolist(), weights.tolist()):
+            begin, end = self.center_offsets[term], self.center_offsets[term + 1]
+            ids.append(self.center_ids[begin:end])
+            contrib.append(self.center_weights[begin:end] * weight)
+        ids = np.concatenate(ids)
+        if not len(ids):
+            return ids
+
+        scores = np.bincount(ids, weights=np.concatenate(contrib))
+        clusters = np.flatnonzero(scores > 0)
+        if len(clusters) > nprobe:
+            clusters = clusters[np.argpartition(-scores[clusters], nprobe - 1)[:nprobe]]
+        return clusters
+
+    def query(self, tags, size=100, exclude=None, min_similarity=0.1, nprobe=default_nprobe):
+        """查询和标签集合最相似的视频, 返回 视频id -> 播放量, 按相似度从高到低排列
+
+        Args:
+            tags (set): 标签集合
+            size (int): 视频个数
+            exclude (str): 不返回的视频id, 一般是查询的视频本身
+            min_similarity (float): 最低余弦相似度
+            nprobe (int): 查询的簇个数, 越大召回越准, 耗时也越长
+        """
+        video_map = {}
+        vector = self.vectorize(tags)
+        if vector is None:
+            return video_map
+        terms, weights = vector
+
+        # 候选视频是几个簇里的连续编号, 各自的向量在indices/data里也是连续的
+        docs, indices, data, row_starts = [], [], [], []
+        offset = 0
+        for cluster in self._probe(terms, weights, nprobe).tolist():
+            begin, end = self.list_offsets[cluster], self.list_offsets[cluster + 1]
+            if begin == end:
+                continue
+            ptr = self.indptr[begin:end + 1]
+            docs.append(np.arange(begin, end))
+            indices.append(self.indices[ptr[0]:ptr[-1]])
+            data.append(self.data[ptr[0]:ptr[-1]])
+            row_starts.append(ptr[:-1] - ptr[0] + offset)
+            offset += ptr[-1] - ptr[0]
+        if not docs:
+            return video_map
+
+        # 视频向量的每个标签在查询向量里二分查找, 没有的标签贡献为0
+        indices = np.concatenate(indices)
+        pos = np.minimum(np.searchsorted(terms, indices), len(terms) - 1)
+        contrib = np.where(terms[pos] == indices, weights[pos] * np.concatenate(data), 0)
+        scores = np.add.reduceat(contrib, np.concatenate(row_starts)) / quantize_scale
+        docs = np.concatenate(docs)
+
+        count = size + 1 if exclude else size
+        matched = np.flatnonzero(scores >= min_similarity)
+        if len(matched) > count:
+            matched = matched[np.argpartition(-scores[matched], count - 1)[:count]]
+        matched = matched[np.argsort(-scores[matched], kind='mergesort')]
+
+        for doc in docs[matched].tolist():
+            video_id = self.videos[doc].decode('utf8')
+            if video_id != exclude and len(video_map) < size:
+                video_map[video_id] = int(self.hots[doc])
+        return video_map
+
+
+_tag_vector_index = None
+_checked_at = 0
+
+
+def get_tag_vector_index(check_interval=60):
+    """获取本地标签向量索引, 索引不存在时返回None
+    每隔check_interval秒检查一次索引是否被重建
+
+    Args:
+        check_interval (int): 检查间隔(秒)
+    """
+    global _tag_vector_index, _checked_at
+    now = time.time()
+    if now - _checked_at < check_interval:
+        return _tag_vector_index
+
+    _checked_at = now
+    if not os.path.exists(tag_vector_index_path):
+        _tag_vector_index = None
+        return None
+
+    data_path = os.path.realpath(tag_vector_index_path)
+    if _tag_vector_index is None or _tag_vector_index.path != data_path:
+        _tag_vector_index = TagVectorIndex(data_path)
+    return _tag_vector_index
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""视频标签分词
+
+把视频的标题和标签切分成标签集合, 标点和emoji替换成空格后按空格切分
+纯ascii文本走预先编译好的转换表(CPython对ascii有快速路径), 其它文本先用正则去掉emoji再逐个替换标点
+"""
+import re
+from itertools import chain
+from recommend.algorithm.video import stop_words_set
+
+punctuations = ',|#@~\'"\\/_-[]+*{};:`=【】().’?'
+emoji_pattern = re.compile('[\U0001F300-\U0001F64F\U0001F680-\U0001F6FF☀-⭕]+')
+translate_table = str.maketrans({x: ' ' for x in punctuations})
+
+
+def _is_ascii(sentence):
+    """str.isascii在python3.7才有, 用encode判断, 同样走C实现"""
+    try:
+        sentence.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _split_words(sentence):
+    """小写化, 去掉标点和emoji, 按空格切分并去重
+
+    Args:
+        sentence (str): 文本
+    """
+    sentence = sentence.lower()
+    if _is_ascii(sentence):
+        sentence = sentence.translate(translate_table)
+    else:
+        sentence = emoji_pattern.sub(' ', sentence)
+        for x in punctuations:
+            sentence = sentence.replace(x, ' ')
+    return set(sentence.split(' '))
+
+
+def tokenize(title, tags=None):
+    """计算视频的标签集合
+
+    Args:
+        title (str): 视频标题
+        tags (list): 视频标签
+    """
+    words = _split_words(' '.join(chain(tags or (), (title,))))
+    return {x for x in words if 1 < len(x) <= 30} - stop_words_set
+
+
+def tokenize_batch(docs):
+    """批量计算视频的标签集合, 用于建索引
+
+    Args:
+        docs (iterable): (标题, 标签列表)序列
+    """
+    return [tokenize(title, tags) for title, tags in docs]
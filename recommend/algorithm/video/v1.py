@@ -5,15 +5,10 @@ youtube 视频第一版推荐算法
 召回环节通过比较标签相似度以及热门视频
 排序环境通过视频播放量进行排序
 """
-import re
 import time
-import random
-import requests
-from math import log10
 from recommend.models import (
     es_client,
     redis_client,
-    cache_region,
 )
 from recommend.const import (
     video_index,
@@ -22,13 +17,44 @@ from recommend.const import (
     Operation,
 )
 from recommend.algorithm.video import (
-    stop_words_set,
     get_video,
+    VideoPending,
 )
-from recommend.configure import PUBLISH_QUERY_URL
+from recommend.algorithm.video.tokenizer import tokenize
+from recommend.algorithm.video.hot_pool import HotVideoPool
+from recommend.algorithm.video.tag_index import get_tag_index
+from recommend.algorithm.video.tag_vectors import get_tag_vector_index
+from recommend.algorithm.video.crawler import video_crawler
+from recommend.algorithm.video.co_watch import get_co_watched_videos
+from recommend.algorithm.video.similar_table import (
+    get_precomputed_similar_videos,
+    pack_similar_videos,
+    unpack_similar_videos,
+)
+from recommend.algorithm.video.scoring import (
+    collect_scores,
+    merge_scores,
+    top_k,
+)
+from recommend.algorithm.video.seen_filter import (
+    seen_keys,
+    seen_window,
+    is_seen,
+    mark_seen,
+    observe_seen,
+    observe_seen_bits,
+)
+from recommend.algorithm.video.lua import (
+    update_recommend_script,
+    pop_recommend_script,
+    needs_fill,
+    popped_videos,
+)
+from recommend.tools.cache import RefreshingCache
+from recommend.tools.publish import publish_client
+from recommend.tools.trace import span
 
 
-emoji_pattern = re.compile('[\U0001F300-\U0001F64F\U0001F680-\U0001F6FF\u2600-\u2B55]+')
 video_operation_score = {
     Operation.watch: 0.1,
     Operation.collect: 0.2,
@@ -37,96 +63,44 @@ video_operation_score = {
     Operation.dislike: -0.5,
 }
 
+# 热门视频的(标签, 个数)
+hot_video_tags = [
+    (None, 100),
+    ('india', 100),
+    ('bollywood', 200),
+    ('series', 100),
+    ('funny', 300),
+    ('cricket', 100),
+    ('status', 100),
+]
+
 
 class VideoAlgorithmV1(object):
+    atomic_update = True  # 是否在redis服务端增量更新推荐列表
 
     def __init__(self):
-        self._session = requests.Session()
-        self.hot_videos = {}
-        self._load_hot_videos()
-
-    def query_publish_id(self, video_ids):
-        result_map = {}
-        if not video_ids:
-            return result_map
-
-        video_len = len(video_ids)
-        offset, limit = 0, 200
-        while offset < video_len:
-            s = video_ids[offset: offset + limit]
-            body = {
-                'resources': [{'res_type': 'video', 'res_id': x} for x in s]
-            }
-            res = self._session.post(PUBLISH_QUERY_URL, json=body).json()
-            if not res['data']:
-                break
-            for item in res['data']:
-                if not item['pub_ids']:
-                    continue
-                result_map[item['res_id']] = item['pub_ids'][0]
-
-            offset += limit
-        return result_map
-
-    def _load_hot_videos(self):
-        """加载热门视频"""
-        if redis_client.exists(hot_video_key1):
-            videos = redis_client.zrangebyscore(
-                hot_video_key1, '-inf', '+inf', withscores=True)
-            for key, value in videos:
-                self.hot_videos[key.decode('utf8')] = value
-        else:
-            self.hot_videos.update(self._get_hot_videos(size=100))
-            self.hot_videos.update(self._get_hot_videos(tag='india', size=100))
-            self.hot_videos.update(self._get_hot_videos(tag='bollywood', size=200))
-            self.hot_videos.update(self._get_hot_videos(tag='series', size=100))
-            self.hot_videos.update(self._get_hot_videos(tag='funny', size=300))
-            self.hot_videos.update(self._get_hot_videos(tag='cricket', size=100))
-            self.hot_videos.update(self._get_hot_videos(tag='status', size=100))
+        self.hot_pool = HotVideoPool(hot_video_key1, hot_video_tags)
+        # 相似视频缓存, 进程内缓存5分钟, redis缓存1小时, 没有相似视频的缓存10分钟
+        self.similar_cache = RefreshingCache(
+            'similar1', max_size=50000, ttl=300, redis_ttl=3600, negative_ttl=600,
+            dumps=pack_similar_videos, loads=unpack_similar_videos)
 
-            zset_args = []
-            for key, value in self.hot_videos.items():
-                zset_args.append(value)
-                zset_args.append(key)
-            redis_client.zadd(hot_video_key1, *zset_args)
+    @property
+    def hot_videos(self):
+        return self.hot_pool.get_videos()
 
     @staticmethod
-    def _get_hot_videos(tag=None, size=100):
-        """找到制定标签的热门视频
+    @span('query_publish_id', 'publish')
+    def query_publish_id(video_ids):
+        """查询视频的发布id
 
         Args:
-            tag (str): 标签
-            size (int): 个数
+            video_ids (list): 视频id列表
         """
-        query = {
-            'size': size,
-            'query': {
-                'bool': {
-                    'must': [
-                        {'term': {'type': 'mv'}},
-                        {'term': {'genre': 'youtube'}},
-                    ]
-                }
-            },
-            '_source': ['hot'],
-            'sort': [{"hot": {"order": "desc"}}]
-        }
-        if tag:
-            query['query']['bool']['must'].append({'term': {'tag': tag}})
-
-        query_result = es_client.search(video_index, video_type, body=query)
-        hits = query_result['hits']['hits']
-
-        video_map = {}
-        for item in hits:
-            id_ = item['_id']
-            view_count = item['_source']['hot']
-            if view_count < 20000000:  # 热门视频的标准是观看数必须超过两千万
-                continue
-            video_map[id_] = log10(view_count)
-        return video_map
+        return publish_client.query(video_ids)
 
     @staticmethod
+    @span('get_video_tag', 'mixed')
     def _get_video_tag(video_id):
         """从es中找到视频, 并计算视频的标签向量
 
@@ -134,47 +108,25 @@ class VideoAlgorithmV1(object):
             video_id (str): 视频id
         """
         source = get_video(video_id)
-        title = source['title']
-        video_tag = source.get('tag', [])
-        video_tag.append(title)
-        sentence = ' '.join(video_tag)
-        sentence = sentence.lower()
-        sentence = emoji_pattern.sub(' ', sentence)
-        sentence = sentence.replace(",", " ").replace("|", " ").replace("#", " "). \
-            replace("@", " ").replace("~", " ").replace("'", " ").replace("\"", " "). \
-            replace("\\", " ").replace("/", " ").replace("_", " ").replace("-", " "). \
-            replace("[", " ").replace("]", " ").replace("+", " ").replace("*", " "). \
-            replace("{", " ").replace("}", " ").replace(";", " ").replace(":", " "). \
-            replace("`", " ").replace("=", " ").replace("【", " ").replace("】", " "). \
-            replace("(", " ").replace(")", " ").replace(".", " ").replace("’", " "). \
-            replace("?", " ")
-        words = sentence.split(' ')
-
-        tags = set()
-        for word in words:
-            if not word:
-                continue
-
-            if len(word) == 1 or len(word) > 30:
-                continue
-
-            if word in stop_words_set:
-                continue
-
-            tags.add(word)
-        return tags
+        return tokenize(source['title'], source.get('tag'))
 
     @staticmethod
-    def _query_videos_by_tag(tags, size=100):
-        """根据标签在es中查询视频
+    def _query_videos_by_tag(tags, size=100, min_score=20.0):
+        """根据标签查询视频, 优先使用本地倒排索引, 没有索引时查询es
 
         Args:
             tags (set): 标签集合
             size (int): 视频个数
+            min_score (float): 最低得分
         """
         if not tags:
             return
 
+        tag_index = get_tag_index()
+        if tag_index is not None:
+            with span('query_videos_by_tag', 'tag_index'):
+                return tag_index.query(tags, size, min_score)
+
         query = {
             'size': size,
             'query': {
@@ -193,9 +145,10 @@ class VideoAlgorithmV1(object):
                 }
             },
             '_source': ['hot'],
-            'min_score': 20.0
+            'min_score': min_score
         }
-        query_result = es_client.search(video_index, video_type, body=query)
+        with span('query_videos_by_tag', 'es'):
+            query_result = es_client.search(video_index, video_type, body=query)
         hits = query_result['hits']['hits']
 
         video_map = {}
@@ -206,16 +159,37 @@ class VideoAlgorithmV1(object):
                 video_map[id_] = hot
         return video_map
 
-    @cache_region.cache_on_arguments(expiration_time=3600)
     def get_similar_videos(self, video_id, size=10):
-        """根据标签获取相似的视频(如果没有,则返回热门视频)
+        """根据标签获取相似的视频(如果没有,则返回热门视频), 先查缓存
+
+        Args:
+            video_id (str): 视频id
+            size (int): 数量
+        """
+        return self.similar_cache.get_or_create(
+            '{} {}'.format(video_id, size), self._compute_similar_videos, video_id, size)
+
+    def _compute_similar_videos(self, video_id, size):
+        """计算相似视频, 按顺序使用第一个可用的来源:
+        离线计算的相似视频表(similar_table) -> 标签向量索引(tag_vectors) -> 标签倒排索引(tag_index) -> es
+        相似视频表里有这个视频时不会查询向量索引, 向量索引只在表里没有的视频上生效
 
         Args:
             video_id (str): 视频id
             size (int): 数量
         """
+        with span('precomputed_similar_videos', 'redis'):
+            video_map = get_precomputed_similar_videos(video_id, size)
+        if video_map is not None:
+            return video_map
+
         try:
             tags = self._get_video_tag(video_id)
+        except VideoPending:
+            if not video_crawler.is_failed(video_id):
+                # 视频还没爬取, 不能缓存结果
+                raise
+            tags = None
         except:
             # 从youtube爬到视频信息出异常
             tags = None
@@ -223,6 +197,12 @@ class VideoAlgorithmV1(object):
         if not tags:
             return
 
+        # 相似视频表里没有这个视频时, 有标签向量索引就按TF-IDF余弦相似度召回
+        tag_vector_index = get_tag_vector_index()
+        if tag_vector_index is not None:
+            with span('query_videos_by_tag', 'tag_vectors'):
+                return tag_vector_index.query(tags, size, exclude=video_id)
+
         video_map = self._query_videos_by_tag(tags, size)
         if video_id in video_map:
             video_map.pop(video_id)
@@ -236,80 +216,185 @@ class VideoAlgorithmV1(object):
             video (str): 视频id
             operation (int): 操作类型
         """
-        device_key = 'device|{}|recommend'.format(device)
-        recommend_list = redis_client.zrangebyscore(
-            device_key, '-inf', '+inf', withscores=True, start=0, num=1000)
-        if not recommend_list:
-            return
+        return self.update_recommend_events(device, [(video, operation)])
 
-        video_map = self.get_similar_videos(video, 16)
-        if not video_map:
-            return
+    def update_recommend_events(self, device, events):
+        """针对用户一段时间内的多个行为一次性更新推荐列表, 多个种子视频的得分累加
+        返回种子视频还没爬取的(视频id, 操作类型)列表, 这些行为等视频爬取之后再更新
 
-        recommend_map = {key.decode('utf8'): value for key, value in recommend_list}
-        recommend_map[video] = (time.time() - 2147483647) / 200000000
-        for key, value in video_map.items():
-            if key in recommend_map:
-                recommend_map[key] += video_operation_score[operation] * log10(value)
-            else:
-                recommend_map[key] = log10(value)
-
-        recommend_list = sorted(recommend_map.items(), key=lambda kv: kv[1], reverse=True)
-        recommending, recommended = 0, 0
-        zset_args = []
-        for key, value in recommend_list:
-            if value > 0:
-                if recommending >= 500:   # 一个用户最多有500个推荐视频
-                    continue
+        Args:
+            device (str): 设备id
+            events (list): (视频id, 操作类型)列表, 按发生顺序排列
+        """
+        if self.atomic_update:
+            return self._incr_recommend_list(device, events)
+        return self._merge_recommend_list(device, events)
 
-                zset_args.append(value)
-                zset_args.append(key)
-                recommending += 1
-            else:
-                if recommended >= 500:    # 最近500条视频不重复
-                    continue
+    def _collect_candidates(self, events):
+        """计算种子视频和候选视频的得分
+        候选视频是(视频id数组, 不在推荐列表中时的分值数组, 已在推荐列表中时的增量数组)
+        种子视频不在es中的行为放到pending里返回
+
+        Args:
+            events (list): (视频id, 操作类型)列表
+        """
+        seeds, similar_maps, weights, pending = [], [], [], []
+        for video, operation in events:
+            try:
+                video_map = self.get_similar_videos(video, 16)
+            except VideoPending:
+                pending.append((video, operation))
+                continue
+
+            # 协同过滤的相似视频补充到标签相似视频里
+            with span('co_watched_videos', 'co_watch'):
+                co_watched = get_co_watched_videos(video, 16)
+            if co_watched:
+                video_map = dict(video_map or {})
+                for key, value in co_watched.items():
+                    video_map.setdefault(key, value)
+            if not video_map:
+                continue
+
+            seeds.append(video)
+            similar_maps.append(video_map)
+            weights.append(video_operation_score[operation])
+
+        with span('collect_scores'):
+            candidates = collect_scores(similar_maps, weights, exclude=seeds)
+        return seeds, candidates, pending
+
+    def _incr_recommend_list(self, device, events):
+        """在redis服务端增量更新推荐列表, 只写入变化的视频
+
+        Args:
+            device (str): 设备id
+            events (list): (视频id, 操作类型)列表
+        """
+        device_key = 'device|{}|recommend'.format(device)
+        keys = [device_key] + seen_keys(device)
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        with span('recommend_list.check', 'redis'):
+            exists = pipe.execute()
+        if not any(exists):
+            return []
+
+        seeds, candidates, pending = self._collect_candidates(events)
+        if not seeds:
+            return pending
+
+        ids, init, incr = candidates
+        args = [seen_window * 2, 2592000, 500, len(seeds)] + seeds
+        for item in zip(ids.tolist(), init.tolist(), incr.tolist()):
+            args.extend(item)
+        with span('recommend_list.incr', 'redis'):
+            ones = update_recommend_script(keys=keys, args=args)
+        observe_seen_bits(ones)
+        return pending
+
+    def _merge_recommend_list(self, device, events):
+        """读出整个推荐列表, 合并后重写
 
+        Args:
+            device (str): 设备id
+            events (list): (视频id, 操作类型)列表
+        """
+        device_key = 'device|{}|recommend'.format(device)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrangebyscore(device_key, 0, '+inf', withscores=True, start=0, num=1000)
+        pipe.mget(seen_keys(device))
+        with span('recommend_list.read', 'redis'):
+            recommend_list, seen_bitmaps = pipe.execute()
+        if not recommend_list and not any(seen_bitmaps):
+            return []
+
+        seeds, candidates, pending = self._collect_candidates(events)
+        if not seeds:
+            return pending
+
+        ids, init, incr = candidates
+        with span('recommend_list.merge'):
+            observe_seen(seen_bitmaps)
+            seen = [x for x in ids.tolist() if is_seen(seen_bitmaps, x)]
+            list_ids, list_scores = merge_scores(
+                [key.decode('utf8') for key, _ in recommend_list],
+                [value for _, value in recommend_list],
+                ids, init, incr, drop=seeds, new_excluded=seen)
+
+            # 一个用户最多有500个推荐视频
+            list_ids, list_scores = top_k(list_ids, list_scores, 500)
+            zset_args = []
+            for key, value in zip(list_ids.tolist(), list_scores.tolist()):
                 zset_args.append(value)
                 zset_args.append(key)
-                recommended += 1
 
-        redis_client.delete(device_key)
-        redis_client.zadd(device_key, *zset_args)
+        pipe = redis_client.pipeline()
+        pipe.delete(device_key)
+        if zset_args:
+            pipe.zadd(device_key, *zset_args)
+            pipe.expire(device_key, 2592000)
+        mark_seen(pipe, device, seeds)
+        with span('recommend_list.write', 'redis'):
+            pipe.execute()
+        return pending
+
+    def pop_recommend_request(self, device, size, now=None, fill=False):
+        """取推荐视频的lua脚本(POP_RECOMMEND_LUA)的(keys, args), 同步和asyncio版本共用
+        推荐列表为空时脚本返回0(见 needs_fill), 再用 fill=True 带上热门视频调用一次
+
+        Args:
+            device (str): 设备id
+            size (int): 个数
+            now (float): 当前时间戳
+            fill (bool): 是否带上用于填充推荐列表的热门视频
+        """
+        device_key = 'device|{}|recommend'.format(device)
+        video_ids = self.hot_pool.sample(200) if fill else []
+        return [device_key] + seen_keys(device, now), [size, seen_window * 2, 2592000] + video_ids
 
     def get_recommend_videos(self, device, size):
         """获取推荐视频数据
+        在redis服务端一次取出推荐视频, 从推荐列表中删除并记入已推荐过滤器, 防止重复推荐
+        推荐列表为空时, 同一次调用里用按热度加权抽取的热门视频填充, 跳过已推荐过的视频
 
         Args:
             device (str): 设备id
             size (int): 个数
         """
-        device_key = 'device|{}|recommend'.format(device)
-        recommend_list = redis_client.zrevrangebyscore(
-            device_key, min=0, max='+inf', withscores=True, start=0, num=size)
-        recommend_list = [x[0].decode('utf8') for x in recommend_list]
-
-        # 推荐列表为空
-        if not recommend_list:
-            redis_client.delete(device_key)
-            video_ids = random.sample(self.hot_videos.keys(), 200)
-            recommend_videos = video_ids[:size]
-            zset_args = []
-            for video in video_ids[size:]:
-                zset_args.append(1.0)
-                zset_args.append(video)
-            redis_client.zadd(device_key, *zset_args)
-            redis_client.expire(device_key, 2592000)
-        else:
-            recommend_videos = recommend_list
-
-        # 把推荐过的权值换成当前时间戳的负值,防止重复推荐
-        zset_args = []
-        score = (time.time() - 2147483647) / 200000000
-        for video in recommend_videos:
-            zset_args.append(score)
-            zset_args.append(video)
-        redis_client.zadd(device_key, *zset_args)
-        return recommend_videos
+        keys, args = self.pop_recommend_request(device, size)
+        with span('recommend_list.pop', 'redis'):
+            recommend_videos = pop_recommend_script(keys=keys, args=args)
+            if needs_fill(recommend_videos):
+                keys, args = self.pop_recommend_request(device, size, fill=True)
+                recommend_videos = pop_recommend_script(keys=keys, args=args)
+        return popped_videos(recommend_videos)
+
+    def batch_get_recommend_videos(self, devices):
+        """批量获取多个设备的推荐视频数据, 所有设备在一次pipeline中完成
+
+        Args:
+            devices (list): (设备id, 个数)列表
+        """
+        now = time.time()
+        pipe = redis_client.pipeline(transaction=False)
+        for device, size in devices:
+            keys, args = self.pop_recommend_request(device, size, now)
+            pop_recommend_script(keys=keys, args=args, client=pipe)
+        with span('recommend_list.batch_pop', 'redis'):
+            results = pipe.execute()
+
+            # 推荐列表为空的设备带上热门视频再取一次
+            empty = [i for i, videos in enumerate(results) if needs_fill(videos)]
+            if empty:
+                for i in empty:
+                    device, size = devices[i]
+                    keys, args = self.pop_recommend_request(device, size, now, fill=True)
+                    pop_recommend_script(keys=keys, args=args, client=pipe)
+                for i, videos in zip(empty, pipe.execute()):
+                    results[i] = videos
+        return [popped_videos(videos) for videos in results]
 
 
 algorithm1 = VideoAlgorithmV1()
@@ -1,8 +1,8 @@
 # -*- coding: utf8 -*-
 """celery配置"""
-from recommend.configure import AMQP_URL
+from recommend import configure
 
-broker_url = AMQP_URL
+broker_url = configure.get('AMQP_URL')
 
 imports = (
     'recommend.tasks',
@@ -10,3 +10,8 @@ imports = (
 
 task_serializer = 'pickle'
 accept_content = ['pickle', 'json']
+
+# 爬取视频很慢, 放到单独的队列, 由固定并发数的worker处理, 不阻塞推荐更新
+task_routes = {
+    'recommend.tasks.crawl_video': {'queue': 'crawl'},
+}
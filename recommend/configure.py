@@ -1,32 +1,102 @@
 # -*- coding: utf-8 -*-
-"""参数配置"""
+"""参数配置
+
+配置项在第一次使用时才从consul读取, 读取成功的值缓存到本地文件, consul不可用时使用本地缓存
+使用方式: from recommend import configure; configure.get('REDIS_URL')
+"""
 import os
+import logging
+import threading
 import consul
 import ujson
+from recommend.tools.lazy import lazy_property
 
 CONSUL_HOST = '172.31.23.5'
 CONSUL_PORT = 8500
 CONSUL_PREFIX = 'service/recommend/production'
+CONSUL_CACHE_PATH = '/data/recommend/consul_cache.json'
+
+logger = logging.getLogger('recommend.file')
 
 
 class ConfigHandler(object):
     """配置基类"""
 
-    def __init__(self, host, port, prefix):
+    def __init__(self, host, port, prefix, cache_path=None):
+        self.host = host
+        self.port = port
         self.prefix = prefix
-        self.client = consul.Consul(host=host, port=port)
+        self.cache_path = cache_path
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @lazy_property
+    def client(self):
+        return consul.Consul(host=self.host, port=self.port)
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                return ujson.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_cache(self, key, value):
+        cache = self._load_cache()
+        if cache.get(key) == value:
+            return
+
+        cache[key] = value
+        tmp_path = '{}.{}'.format(self.cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                ujson.dump(cache, f)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError) as e:
+            logger.warning('save consul cache failed: {}'.format(e))
 
     def get(self, key):
-        param_key = os.path.join(self.prefix, key)
-        _, val = self.client.kv.get(param_key)
-        value = val['Value']
-        return value.decode('utf8')
+        value = self._values.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            try:
+                param_key = os.path.join(self.prefix, key)
+                _, val = self.client.kv.get(param_key)
+                value = val['Value'].decode('utf8')
+            except Exception as e:
+                if not self.cache_path:
+                    raise
+                value = self._load_cache().get(key)
+                if value is None:
+                    raise
+                logger.warning('read {} from consul failed, use local cache: {}'.format(key, e))
+            else:
+                if self.cache_path:
+                    self._save_cache(key, value)
+            self._values[key] = value
+        return value
+
+config_handler = ConfigHandler(CONSUL_HOST, CONSUL_PORT, CONSUL_PREFIX, CONSUL_CACHE_PATH)
+
+# 配置项 -> 解析函数
+config_parsers = {
+    'MYSQL_URL': str,
+    'REDIS_URL': str,
+    'AMQP_URL': str,
+    'ES_HOSTS': ujson.loads,
+    'PUBLISH_QUERY_URL': str,
+}
 
-config_handler = ConfigHandler(CONSUL_HOST, CONSUL_PORT, CONSUL_PREFIX)
 
+def get(name):
+    """读取并解析配置项, 第一次读取时才访问consul
 
-MYSQL_URL = config_handler.get('MYSQL_URL')
-REDIS_URL = config_handler.get('REDIS_URL')
-AMQP_URL = config_handler.get('AMQP_URL')
-ES_HOSTS = ujson.loads(config_handler.get('ES_HOSTS'))
-PUBLISH_QUERY_URL = config_handler.get('PUBLISH_QUERY_URL')
+    Args:
+        name (str): 配置项名称, 见 config_parsers
+    """
+    if name not in config_parsers:
+        raise KeyError('unknown config: {}'.format(name))
+    return config_parsers[name](config_handler.get(name))
@@ -7,6 +7,17 @@ video_type = 'doc'
 hot_video_key1 = 'hot_video_zset1'
 hot_video_key2 = 'hot_video_zset2'
 
+similar_video_key = 'similar_video_hash'
+similar_digest_key = 'similar_digest_hash'
+
+tag_index_path = '/data/recommend/tag_index'
+tag_vector_index_path = '/data/recommend/tag_vectors'
+co_watch_path = '/data/recommend/co_watch'
+behavior_snapshot_path = '/data/recommend/behavior'
+hot_video_snapshot_path = '/data/recommend/{}.json'
+
+behavior_coalesce_window = 10  # 同一设备的行为合并成一个任务的时间窗口(秒), 0表示不合并
+
 
 class ReturnCode(object):
     """返回码"""
@@ -20,3 +31,13 @@ class Operation(object):
     share = 3
     star = 4
     dislike = 5
+
+
+# 接口接受的操作类型, 推荐算法按操作类型取权重(video_operation_score), 其它值不能进入任务
+valid_operations = frozenset((
+    Operation.watch,
+    Operation.collect,
+    Operation.share,
+    Operation.star,
+    Operation.dislike,
+))
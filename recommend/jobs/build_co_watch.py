@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""从video_behavior计算视频的协同过滤相似视频(item-item), 查询见 recommend.algorithm.video.co_watch
+
+    python -m recommend.jobs.build_co_watch [--days 90] [--top 50] [--processes 8] [--shards 32]
+
+1. 按设备顺序流式读取行为, 设备对每个视频的权重是各次操作得分(video_operation_score)之和,
+   每攒够chunk_devices个设备, 把这部分 设备 x 视频 的稀疏矩阵A写到临时目录
+2. 视频按编号分成shards份, 进程池里每个任务读取所有分块, 计算一份视频和所有视频的共现 A[:, 份].T * A,
+   每个进程的内存只和一份视频的共现对数有关, 和行为总条数无关
+3. 共现除以两个视频权重向量的范数得到余弦相似度, 至少min_devices个设备共同操作过才计算,
+   每个视频只保留最相似的top个可推荐视频
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from multiprocessing import (
+    Pool,
+    cpu_count,
+)
+
+import numpy as np
+from scipy import sparse
+from elasticsearch.helpers import scan
+
+from recommend.const import (
+    video_index,
+    video_type,
+    co_watch_path,
+)
+from recommend.models import es_client
+from recommend.models.video_model import VideoBehavior
+from recommend.algorithm.video.v1 import video_operation_score
+from recommend.algorithm.video.tag_index import swap_index_link
+from recommend.jobs.build_tag_index import eligible_query
+
+
+def scan_eligible_hots():
+    """扫描可推荐的视频, 返回 视频id -> 播放量"""
+    query = dict(eligible_query, _source=['hot'])
+    hots = {}
+    for item in scan(es_client, query=query, index=video_index, doc_type=video_type, size=1000):
+        hots[item['_id']] = item['_source']['hot']
+    return hots
+
+
+def _grow(array, size):
+    return np.concatenate([array, np.zeros(size - len(array), dtype=array.dtype)])
+
+
+class ChunkWriter(object):
+    """把按设备顺序的行为写成 设备 x 视频 的稀疏矩阵分块, 同时给视频编号
+
+    Args:
+        path (str): 分块目录
+        chunk_devices (int): 每个分块的设备个数
+        max_videos (int): 每个设备最多取最近操作的多少个视频, 避免个别设备产生太多共现对
+    """
+
+    def __init__(self, path, chunk_devices=100000, max_videos=500):
+        self.path = path
+        self.chunk_devices = chunk_devices
+        self.max_videos = max_videos
+        self.video_ids = {}                            # 视频id -> 编号
+        self.chunks = []                               # 分块文件
+        self.squares = np.zeros(0, dtype=np.float64)   # 视频编号 -> 权重平方和
+        self.devices = np.zeros(0, dtype=np.int64)     # 视频编号 -> 操作过的设备数
+        self._reset()
+
+    def _reset(self):
+        self._indptr, self._indices, self._data = [0], [], []
+
+    def add_device(self, events):
+        """加入一个设备的所有行为
+
+        Args:
+            events (iterable): (视频id, 操作类型)序列, 按时间顺序
+        """
+        weights = {}
+        for video, operation in events:
+            # 重新插入, 字典的顺序是每个视频最后一次操作的顺序
+            weights[video] = weights.pop(video, 0.0) + video_operation_score.get(operation, 0.0)
+
+        items = []
+        for video, weight in list(weights.items())[-self.max_videos:]:
+            if weight:
+                items.append((self.video_ids.setdefault(video, len(self.video_ids)), weight))
+        if len(items) < 2:
+            return
+
+        items.sort()
+        self._indices.extend(x for x, _ in items)
+        self._data.extend(x for _, x in items)
+        self._indptr.append(len(self._indices))
+        if len(self._indptr) > self.chunk_devices:
+            self.flush()
+
+    def flush(self):
+        if len(self._indptr) == 1:
+            return
+        indices = np.array(self._indices, dtype=np.int32)
+        data = np.array(self._data, dtype=np.float32)
+        size = len(self.video_ids)
+        self.squares = _grow(self.squares, size)
+        self.squares += np.bincount(indices, weights=data.astype(np.float64) ** 2, minlength=size)
+        self.devices = _grow(self.devices, size)
+        self.devices += np.bincount(indices, minlength=size)
+
+        path = os.path.join(self.path, 'chunk{:05d}.npz'.format(len(self.chunks)))
+        np.savez(path, indptr=np.array(self._indptr, dtype=np.int64), indices=indices, data=data)
+        self.chunks.append(path)
+        self._reset()
+
+
+def load_chunk(path, columns):
+    """读取一个分块, 列数补齐到所有视频的个数, 权重转成float64, 累加结果和分块的顺序无关"""
+    with np.load(path) as f:
+        return sparse.csr_matrix(
+            (f['data'].astype(np.float64), f['indices'], f['indptr']), shape=(len(f['indptr']) - 1, columns))
+
+
+def shard_neighbours(task):
+    """计算编号在[begin, end)之间的视频的相似视频, 结果写到output, 返回output
+
+    Args:
+        task (tuple): (分块文件列表, begin, end, 参数文件, top, min_devices, output)
+    """
+    chunks, begin, end, params_path, top, min_devices, output = task
+    with np.load(params_path) as f:
+        norms, eligible = f['norms'], f['eligible']
+    columns = len(norms)
+
+    cooccur = counts = None
+    for path in chunks:
+        matrix = load_chunk(path, columns)
+        part = matrix.tocsc()[:, begin:end].T.tocsr()
+        chunk_cooccur = part.dot(matrix)
+        part.data[:] = 1
+        matrix.data[:] = 1
+        chunk_counts = part.dot(matrix)
+        cooccur = chunk_cooccur if cooccur is None else cooccur + chunk_cooccur
+        counts = chunk_counts if counts is None else counts + chunk_counts
+
+    rows = cols = values = np.zeros(0)
+    if cooccur is not None:
+        pairs = cooccur.multiply(counts >= min_devices).tocoo()
+        rows, cols = pairs.row, pairs.col
+        values = pairs.data / (norms[rows + begin] * norms[cols])
+        keep = eligible[cols] & (cols != rows + begin) & (values > 0)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+        # 每一行按相似度从高到低排列(相同时按编号), 只保留前top个
+        order = np.lexsort((cols, -values, rows))
+        rows, cols, values = rows[order], cols[order], values[order]
+        starts = np.zeros(end - begin, dtype=np.int64)
+        starts[1:] = np.cumsum(np.bincount(rows, minlength=end - begin))[:-1]
+        keep = np.arange(len(rows)) - starts[rows] < top
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+    np.savez(output, rows=(rows + begin).astype(np.int64), cols=cols.astype(np.int32),
+             scores=values.astype(np.float32))
+    return output
+
+
+def split_shards(devices, shards):
+    """按操作过的设备数把视频编号分成计算量接近的几份, 返回各份的边界"""
+    total = np.cumsum(devices)
+    bounds = np.searchsorted(total, np.linspace(0, total[-1], shards + 1)[1:-1], side='right')
+    return np.unique(np.concatenate([[0], bounds, [len(devices)]]))
+
+
+def build_co_watch(rows, hots, path, top=50, min_devices=2, max_videos=500,
+                   chunk_devices=100000, shards=None, processes=None):
+    """计算协同过滤相似视频
+
+    Args:
+        rows (iterable): (设备id, 视频id, 操作类型)序列, 同一个设备的行为连续, 按时间顺序
+        hots (dict): 可推荐的视频id -> 播放量, 只有这些视频会作为相似视频
+        path (str): 结果目录
+        top (int): 每个视频保留的相似视频个数
+        min_devices (int): 至少几个设备共同操作过
+        max_videos (int): 每个设备最多取最近操作的多少个视频
+        chunk_devices (int): 每个分块的设备个数
+        shards (int): 视频分成几份计算, 不指定时是进程数的4倍
+        processes (int): 进程数
+    """
+    processes = processes or cpu_count()
+    shards = shards or processes * 4
+    work_dir = tempfile.mkdtemp(prefix='co_watch-')
+    try:
+        writer = ChunkWriter(work_dir, chunk_devices, max_videos)
+        for _, events in groupby(rows, key=itemgetter(0)):
+            writer.add_device((video, operation) for _, video, operation in events)
+        writer.flush()
+
+        video_ids = sorted(writer.video_ids, key=writer.video_ids.get)
+        video_hots = np.array([hots.get(x, 0) for x in video_ids], dtype=np.int64)
+        params_path = os.path.join(work_dir, 'params.npz')
+        np.savez(params_path, norms=np.sqrt(writer.squares), eligible=np.array(
+            [x in hots for x in video_ids], dtype=bool))
+
+        tasks = []
+        if video_ids:
+            bounds = split_shards(writer.devices, shards)
+            for i, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+                tasks.append((writer.chunks, int(begin), int(end), params_path, top, min_devices,
+                              os.path.join(work_dir, 'shard{:05d}.npz'.format(i))))
+
+        pool = Pool(processes)
+        rows, cols, scores = [], [], []
+        for output in pool.imap(shard_neighbours, tasks):
+            with np.load(output) as f:
+                rows.append(f['rows'])
+                cols.append(f['cols'])
+                scores.append(f['scores'])
+        pool.close()
+        pool.join()
+
+        # 视频按id排序, 查询时二分查找
+        ids = np.array(video_ids, dtype='S16')
+        order = np.argsort(ids, kind='mergesort')
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        rows = position[np.concatenate(rows)] if rows else np.zeros(0, dtype=np.int64)
+        cols = position[np.concatenate(cols)] if cols else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        pair_order = np.lexsort((-scores, rows))
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows, minlength=len(ids)))
+
+        data_path = '{}.{}'.format(path, int(time.time() * 1000))
+        os.makedirs(data_path)
+        np.save(os.path.join(data_path, 'videos.npy'), ids[order])
+        np.save(os.path.join(data_path, 'offsets.npy'), offsets)
+        np.save(os.path.join(data_path, 'neighbours.npy'), cols[pair_order].astype(np.int32))
+        np.save(os.path.join(data_path, 'scores.npy'), scores[pair_order])
+        np.save(os.path.join(data_path, 'hots.npy'), video_hots[order])
+        swap_index_link(data_path, path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--days', type=int, default=90, help='使用最近多少天的行为')
+    arg_parser.add_argument('--top', type=int, default=50, help='每个视频保留的相似视频个数')
+    arg_parser.add_argument('--min-devices', type=int, default=2, help='至少几个设备共同操作过')
+    arg_parser.add_argument('--max-videos', type=int, default=500, help='每个设备最多取最近的多少个视频')
+    arg_parser.add_argument('--chunk-devices', type=int, default=100000, help='每个分块的设备个数')
+    arg_parser.add_argument('--shards', type=int, help='视频分成几份计算, 默认是进程数的4倍')
+    arg_parser.add_argument('--processes', type=int, default=cpu_count())
+    args = arg_parser.parse_args()
+
+    build_co_watch(VideoBehavior.scan_by_device(args.days), scan_eligible_hots(), co_watch_path,
+                   args.top, args.min_devices, args.max_videos, args.chunk_devices,
+                   args.shards, args.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""离线计算可推荐视频的相似视频, 写入redis
+
+增量计算时只重新计算以下视频, --full 重新计算所有视频:
+    1. 标签变化过的视频和新视频
+    2. 相似视频里有标签变化过或者不再可推荐的视频
+    3. 超过max_age天没有重新计算的视频, 新视频进入其它视频的相似视频、播放量变化只能靠这一条更新
+不再可推荐的视频从相似视频表中删除
+
+    python -m recommend.jobs.build_similar_videos [--top 100000] [--full] [--max-age 7] [--processes 8]
+"""
+import time
+import heapq
+import argparse
+from itertools import islice
+from multiprocessing import (
+    Pool,
+    cpu_count,
+)
+from elasticsearch.helpers import scan
+from recommend.const import (
+    video_index,
+    video_type,
+    similar_video_key,
+    similar_digest_key,
+)
+from recommend.models import (
+    es_client,
+    redis_client,
+)
+from recommend.algorithm.video.tokenizer import tokenize
+from recommend.algorithm.video.v1 import VideoAlgorithmV1
+from recommend.algorithm.video.similar_table import (
+    similar_top_k,
+    encode_similar_videos,
+    decode_similar_videos,
+    tag_digest,
+)
+from recommend.jobs.build_tag_index import eligible_query
+
+
+def scan_videos(top=None):
+    """扫描可推荐的视频, 返回(视频id, 标签集合, 播放量)序列
+
+    Args:
+        top (int): 只取播放量最高的top个视频
+    """
+    query = dict(eligible_query, _source=['title', 'tag', 'hot'])
+    docs = []
+    for item in scan(es_client, query=query, index=video_index,
+                     doc_type=video_type, size=1000):
+        source = item['_source']
+        tags = tokenize(source['title'], source.get('tag'))
+        if tags:
+            docs.append((item['_id'], tags, source['hot']))
+
+    if top:
+        docs = heapq.nlargest(top, docs, key=lambda x: x[2])
+    return docs
+
+
+def compute_similar_videos(item):
+    """计算一个视频的相似视频
+
+    Args:
+        item (tuple): (视频id, 标签集合)
+    """
+    video_id, tags = item
+    video_map = VideoAlgorithmV1._query_videos_by_tag(tags, similar_top_k + 1) or {}
+    video_map.pop(video_id, None)
+    video_map = dict(islice(video_map.items(), similar_top_k))
+    return video_id, encode_similar_videos(video_map)
+
+
+def parse_digest(value):
+    """解析摘要表中的值 "摘要 计算时间", 返回(摘要, 计算时间)"""
+    digest, _, built_at = value.decode('utf8').partition(' ')
+    return digest, int(built_at or 0)
+
+
+def plan_updates(docs, digests, neighbours, now, max_age, full=False):
+    """选出需要重新计算的视频和需要删除的视频, 返回(待计算的(视频id, 标签集合)列表, 待删除的视频id集合)
+
+    Args:
+        docs (list): (视频id, 标签集合, 播放量)列表, 当前可推荐的视频
+        digests (dict): 视频id -> (摘要, 计算时间), 上次计算的结果
+        neighbours (callable): 返回(视频id, 编码后的相似视频)序列, 只在有视频变化时调用
+        now (int): 当前时间戳
+        max_age (int): 超过多少秒重新计算
+        full (bool): 是否重新计算所有视频
+    """
+    current = {video_id: tag_digest(tags) for video_id, tags, _ in docs}
+    removed = set(digests) - set(current)
+    changed = {x for x, digest in current.items() if digests.get(x, (None,))[0] != digest}
+
+    stale = set()
+    if not full and (changed or removed):
+        dirty = changed | removed
+        for video_id, data in neighbours():
+            if dirty.intersection(decode_similar_videos(data)):
+                stale.add(video_id.decode('utf8'))
+
+    todo = []
+    for video_id, tags, _ in docs:
+        if full or video_id in changed or video_id in stale or now - digests[video_id][1] > max_age:
+            todo.append((video_id, tags))
+    return todo, removed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--top', type=int, help='只计算播放量最高的视频')
+    arg_parser.add_argument('--full', action='store_true', help='重新计算所有视频')
+    arg_parser.add_argument('--max-age', type=int, default=7, help='超过多少天重新计算')
+    arg_parser.add_argument('--processes', type=int, default=cpu_count())
+    args = arg_parser.parse_args()
+
+    # 在访问es和redis之前fork, 子进程各自创建连接, 不会共用父进程的keep-alive连接
+    pool = Pool(args.processes)
+
+    digests = {}
+    for key, value in redis_client.hscan_iter(similar_digest_key, count=1000):
+        digests[key.decode('utf8')] = parse_digest(value)
+
+    now = int(time.time())
+    docs = scan_videos(args.top)
+    todo, removed = plan_updates(
+        docs, digests, lambda: redis_client.hscan_iter(similar_video_key, count=1000),
+        now, args.max_age * 86400, args.full)
+    new_digests = {video_id: tag_digest(tags) for video_id, tags in todo}
+
+    pipe = redis_client.pipeline(transaction=False)
+    removed = list(removed)
+    for i in range(0, len(removed), 1000):
+        pipe.hdel(similar_video_key, *removed[i: i + 1000])
+        pipe.hdel(similar_digest_key, *removed[i: i + 1000])
+    results = pool.imap_unordered(compute_similar_videos, todo, chunksize=100)
+    for i, (video_id, data) in enumerate(results, 1):
+        pipe.hset(similar_video_key, video_id, data)
+        pipe.hset(similar_digest_key, video_id, '{} {}'.format(new_digests[video_id], now))
+        if i % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+    pool.close()
+    pool.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""从es中扫描可推荐的视频, 建立本地标签倒排索引
+
+    python -m recommend.jobs.build_tag_index
+"""
+from elasticsearch.helpers import scan
+from recommend.const import (
+    video_index,
+    video_type,
+    tag_index_path,
+)
+from recommend.models import es_client
+from recommend.algorithm.video.tokenizer import tokenize
+from recommend.algorithm.video.tag_index import build_tag_index
+
+# 与 _query_videos_by_tag 的过滤条件一致
+eligible_query = {
+    'query': {
+        'bool': {
+            'filter': [
+                {'term': {'type': 'mv'}},
+                {'term': {'genre': 'youtube'}},
+                {'range': {'runtime': {'lte': 600}}},
+                {'term': {'status': 1}},
+                {'range': {'hot': {'gt': 100000}}},
+            ]
+        }
+    },
+    '_source': ['tag', 'hot'],
+}
+
+
+def scan_eligible_videos():
+    """扫描可推荐的视频, 返回(视频id, 标签集合, 播放量)序列"""
+    for item in scan(es_client, query=eligible_query, index=video_index,
+                     doc_type=video_type, size=1000):
+        source = item['_source']
+        tags = tokenize('', source.get('tag'))
+        if tags:
+            yield item['_id'], tags, source['hot']
+
+
+def main():
+    build_tag_index(scan_eligible_videos(), tag_index_path)
+
+
+if __name__ == '__main__':
+    main()
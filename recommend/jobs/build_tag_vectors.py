@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""从es中扫描可推荐的视频, 建立标签TF-IDF向量的近似最近邻索引
+索引格式和查询方式见 recommend.algorithm.video.tag_vectors
+
+    python -m recommend.jobs.build_tag_vectors [--clusters 4000] [--center-terms 64] [--min-df 2]
+
+簇中心用球面k-means在抽样的视频上训练, 再把所有视频分到最接近的簇
+簇个数默认是视频个数平方根的4倍, 每个簇平均几百个视频
+"""
+import os
+import time
+import argparse
+from math import (
+    log,
+    sqrt,
+)
+from collections import Counter
+
+import numpy as np
+import ujson
+from scipy import sparse
+
+from recommend.const import tag_vector_index_path
+from recommend.algorithm.video.tag_index import swap_index_link
+from recommend.algorithm.video.tag_vectors import quantize_scale
+from recommend.jobs.build_similar_videos import scan_videos
+
+
+def normalize_rows(matrix):
+    """CSR矩阵的每一行做L2归一化(原地修改)"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr)).astype(matrix.dtype)
+    return matrix
+
+
+def truncate_rows(matrix, k):
+    """CSR矩阵的每一行只保留最大的k个元素"""
+    indptr, indices, data = [0], [], []
+    for i in range(matrix.shape[0]):
+        begin, end = matrix.indptr[i], matrix.indptr[i + 1]
+        row_indices, row_data = matrix.indices[begin:end], matrix.data[begin:end]
+        if end - begin > k:
+            top = np.argpartition(-row_data, k - 1)[:k]
+            row_indices, row_data = row_indices[top], row_data[top]
+        indices.append(row_indices)
+        data.append(row_data)
+        indptr.append(indptr[-1] + len(row_indices))
+    return sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), np.array(indptr)), shape=matrix.shape)
+
+
+def tfidf_matrix(docs, min_df=2):
+    """计算视频的TF-IDF向量, 每个标签只计一次, 只在一个视频里出现的标签不参与相似度计算
+
+    Args:
+        docs (iterable): (视频id, 标签集合, 播放量)序列
+        min_df (int): 标签至少出现在几个视频里
+
+    Returns:
+        (标签 -> 标签编号, idf数组, 行归一化的CSR矩阵, 视频id列表, 播放量列表)
+    """
+    docs = list(docs)
+    df = Counter(tag for _, tags, _ in docs for tag in tags)
+    vocab = {tag: i for i, tag in enumerate(sorted(x for x, count in df.items() if count >= min_df))}
+    idf = np.zeros(len(vocab), dtype=np.float32)
+    for tag, i in vocab.items():
+        idf[i] = log((1.0 + len(docs)) / (1.0 + df[tag])) + 1.0
+
+    videos, hots, indices, indptr = [], [], [], [0]
+    for video_id, tags, hot in docs:
+        terms = sorted(vocab[x] for x in tags if x in vocab)
+        if not terms:
+            continue
+        videos.append(video_id)
+        hots.append(hot)
+        indices.extend(terms)
+        indptr.append(len(indices))
+
+    indices = np.array(indices, dtype=np.int32)
+    matrix = sparse.csr_matrix(
+        (idf[indices], indices, np.array(indptr, dtype=np.int64)), shape=(len(videos), len(vocab)))
+    return vocab, idf, normalize_rows(matrix), videos, hots
+
+
+def assign_clusters(matrix, centers, chunk_size=2000):
+    """把每个视频分到余弦相似度最高的簇, 和所有簇中心都不相交的视频按编号平均分到各个簇
+
+    Args:
+        matrix (csr_matrix): 视频向量
+        centers (csr_matrix): 簇中心
+        chunk_size (int): 每次计算的视频个数, 限制中间结果的内存
+    """
+    centers_t = centers.T.tocsr()
+    count = matrix.shape[0]
+    labels = np.empty(count, dtype=np.int32)
+    for begin in range(0, count, chunk_size):
+        end = min(begin + chunk_size, count)
+        sims = matrix[begin:end].dot(centers_t).toarray()
+        chunk_labels = sims.argmax(axis=1)
+        orphans = np.flatnonzero(sims[np.arange(end - begin), chunk_labels] <= 0)
+        chunk_labels[orphans] = (begin + orphans) % centers.shape[0]
+        labels[begin:end] = chunk_labels
+    return labels
+
+
+def train_centers(matrix, clusters, center_terms=64, iterations=10, sample_size=200000, seed=1):
+    """球面k-means训练簇中心, 簇中心只保留权重最高的center_terms个标签
+
+    Args:
+        matrix (csr_matrix): 行归一化的视频向量
+        clusters (int): 簇个数
+        center_terms (int): 每个簇中心保留的标签个数
+        iterations (int): 迭代次数
+        sample_size (int): 训练用的视频个数
+        seed (int): 随机种子
+    """
+    rng = np.random.RandomState(seed)
+    if matrix.shape[0] > sample_size:
+        matrix = matrix[np.sort(rng.choice(matrix.shape[0], sample_size, replace=False))]
+    count = matrix.shape[0]
+    clusters = min(clusters, count)
+
+    centers = truncate_rows(matrix[rng.choice(count, clusters, replace=False)], center_terms)
+    for _ in range(iterations):
+        labels = assign_clusters(matrix, normalize_rows(centers))
+        members = sparse.csr_matrix(
+            (np.ones(count, dtype=matrix.dtype), (labels, np.arange(count))), shape=(clusters, count))
+        centers = members.dot(matrix).tocsr()
+
+        # 空的簇换成随机抽取的视频
+        empty = np.flatnonzero(np.diff(centers.indptr) == 0)
+        if len(empty):
+            rows = np.arange(clusters)
+            rows[empty] = clusters + np.arange(len(empty))
+            reseed = matrix[rng.choice(count, len(empty), replace=False)]
+            centers = sparse.vstack([centers, reseed]).tocsr()[rows]
+        centers = truncate_rows(centers, center_terms)
+    return normalize_rows(centers)
+
+
+def build_tag_vector_index(docs, path, clusters=None, center_terms=64, min_df=2, iterations=10):
+    """建立标签向量索引
+
+    Args:
+        docs (iterable): (视频id, 标签集合, 播放量)序列
+        path (str): 索引目录
+        clusters (int): 簇个数, 不指定时是视频个数平方根的4倍
+        center_terms (int): 每个簇中心保留的标签个数
+        min_df (int): 标签至少出现在几个视频里
+        iterations (int): k-means迭代次数
+    """
+    vocab, idf, matrix, videos, hots = tfidf_matrix(docs, min_df)
+    clusters = clusters or max(1, int(round(4 * sqrt(len(videos)))))
+    centers = train_centers(matrix, clusters, center_terms, iterations)
+    labels = assign_clusters(matrix, centers)
+
+    # 同一个簇的视频编号连续
+    order = np.argsort(labels, kind='mergesort')
+    matrix = matrix[order]
+    list_offsets = np.zeros(centers.shape[0] + 1, dtype=np.int64)
+    list_offsets[1:] = np.cumsum(np.bincount(labels, minlength=centers.shape[0]))
+    centers_by_term = centers.tocsc()
+    centers_by_term.sort_indices()
+
+    data_path = '{}.{}'.format(path, int(time.time() * 1000))
+    os.makedirs(data_path)
+    with open(os.path.join(data_path, 'vocab.json'), 'w') as f:
+        ujson.dump(vocab, f)
+    arrays = {
+        'idf': idf,
+        'center_offsets': centers_by_term.indptr.astype(np.int64),
+        'center_ids': centers_by_term.indices.astype(np.int32),
+        'center_weights': centers_by_term.data.astype(np.float32),
+        'list_offsets': list_offsets,
+        'indptr': matrix.indptr.astype(np.int64),
+        'indices': matrix.indices.astype(np.int32),
+        'data': np.maximum(1, np.round(matrix.data * quantize_scale)).astype(np.uint8),
+        'videos': np.array(videos, dtype='S16')[order],
+        'hots': np.array(hots, dtype=np.int64)[order],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(data_path, '{}.npy'.format(name)), array)
+    swap_index_link(data_path, path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--clusters', type=int, help='簇个数')
+    arg_parser.add_argument('--center-terms', type=int, default=64, help='每个簇中心保留的标签个数')
+    arg_parser.add_argument('--min-df', type=int, default=2, help='标签至少出现在几个视频里')
+    arg_parser.add_argument('--iterations', type=int, default=10, help='k-means迭代次数')
+    args = arg_parser.parse_args()
+
+    build_tag_vector_index(scan_videos(), tag_vector_index_path, args.clusters,
+                           args.center_terms, args.min_df, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
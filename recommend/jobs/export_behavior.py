@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""把video_behavior增量导出成按天分区的列式快照, 格式和读取方式见 recommend.models.behavior_snapshot
+
+每次从上次导出的id之后开始读, 只导出今天之前的完整日期, 适合每天凌晨运行一次
+
+    python -m recommend.jobs.export_behavior [--path /data/recommend/behavior] [--until 2018-07-10]
+"""
+import time
+import logging
+import argparse
+import datetime
+
+from recommend.const import behavior_snapshot_path
+from recommend.models.video_model import VideoBehavior
+from recommend.models.behavior_snapshot import BehaviorSnapshotWriter
+
+logger = logging.getLogger('recommend.file')
+
+
+def export_behavior(path=behavior_snapshot_path, until=None, batch_size=100000):
+    """增量导出行为, 返回导出的条数
+
+    Args:
+        path (str): 快照目录
+        until (date): 只导出这一天之前的行为, 默认是今天
+        batch_size (int): 每次查询的条数
+    """
+    writer = BehaviorSnapshotWriter(path)
+    rows = VideoBehavior.stream_since(writer.last_id, batch_size)
+    try:
+        return writer.export(rows, until)
+    finally:
+        rows.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--path', default=behavior_snapshot_path, help='快照目录')
+    arg_parser.add_argument('--until', help='只导出这一天之前的行为(YYYY-MM-DD), 默认是今天')
+    arg_parser.add_argument('--batch-size', type=int, default=100000, help='每次查询的条数')
+    args = arg_parser.parse_args()
+
+    until = datetime.datetime.strptime(args.until, '%Y-%m-%d').date() if args.until else None
+    start = time.time()
+    count = export_behavior(args.path, until, args.batch_size)
+    logger.info('exported {} behaviors in {:.1f}s'.format(count, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
-"""数据库连接"""
-from dogpile.cache import make_region
+"""数据库连接
+
+所有连接都在第一次使用时才创建
+"""
+import threading
+from dogpile.cache.region import CacheRegion
 from elasticsearch import Elasticsearch
 from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import DisconnectionError
 from sqlalchemy.engine import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from recommend.configure import (
-    MYSQL_URL,
-    REDIS_URL,
-    ES_HOSTS,
-)
+from recommend import configure
+from recommend.tools.lazy import LazyObject
 
 
 def checkout_listener(dbapi_con, con_record, con_proxy):
@@ -26,18 +27,37 @@ def checkout_listener(dbapi_con, con_record, con_proxy):
         else:
             raise
 
+
+def _create_db_engine():
+    engine = create_engine(configure.get('MYSQL_URL'), pool_size=100, pool_recycle=3600)
+    event.listen(engine, 'checkout', checkout_listener)
+    return engine
+
+
+class LazyCacheRegion(CacheRegion):
+    """第一次读写缓存时才配置redis后端, 可以在配置之前用 cache_on_arguments 装饰函数"""
+
+    _configure_lock = threading.Lock()
+
+    def __getattribute__(self, name):
+        if name in ('backend', 'actual_backend') and 'backend' not in self.__dict__:
+            with LazyCacheRegion._configure_lock:
+                if 'backend' not in self.__dict__:
+                    self.configure(
+                        'dogpile.cache.redis',
+                        arguments={
+                            'url': configure.get('REDIS_URL'),
+                            'redis_expiration_time': 86400,
+                        },
+                        expiration_time=300,
+                    )
+        return super(LazyCacheRegion, self).__getattribute__(name)
+
+
 BaseModel = declarative_base()
-db_engine = create_engine(MYSQL_URL, pool_size=100, pool_recycle=3600)
-event.listen(db_engine, 'checkout', checkout_listener)
+db_engine = LazyObject(_create_db_engine)
 DBSession = sessionmaker(bind=db_engine, expire_on_commit=False)
 
-es_client = Elasticsearch(ES_HOSTS)
-cache_region = make_region().configure(
-    'dogpile.cache.redis',
-    arguments={
-        'url': REDIS_URL,
-        'redis_expiration_time': 86400,
-    },
-    expiration_time=300,
-)
-redis_client = cache_region.actual_backend.client
+es_client = LazyObject(lambda: Elasticsearch(configure.get('ES_HOSTS')))
+cache_region = LazyCacheRegion()
+redis_client = LazyObject(lambda: cache_region.actual_backend.client)
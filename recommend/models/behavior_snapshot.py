@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""video_behavior按天导出的列式快照, 离线任务直接mmap读取, 不用查询线上mysql
+
+目录结构:
+    meta.json               导出进度: 最后导出的id, 下一个要导出的日期, 两个字符串表的条数
+    devices.bin             设备id表, 每条32字节定长, 编号就是在表中的位置
+    videos.bin              视频id表, 每条16字节定长
+    days/2018-07-01/        一天的行为, 每列一个npy文件, 行按id顺序
+        device.npy          设备编号 uint32
+        video.npy           视频编号 uint32
+        operation.npy       操作类型 uint8
+        seconds.npy         当天0点起的秒数 uint32
+
+只导出完整的天(导出时刻之前的日期), 增量导出只追加新的天, 字符串表只追加新的id
+写入顺序是 字符串表 -> 当天目录(先写临时目录再改名) -> meta.json, meta.json之后的内容在下次导出时清理重写
+"""
+import os
+import json
+import shutil
+import datetime
+
+import numpy as np
+
+device_width = 32   # 和 VideoBehavior.device 的长度一致
+video_width = 16    # 和 VideoBehavior.video 的长度一致
+columns = ('device', 'video', 'operation', 'seconds')
+
+
+class StringTable(object):
+    """只追加的定长字符串表, 编号是字符串在表中的位置
+
+    Args:
+        path (str): 文件路径
+        width (int): 每条的字节数
+        count (int): 已提交的条数, 之后的内容是上次没有提交的, 会被截断
+    """
+
+    def __init__(self, path, width, count):
+        self.path = path
+        self.dtype = 'S{}'.format(width)
+        with open(path, 'ab') as f:
+            f.truncate(count * width)
+        existing = np.fromfile(path, dtype=self.dtype) if count else []
+        self.codes = {x.decode('utf8'): i for i, x in enumerate(existing)}
+        self._pending = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def code(self, value):
+        """字符串的编号, 新的字符串追加到表尾"""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+            self._pending.append(value)
+        return code
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(np.array(self._pending, dtype=self.dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = []
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except IOError:
+        return {'last_id': 0, 'next_day': None, 'devices': 0, 'videos': 0, 'rows': 0, 'dropped': 0}
+
+
+class BehaviorSnapshotWriter(object):
+    """把按id顺序的行为导出成按天分区的列式文件, 见模块说明
+
+    Args:
+        path (str): 快照目录
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.days_path = os.path.join(path, 'days')
+        if not os.path.isdir(self.days_path):
+            os.makedirs(self.days_path)
+        self.meta = _read_meta(path)
+        self.devices = StringTable(os.path.join(path, 'devices.bin'), device_width, self.meta['devices'])
+        self.videos = StringTable(os.path.join(path, 'videos.bin'), video_width, self.meta['videos'])
+
+        # 清理上次没有提交的天
+        for name in os.listdir(self.days_path):
+            if name.endswith('.tmp') or (self.meta['next_day'] and name >= self.meta['next_day']):
+                shutil.rmtree(os.path.join(self.days_path, name), ignore_errors=True)
+
+    @property
+    def last_id(self):
+        return self.meta['last_id']
+
+    def export(self, rows, until=None):
+        """导出行为, 遇到until当天或之后的行为时停止, 返回导出的条数
+        已经导出过的日期又出现的行为(写入延迟造成的乱序)丢弃, 条数记在meta.json的dropped里
+
+        Args:
+            rows (iterable): (id, 设备id, 视频id, 操作类型, 时间)序列, 按id排序, 一般是 VideoBehavior.stream_since(last_id)
+            until (date): 只导出这一天之前的行为, 默认是今天
+        """
+        until = until or datetime.date.today()
+        next_day = self.meta['next_day']
+        day = day_start = day_end = None
+        last_id, dropped, exported = self.last_id, 0, 0
+        devices, videos, operations, times = [], [], [], []
+
+        for id_, device, video, operation, created_at in rows:
+            if day_end is None or created_at >= day_end:
+                if created_at.date() >= until:
+                    break
+                if devices:
+                    self._commit(day, last_id, dropped, devices, videos, operations, times)
+                    exported += len(devices)
+                    devices, videos, operations, times, dropped = [], [], [], [], 0
+                day = created_at.date()
+                day_start = datetime.datetime.combine(day, datetime.time())
+                day_end = day_start + datetime.timedelta(days=1)
+            last_id = id_
+            if created_at < day_start or (next_day and day.isoformat() < next_day):
+                dropped += 1
+                continue
+
+            devices.append(self.devices.code(device))
+            videos.append(self.videos.code(video))
+            operations.append(operation)
+            times.append(created_at)
+
+        if devices:
+            self._commit(day, last_id, dropped, devices, videos, operations, times)
+            exported += len(devices)
+        return exported
+
+    def _commit(self, day, last_id, dropped, devices, videos, operations, times):
+        """写入一天的行为并更新导出进度"""
+        day_start = np.datetime64(day.isoformat(), 's')
+        arrays = {
+            'device': np.array(devices, dtype=np.uint32),
+            'video': np.array(videos, dtype=np.uint32),
+            'operation': np.array(operations, dtype=np.uint8),
+            'seconds': (np.array(times, dtype='datetime64[s]') - day_start).astype(np.uint32),
+        }
+        self.devices.flush()
+        self.videos.flush()
+
+        day_path = os.path.join(self.days_path, day.isoformat())
+        tmp_path = '{}.tmp'.format(day_path)
+        os.makedirs(tmp_path)
+        for name in columns:
+            np.save(os.path.join(tmp_path, '{}.npy'.format(name)), arrays[name])
+        os.rename(tmp_path, day_path)
+
+        self.meta.update({
+            'last_id': last_id,
+            'next_day': (day + datetime.timedelta(days=1)).isoformat(),
+            'devices': len(self.devices),
+            'videos': len(self.videos),
+            'rows': self.meta['rows'] + len(devices),
+            'dropped': self.meta['dropped'] + dropped,
+        })
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open('{}.tmp'.format(meta_path), 'w') as f:
+            json.dump(self.meta, f)
+        os.rename('{}.tmp'.format(meta_path), meta_path)
+
+
+def _load_table(path, width, count):
+    if not count:
+        return np.zeros(0, dtype='S{}'.format(width))
+    return np.memmap(path, dtype='S{}'.format(width), mode='r', shape=(count,))
+
+
+class BehaviorSnapshot(object):
+    """读取导出的行为快照, 所有文件都是mmap方式加载
+
+        snapshot = BehaviorSnapshot(behavior_snapshot_path)
+        for day, data in snapshot.scan('2018-07-01'):
+            counts = np.bincount(data['operation'])
+
+    Args:
+        path (str): 快照目录
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = _read_meta(path)
+        self.devices = _load_table(os.path.join(path, 'devices.bin'), device_width, self.meta['devices'])
+        self.videos = _load_table(os.path.join(path, 'videos.bin'), video_width, self.meta['videos'])
+
+    def days(self):
+        """已导出的日期列表, 'YYYY-MM-DD'格式, 从早到晚"""
+        days_path = os.path.join(self.path, 'days')
+        if not self.meta['next_day'] or not os.path.isdir(days_path):
+            return []
+        return sorted(x for x in os.listdir(days_path)
+                      if not x.endswith('.tmp') and x < self.meta['next_day'])
+
+    def read_day(self, day):
+        """读取一天的行为, 返回 列名 -> 数组
+
+        Args:
+            day (str): 日期, 'YYYY-MM-DD'格式
+        """
+        day_path = os.path.join(self.path, 'days', str(day))
+        return {name: np.load(os.path.join(day_path, '{}.npy'.format(name)), mmap_mode='r')
+                for name in columns}
+
+    def scan(self, begin=None, end=None):
+        """按日期顺序遍历[begin, end)之间的行为, 返回(日期, 列名 -> 数组)序列
+
+        Args:
+            begin (str): 开始日期(包含), 'YYYY-MM-DD'格式或date
+            end (str): 结束日期(不包含)
+        """
+        begin = str(begin) if begin else None
+        end = str(end) if end else None
+        for day in self.days():
+            if (begin and day < begin) or (end and day >= end):
+                continue
+            yield day, self.read_day(day)
+
+    def device_id(self, code):
+        return self.devices[code].decode('utf8')
+
+    def video_id(self, code):
+        return self.videos[code].decode('utf8')
@@ -1,22 +1,34 @@
 # -*- coding: utf-8 -*-
 """用户操作视频的行为"""
+import time
+import atexit
+import logging
 import datetime
+import threading
 from sqlalchemy import (
     Column,
     String,
     Integer,
     DateTime,
     SmallInteger,
+    Index,
+    and_,
+    or_,
 )
 from recommend.models import (
     DBSession,
     BaseModel,
+    db_engine,
 )
 
+logger = logging.getLogger('recommend.file')
 
 class VideoBehavior(BaseModel):
 
     __tablename__ = 'video_behavior'
+    __table_args__ = (
+        Index('ix_device_create', 'device', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     device = Column(String(32), nullable=False)
@@ -47,3 +59,192 @@ class VideoBehavior(BaseModel):
             limit(100).all()
         session.commit()
         return records
+
+    @classmethod
+    def iter_by_device(cls, device, days=90, batch_size=100):
+        """按时间倒序遍历设备的行为, 用(created_at, id)做游标分页, 不用OFFSET
+
+        Args:
+            device (str): 设备id
+            days (int): 最近多少天
+            batch_size (int): 每次查询的条数
+        """
+        begin = datetime.datetime.now() - datetime.timedelta(days=days)
+        session = DBSession()
+        cursor = None
+        try:
+            while True:
+                query = session.query(cls).\
+                    filter(cls.device == device).\
+                    filter(cls.created_at > begin)
+                if cursor:
+                    created_at, id_ = cursor
+                    query = query.filter(or_(
+                        cls.created_at < created_at,
+                        and_(cls.created_at == created_at, cls.id < id_)))
+                records = query.\
+                    order_by(cls.created_at.desc(), cls.id.desc()).\
+                    limit(batch_size).all()
+                session.commit()
+
+                for record in records:
+                    yield record
+                if len(records) < batch_size:
+                    break
+                cursor = (records[-1].created_at, records[-1].id)
+        finally:
+            session.close()
+
+    @classmethod
+    def scan_by_device(cls, days=90, batch_size=10000):
+        """按(设备, 时间, id)顺序遍历所有设备最近days天的行为, 返回(设备id, 视频id, 操作类型)序列
+        同一个设备的行为连续返回, 用(device, created_at, id)做游标分页, 走ix_device_create索引
+
+        Args:
+            days (int): 最近多少天
+            batch_size (int): 每次查询的条数
+        """
+        begin = datetime.datetime.now() - datetime.timedelta(days=days)
+        session = DBSession()
+        cursor = None
+        try:
+            while True:
+                query = session.query(cls.device, cls.created_at, cls.id, cls.video, cls.operation).\
+                    filter(cls.created_at > begin)
+                if cursor:
+                    device, created_at, id_ = cursor
+                    query = query.filter(or_(
+                        cls.device > device,
+                        and_(cls.device == device, cls.created_at > created_at),
+                        and_(cls.device == device, cls.created_at == created_at, cls.id > id_)))
+                rows = query.\
+                    order_by(cls.device, cls.created_at, cls.id).\
+                    limit(batch_size).all()
+                session.commit()
+
+                for row in rows:
+                    yield row.device, row.video, row.operation
+                if len(rows) < batch_size:
+                    break
+                cursor = (rows[-1].device, rows[-1].created_at, rows[-1].id)
+        finally:
+            session.close()
+
+    @classmethod
+    def stream_since(cls, last_id=0, batch_size=100000, fetch_size=10000):
+        """按id顺序遍历id大于last_id的所有行为, 返回(id, 设备id, 视频id, 操作类型, 时间)序列
+        每次查询batch_size条, 用id做游标分页; 查询用服务端游标(stream_results),
+        每次从mysql取fetch_size条, 客户端不缓存整批结果
+
+        Args:
+            last_id (int): 从这个id之后开始
+            batch_size (int): 每次查询的条数
+            fetch_size (int): 每次从服务端游标取的条数
+        """
+        session = DBSession()
+        try:
+            while True:
+                query = session.query(cls.id, cls.device, cls.video, cls.operation, cls.created_at).\
+                    filter(cls.id > last_id).\
+                    order_by(cls.id).\
+                    limit(batch_size).\
+                    yield_per(fetch_size)
+                count = 0
+                for row in query:
+                    count += 1
+                    last_id = row.id
+                    yield row.id, row.device, row.video, row.operation, row.created_at
+                session.commit()
+                if count < batch_size:
+                    break
+        finally:
+            session.close()
+
+
+class VideoBehaviorWriter(object):
+    """缓存行为记录, 攒够条数或者超过时间后一次写入
+    pymysql的executemany会把多条记录合并成一条多行INSERT
+    进程退出时会写入剩余的记录, celery worker进程退出时由 worker_process_shutdown 信号写入
+    写入失败的记录放回缓存, retry_delay秒后重试, 缓存超过max_pending条时丢弃最早的记录
+    """
+
+    def __init__(self, engine=db_engine, max_size=500, max_delay=1.0, max_pending=50000, retry_delay=5.0):
+        """
+        Args:
+            engine: 数据库连接
+            max_size (int): 缓存的最多条数
+            max_delay (float): 缓存的最长时间(秒)
+            max_pending (int): 写入失败时最多保留的条数
+            retry_delay (float): 写入失败后多久重试(秒)
+        """
+        self.engine = engine
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self._rows = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._retry_at = 0
+        self._dropped = 0
+        atexit.register(self.flush)
+
+    def add(self, device, video, operation):
+        row = {
+            'device': device,
+            'video': video,
+            'operation': operation,
+            'created_at': datetime.datetime.now(),
+        }
+        with self._lock:
+            self._rows.append(row)
+            self._trim()
+            size = len(self._rows)
+            if self._timer is None:
+                self._start_timer(self.max_delay)
+        # 写入失败后等定时器重试, 不在每次请求里重试
+        if size >= self.max_size and time.time() >= self._retry_at:
+            self.flush()
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _trim(self):
+        """缓存超过max_pending条时丢弃最早的记录, 调用时需要持有锁"""
+        dropped = len(self._rows) - self.max_pending
+        if dropped > 0:
+            del self._rows[:dropped]
+            self._dropped += dropped
+
+    def flush(self):
+        """写入缓存的记录, 返回写入的条数, 失败时记录日志并把记录放回缓存"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+            dropped, self._dropped = self._dropped, 0
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if dropped:
+            logger.error('drop {} behaviors, pending behaviors exceed {}'.format(dropped, self.max_pending))
+        if not rows:
+            return 0
+
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(VideoBehavior.__table__.insert(), rows)
+        except Exception as e:
+            logger.exception('write {} behaviors failed: {}'.format(len(rows), e))
+            with self._lock:
+                self._rows = rows + self._rows
+                self._trim()
+                self._retry_at = time.time() + self.retry_delay
+                if self._timer is None:
+                    self._start_timer(self.retry_delay)
+            return 0
+        self._retry_at = 0
+        return len(rows)
+
+
+behavior_writer = VideoBehaviorWriter()
@@ -1,11 +1,43 @@
 # -*- coding: utf-8 -*-
 """celery 任务"""
+import logging
+from collections import OrderedDict
+from celery.signals import worker_process_shutdown
 from recommend import celery_app
+from recommend.const import (
+    behavior_coalesce_window,
+    valid_operations,
+)
+from recommend.models import redis_client
+from recommend.models.video_model import behavior_writer
+from recommend.algorithm.video.crawler import video_crawler
+from recommend.algorithm.video.lua import coalesce_events_script
 from recommend.algorithm.video.v1 import algorithm1
 from recommend.algorithm.video.v2 import algorithm2
+from recommend.tools.trace import span
+
+logger = logging.getLogger('recommend.file')
+
+
+def get_algorithm(device):
+    """根据设备id选择推荐算法
+
+    Args:
+        device (str): 设备id
+    """
+    if device[0] in ('0', '1', '2', '3', '4', '5', '6', '7'):
+        return algorithm2
+    return algorithm1
+
+
+@worker_process_shutdown.connect
+def flush_behavior_writer(**kwargs):
+    """worker进程退出前写入缓存的行为记录"""
+    behavior_writer.flush()
 
 
 @celery_app.task
+@span('update_video_recommendation', 'mixed')
 def update_video_recommendation(device, video_id, operation):
     """根据用户行为更新推荐内容
 
@@ -14,7 +46,203 @@ def update_video_recommendation(device, video_id, operation):
         video_id (str): 视频id
         operation (int): 操作类型
     """
-    if device[0] in ('0', '1', '2', '3', '4', '5', '6', '7'):
-        algorithm2.update_recommend_list(device, video_id, operation)
-    else:
-        algorithm1.update_recommend_list(device, video_id, operation)
+    update_device_recommendation(device, [(video_id, operation)])
+
+
+@celery_app.task
+@span('update_video_recommendation_events', 'mixed')
+def update_video_recommendation_events(device):
+    """取出设备在合并窗口内缓存的所有行为, 一次性更新推荐内容
+
+    Args:
+        device (str): 设备id
+    """
+    pipe = redis_client.pipeline()
+    pipe.delete('device|{}|events_scheduled'.format(device))
+    pipe.lrange('device|{}|events'.format(device), 0, -1)
+    pipe.delete('device|{}|events'.format(device))
+    _, events, _ = pipe.execute()
+    events = decode_events(device, events)
+    if events:
+        update_device_recommendation(device, events)
+
+
+def decode_events(device, events):
+    """解析合并窗口内缓存的行为, 跳过不合法的行为, 一个坏的行为不影响同一设备的其它行为
+
+    Args:
+        device (str): 设备id
+        events (list): "视频id 操作类型" 列表
+    """
+    result = []
+    for event in events:
+        # 操作类型是整数, 从右边切分, 视频id里有空格也不会出错
+        video_id, _, operation = event.decode('utf8').rpartition(' ')
+        try:
+            operation = int(operation)
+        except ValueError:
+            operation = None
+        if not video_id or operation not in valid_operations:
+            logger.warning('skip invalid event of device {}: {!r}'.format(device, event))
+            continue
+        result.append((video_id, operation))
+    return result
+
+
+@celery_app.task
+@span('update_video_recommendation_bulk', 'mixed')
+def update_video_recommendation_bulk(device_events):
+    """批量更新多个设备的推荐内容, 一个设备出错不影响其它设备
+
+    Args:
+        device_events (dict): 设备id -> (视频id, 操作类型)列表
+    """
+    for device, events in device_events.items():
+        try:
+            update_device_recommendation(device, events)
+        except Exception as e:
+            logger.exception('update recommendation of device {} failed: {}'.format(device, e))
+
+
+@celery_app.task
+@span('crawl_video', 'mixed')
+def crawl_video(video_id):
+    """爬取不在es中的视频, 爬完后用等待中的行为更新推荐内容
+
+    Args:
+        video_id (str): 视频id
+    """
+    _, waiting = video_crawler.crawl(video_id)
+    if waiting:
+        enqueue_video_recommendations(
+            [(device, video_id, operation) for device, operation in waiting])
+
+
+def update_device_recommendation(device, events):
+    """更新一个设备的推荐内容并记录行为, 种子视频不在es中的行为等视频爬取之后再处理
+
+    Args:
+        device (str): 设备id
+        events (list): (视频id, 操作类型)列表
+    """
+    pending = get_algorithm(device).update_recommend_events(device, events)
+    record_behaviors(device, events, pending)
+    request_crawl(device, pending)
+
+
+def record_behaviors(device, events, pending=None):
+    """把行为写入video_behavior, 等待爬取的行为在爬取之后重新提交任务时再写入, 不会重复记录
+
+    Args:
+        device (str): 设备id
+        events (list): (视频id, 操作类型)列表
+        pending (list): 等待爬取的(视频id, 操作类型)列表
+    """
+    pending = set(pending or ())
+    for video_id, operation in events:
+        if (video_id, operation) not in pending:
+            behavior_writer.add(device, video_id, operation)
+
+
+def request_crawl(device, events):
+    """种子视频不在es中的行为等视频爬取之后再更新, 同一个视频只提交一次爬取任务
+
+    Args:
+        device (str): 设备id
+        events (list): (视频id, 操作类型)列表
+    """
+    for video_id, operation in events or ():
+        if video_crawler.request(video_id, device, operation):
+            crawl_video.delay(video_id)
+
+
+def enqueue_video_recommendation(device, video_id, operation):
+    """提交更新推荐内容的任务
+
+    Args:
+        device (str): 设备id
+        video_id (str): 视频id
+        operation (int): 操作类型
+    """
+    enqueue_video_recommendations([(device, video_id, operation)])
+
+
+def group_device_events(events):
+    """把行为按设备分组, 返回 设备id -> (视频id, 操作类型)列表
+
+    Args:
+        events (list): (设备id, 视频id, 操作类型)列表
+    """
+    device_events = OrderedDict()
+    for device, video_id, operation in events:
+        device_events.setdefault(device, []).append((video_id, operation))
+    return device_events
+
+
+def submit_bulk_tasks(device_events, devices_per_task=100):
+    """不合并时直接提交批量更新任务
+
+    Args:
+        device_events (dict): 设备id -> (视频id, 操作类型)列表
+        devices_per_task (int): 每个任务包含的设备数
+    """
+    devices = list(device_events)
+    for i in range(0, len(devices), devices_per_task):
+        chunk = {x: device_events[x] for x in devices[i: i + devices_per_task]}
+        update_video_recommendation_bulk.delay(chunk)
+
+
+def schedule_event_tasks(devices):
+    """合并窗口结束时更新这些设备的推荐内容
+
+    Args:
+        devices (list): 设备id列表
+    """
+    for device in devices:
+        update_video_recommendation_events.apply_async(
+            (device,), countdown=behavior_coalesce_window)
+
+
+def coalesce_events_request(device_events):
+    """缓存行为的lua脚本(COALESCE_EVENTS_LUA)的(keys, args), 同步和asyncio版本共用
+
+    Args:
+        device_events (dict): 设备id -> (视频id, 操作类型)列表
+    """
+    keys, args = [], [behavior_coalesce_window]
+    for device, items in device_events.items():
+        keys.append('device|{}|events'.format(device))
+        keys.append('device|{}|events_scheduled'.format(device))
+        args.append(len(items))
+        args.extend('{} {}'.format(x, y) for x, y in items)
+    return keys, args
+
+
+def scheduled_devices(device_events, result):
+    """COALESCE_EVENTS_LUA 的结果转换成需要提交任务的设备id列表
+
+    Args:
+        device_events (dict): 设备id -> (视频id, 操作类型)列表
+        result (list): 脚本返回的设备序号
+    """
+    devices = list(device_events)
+    return [devices[i - 1] for i in result]
+
+
+def enqueue_video_recommendations(events, devices_per_task=100):
+    """批量提交更新推荐内容的任务, 同一设备的行为放在同一个任务里
+    开启合并时, 行为先缓存在redis里, 每个设备在合并窗口内只提交一个任务
+    asyncio版本见 recommend.tools.aio.enqueue_video_recommendations
+
+    Args:
+        events (list): (设备id, 视频id, 操作类型)列表
+        devices_per_task (int): 不合并时每个任务包含的设备数
+    """
+    device_events = group_device_events(events)
+    if not behavior_coalesce_window:
+        submit_bulk_tasks(device_events, devices_per_task)
+        return
+
+    keys, args = coalesce_events_request(device_events)
+    result = coalesce_events_script(keys=keys, args=args)
+    schedule_event_tasks(scheduled_devices(device_events, result))
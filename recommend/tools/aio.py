@@ -0,0 +1,135 @@
+# -*- coding: utf8 -*-
+"""asyncio版本的redis/发布服务/celery调用, 供 async_server.py 使用
+
+- redis用aioredis连接池, lua脚本和redis-py一样先EVALSHA, 服务端没有脚本时再EVAL
+- 发布id查询和同步版本共用 publish_client 的缓存和解析, 分块并发请求, 同一个视频同时只请求一次
+- celery没有asyncio接口, 提交任务放到线程池里执行, 不阻塞事件循环, 其它会阻塞的调用(比如抽取热门视频)也用这个线程池
+"""
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import aioredis
+import ujson
+
+from recommend import (
+    configure,
+    tasks,
+)
+from recommend.const import behavior_coalesce_window
+from recommend.tools.publish import publish_client
+from recommend.algorithm.video.lua import COALESCE_EVENTS_LUA
+
+logger = logging.getLogger('recommend.file')
+
+# 提交celery任务等会阻塞的调用的线程池
+blocking_executor = ThreadPoolExecutor(4)
+
+
+async def create_redis(maxsize=100):
+    """创建redis连接池
+
+    Args:
+        maxsize (int): 最多连接数
+    """
+    return await aioredis.create_redis_pool(configure.get('REDIS_URL'), maxsize=maxsize)
+
+
+class AsyncScript(object):
+    """lua脚本, 用法和redis-py的register_script相同, 执行时传入连接"""
+
+    def __init__(self, script):
+        self.script = script
+        self.sha = hashlib.sha1(script.encode('utf8')).hexdigest()
+
+    async def __call__(self, redis, keys=(), args=()):
+        try:
+            return await redis.evalsha(self.sha, list(keys), list(args))
+        except aioredis.ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+        return await redis.eval(self.script, list(keys), list(args))
+
+
+coalesce_events_script = AsyncScript(COALESCE_EVENTS_LUA)
+
+
+class AsyncPublishClient(object):
+    """发布id查询, 和 PublishClient 共用缓存
+
+    Args:
+        client (PublishClient): 提供缓存, 分块大小和超时时间
+        max_connections (int): 最多同时请求数
+    """
+
+    def __init__(self, client=publish_client, max_connections=64):
+        self.client = client
+        self.max_connections = max_connections
+        self._session = None
+        self._pending = {}  # 视频id -> 正在查询该视频的Future
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            json_serialize=ujson.dumps,
+            timeout=aiohttp.ClientTimeout(total=self.client.timeout))
+
+    async def close(self):
+        await self._session.close()
+
+    async def _fetch(self, video_ids, future):
+        """请求一个分块, 结果写入缓存"""
+        result = {}
+        try:
+            async with self._session.post(
+                    configure.get('PUBLISH_QUERY_URL'), json=self.client.request_body(video_ids)) as resp:
+                res = await resp.json(loads=ujson.loads, content_type=None)
+            result = self.client.store(video_ids, res)
+        except Exception as e:
+            logger.warning('query publish id failed: {}'.format(e))
+        finally:
+            self.client.release(self._pending, video_ids, future)
+            future.set_result(result)
+
+    async def query(self, video_ids):
+        """查询视频的发布id, 返回 视频id -> 发布id, 没有发布id的视频不返回
+
+        Args:
+            video_ids (list): 视频id列表
+        """
+        if not video_ids:
+            return {}
+
+        found, misses = self.client.lookup(video_ids)
+        if misses:
+            loop = asyncio.get_event_loop()
+            futures, chunks = self.client.claim(misses, self._pending, loop.create_future)
+            for chunk, future in chunks:
+                loop.create_task(self._fetch(chunk, future))
+
+            done, _ = await asyncio.wait(futures, timeout=self.client.timeout)
+            for future in done:
+                found.update(future.result())
+        return self.client.select(video_ids, found)
+
+
+async def enqueue_video_recommendations(redis, events):
+    """和 tasks.enqueue_video_recommendations 相同, lua脚本用aioredis执行
+
+    Args:
+        redis (Redis): aioredis连接池
+        events (list): (设备id, 视频id, 操作类型)列表
+    """
+    device_events = tasks.group_device_events(events)
+    loop = asyncio.get_event_loop()
+    if not behavior_coalesce_window:
+        await loop.run_in_executor(blocking_executor, tasks.submit_bulk_tasks, device_events)
+        return
+
+    keys, args = tasks.coalesce_events_request(device_events)
+    result = await coalesce_events_script(redis, keys, args)
+    devices = tasks.scheduled_devices(device_events, result)
+    if devices:
+        await loop.run_in_executor(blocking_executor, tasks.schedule_event_tasks, devices)
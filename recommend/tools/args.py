@@ -2,15 +2,36 @@
 """解析flask参数"""
 import functools
 import collections
+from marshmallow import (
+    ValidationError,
+    validate,
+)
+from webargs import fields
 from webargs.flaskparser import FlaskParser
 from webargs.core import argmap2schema
 from flask import jsonify
 
+from recommend.const import valid_operations
+
 
 class ParamException(Exception):
     pass
 
 
+# 接口参数, server.py和asyncio版本(async_server.py)共用
+behavior_args = {
+    'device': fields.Str(required=True, location='json'),
+    'video_id': fields.Str(required=True, location='json'),
+    'operation': fields.Int(required=True, location='json',
+                            validate=validate.OneOf(sorted(valid_operations))),
+}
+recommend_args = {
+    'device': fields.Str(required=True, location='query'),
+    'size': fields.Int(location='query'),
+    'version': fields.Int(location='query'),
+}
+
+
 class MessageParser(FlaskParser):
     """解决参数解析出错的时候直接返回PARAM_ERROR"""
     def use_args(self, argmap, req=None, locations=None, as_kwargs=False, validate=None):
@@ -53,7 +74,31 @@ class MessageParser(FlaskParser):
 
 parser = MessageParser()
 
+_schemas = {}
+
+
+def load_args(argmap, data):
+    """用argmap校验已经取出的参数, 不依赖web框架, 出错时抛出ParamException
+    asyncio服务用它解析参数(webargs 3.0的aiohttp解析器在python3.7及以上无法import)
+
+    Args:
+        argmap (dict): 参数名 -> webargs字段, 和 parser.use_args 的参数相同
+        data (dict): 参数
+    """
+    schema = _schemas.get(id(argmap))
+    if schema is None:
+        schema = _schemas[id(argmap)] = argmap2schema(argmap)()
+    # webargs生成的schema是strict的, 校验失败时抛出ValidationError
+    try:
+        result, errors = schema.load(data)
+    except ValidationError as e:
+        raise ParamException(e.messages)
+    if errors:
+        raise ParamException(errors)
+    return result
+
 
 @parser.error_handler
-def handle_error(error):
+def handle_error(error, req=None):
+    """webargs 3.0 调用时会传入请求对象"""
     raise ParamException(error.messages)
@@ -0,0 +1,330 @@
+# -*- coding: utf8 -*-
+"""缓存"""
+import os
+import time
+import uuid
+import zlib
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson
+from prometheus_client import Counter
+
+from recommend.models import redis_client
+from recommend.tools.lazy import LazyObject
+
+logger = logging.getLogger('recommend.file')
+
+missing = object()
+
+# 只有锁的值还是自己的token时才删除, 计算超过锁的过期时间后不会删掉其它进程重新加的锁
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock_script = LazyObject(lambda: redis_client.register_script(RELEASE_LOCK_LUA))
+
+
+class TTLCache(object):
+    """有容量上限的LRU缓存, 每个值有自己的过期时间, 线程安全"""
+
+    def __init__(self, max_size=10000, ttl=600):
+        """
+        Args:
+            max_size (int): 最多缓存个数
+            ttl (float): 默认过期时间(秒)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=missing):
+        """查询缓存, 不存在或者过期时返回default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            value, expire_at = item
+            if expire_at < time.time():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expire_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+cache_counter = Counter(
+    'recommend_cache_total',
+    'Cache lookups',
+    ['cache', 'level', 'result'])
+
+
+class TieredCache(object):
+    """两级缓存: 进程内LRU + redis, redis中的值用 dumps/loads 编码"""
+
+    def __init__(self, name, max_size=10000, ttl=60, redis_ttl=3600,
+                 dumps=None, loads=None):
+        """
+        Args:
+            name (str): 缓存名, 用作redis key前缀和监控标签
+            max_size (int): 进程内最多缓存个数
+            ttl (int): 进程内缓存时间(秒)
+            redis_ttl (int): redis缓存时间(秒)
+            dumps (callable): 编码函数, 返回bytes
+            loads (callable): 解码函数
+        """
+        self.name = name
+        self.redis_ttl = redis_ttl
+        self.dumps = dumps or zlib_json_dumps
+        self.loads = loads or zlib_json_loads
+        self._local = TTLCache(max_size, ttl)
+        self._metrics = {}
+
+    def _redis_key(self, key):
+        return '{}|{}'.format(self.name, key)
+
+    def _counter(self, level, result):
+        """第一次计数时才创建子指标, 缓存在import时创建, 多进程模式下不能在fork之前创建子指标"""
+        counter = self._metrics.get((level, result))
+        if counter is None:
+            counter = self._metrics[(level, result)] = cache_counter.labels(
+                cache=self.name, level=level, result=result)
+        return counter
+
+    def _count(self, level, hits, misses):
+        if hits:
+            self._counter(level, 'hit').inc(hits)
+        if misses:
+            self._counter(level, 'miss').inc(misses)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """批量查询, 只返回命中的key, 本地未命中的用一次mget查询redis
+
+        Args:
+            keys (list): key列表
+        """
+        result = {}
+        misses = []
+        for key in keys:
+            value = self._local.get(key)
+            if value is missing:
+                misses.append(key)
+            else:
+                result[key] = value
+        self._count('local', len(result), len(misses))
+        if not misses:
+            return result
+
+        values = redis_client.mget([self._redis_key(x) for x in misses])
+        hits = 0
+        for key, data in zip(misses, values):
+            if data is None:
+                continue
+            value = self.loads(data)
+            self._local.set(key, value)
+            result[key] = value
+            hits += 1
+        self._count('redis', hits, len(misses) - hits)
+        return result
+
+    def set(self, key, value, ttl=None, redis_ttl=None):
+        self.set_many({key: value}, ttl, redis_ttl)
+
+    def set_many(self, mapping, ttl=None, redis_ttl=None):
+        """批量写入两级缓存
+
+        Args:
+            mapping (dict): key -> value
+            ttl (int): 进程内缓存时间(秒), 为空时用默认值
+            redis_ttl (int): redis缓存时间(秒), 为空时用默认值
+        """
+        if not mapping:
+            return
+
+        redis_ttl = redis_ttl or self.redis_ttl
+        pipe = redis_client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            self._local.set(key, value, ttl)
+            pipe.set(self._redis_key(key), self.dumps(value), ex=redis_ttl)
+        pipe.execute()
+
+    def delete(self, key):
+        self._local.delete(key)
+        redis_client.delete(self._redis_key(key))
+
+
+class RefreshingCache(TieredCache):
+    """计算结果的两级缓存
+
+    - 快过期时返回旧值, 同时在后台线程提前重新计算
+    - 用redis锁保证同一个key同时只有一个进程在计算, 其它进程等待结果
+    - 空结果也缓存, 过期时间更短
+
+    redis中的值是 8字节创建时间 + 1字节是否为空 + dumps编码的结果
+    """
+
+    header = struct.Struct('<d?')
+
+    def __init__(self, name, max_size=10000, ttl=60, redis_ttl=3600,
+                 refresh_ratio=0.8, negative_ttl=300, lock_timeout=10, wait_timeout=2.0,
+                 dumps=None, loads=None):
+        """
+        Args:
+            name (str): 缓存名
+            max_size (int): 进程内最多缓存个数
+            ttl (int): 进程内缓存时间(秒)
+            redis_ttl (int): redis缓存时间(秒)
+            refresh_ratio (float): 缓存存在时间超过 redis_ttl * refresh_ratio 后提前刷新
+            negative_ttl (int): 空结果的缓存时间(秒)
+            lock_timeout (int): 计算锁的过期时间(秒)
+            wait_timeout (float): 其它进程正在计算时最多等待的时间(秒)
+            dumps (callable): 结果编码函数, 返回bytes
+            loads (callable): 结果解码函数
+        """
+        super(RefreshingCache, self).__init__(
+            name, max_size, ttl, redis_ttl, self._dump_item, self._load_item)
+        self.value_dumps = dumps or zlib_json_dumps
+        self.value_loads = loads or zlib_json_loads
+        self.refresh_after = redis_ttl * refresh_ratio
+        self.negative_ttl = negative_ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _dump_item(self, item):
+        value, created_at = item
+        if not value:
+            return self.header.pack(created_at, True)
+        return self.header.pack(created_at, False) + self.value_dumps(value)
+
+    def _load_item(self, data):
+        created_at, negative = self.header.unpack_from(data)
+        if negative:
+            return None, created_at
+        return self.value_loads(data[self.header.size:]), created_at
+
+    def _lock_key(self, key):
+        return '{}|{}|lock'.format(self.name, key)
+
+    def _acquire(self, lock_key):
+        """加计算锁, 成功时返回锁的token, 失败返回None"""
+        token = uuid.uuid4().hex
+        if redis_client.set(lock_key, token, px=int(self.lock_timeout * 1000), nx=True):
+            return token
+
+    @staticmethod
+    def _release(lock_key, token):
+        release_lock_script(keys=[lock_key], args=[token])
+
+    def _store(self, key, value):
+        if value:
+            self.set(key, (value, time.time()))
+        else:
+            ttl = min(self.negative_ttl, self._local.ttl)
+            self.set(key, (value, time.time()), ttl, self.negative_ttl)
+
+    def get_or_create(self, key, creator, *args):
+        """查询缓存, 不存在时调用 creator(*args) 计算并写入缓存
+        creator抛出的异常不会缓存, 直接抛给调用方
+
+        Args:
+            key (str): 缓存key
+            creator (callable): 计算函数
+        """
+        item = self.get(key)
+        if item is not None:
+            value, created_at = item
+            if value and time.time() - created_at > self.refresh_after:
+                self._refresh_async(key, creator, args)
+            return value
+
+        lock_key = self._lock_key(key)
+        token = self._acquire(lock_key)
+        if token is None:
+            # 其它进程正在计算, 等它写入缓存, 超时后自己计算
+            deadline = time.time() + self.wait_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                item = self.get(key)
+                if item is not None:
+                    return item[0]
+            return creator(*args)
+
+        try:
+            value = creator(*args)
+            self._store(key, value)
+        finally:
+            self._release(lock_key, token)
+        return value
+
+    def _refresh_async(self, key, creator, args):
+        """提交后台刷新, 同一个key在进程内只提交一次"""
+        with self._refresh_lock:
+            if self._pid != os.getpid():
+                # 线程池不能跨进程使用, fork之后重新创建
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(2)
+                self._refreshing = set()
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, creator, args)
+
+    def _refresh(self, key, creator, args):
+        lock_key = self._lock_key(key)
+        try:
+            token = self._acquire(lock_key)
+            if token is None:
+                return
+            try:
+                # 其它进程可能已经刷新过, 只是本进程的缓存还是旧值
+                data = redis_client.get(self._redis_key(key))
+                if data is not None:
+                    item = self._load_item(data)
+                    if time.time() - item[1] <= self.refresh_after:
+                        self._local.set(key, item)
+                        return
+                self._store(key, creator(*args))
+            finally:
+                self._release(lock_key, token)
+        except Exception as e:
+            logger.warning('refresh cache {} {} failed: {}'.format(self.name, key, e))
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+
+def zlib_json_dumps(value):
+    return zlib.compress(ujson.dumps(value).encode('utf8'), 1)
+
+
+def zlib_json_loads(data):
+    return ujson.loads(zlib.decompress(data).decode('utf8'))
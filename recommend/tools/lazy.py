@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+"""延迟初始化
+
+import时不做任何网络请求, 连接和配置在第一次使用时才创建
+"""
+import threading
+
+
+class LazyObject(object):
+    """代理对象, 第一次访问属性时才调用factory创建真正的对象"""
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_wrapped', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _setup(self):
+        wrapped = self._wrapped
+        if wrapped is None:
+            with self._lock:
+                wrapped = self._wrapped
+                if wrapped is None:
+                    wrapped = self._factory()
+                    object.__setattr__(self, '_wrapped', wrapped)
+        return wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._setup(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._setup(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._setup()(*args, **kwargs)
+
+
+class lazy_property(object):
+    """第一次访问时计算, 之后缓存在实例上的属性"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
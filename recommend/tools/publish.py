@@ -0,0 +1,183 @@
+# -*- coding: utf8 -*-
+"""视频发布id查询
+
+视频id分块后并发请求发布服务, 结果缓存在进程内(没有发布id的视频也缓存, 过期时间更短)
+多个请求同时查询同一个视频时只发一次请求, 超时的分块直接返回已经查到的部分
+"""
+import os
+import logging
+import threading
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from recommend import configure
+from recommend.tools.cache import (
+    TTLCache,
+    missing,
+)
+
+logger = logging.getLogger('recommend.file')
+
+
+class PublishClient(object):
+
+    def __init__(self, chunk_size=200, max_workers=8, timeout=1.0,
+                 cache_size=200000, ttl=600, negative_ttl=60):
+        """
+        Args:
+            chunk_size (int): 每次请求的视频个数
+            max_workers (int): 最多同时请求数
+            timeout (float): 查询超时时间(秒)
+            cache_size (int): 最多缓存的视频个数
+            ttl (int): 发布id缓存时间(秒)
+            negative_ttl (int): 没有发布id的缓存时间(秒)
+        """
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(cache_size, ttl)
+        self._pending = {}  # 视频id -> 正在查询该视频的Future
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._executor = None
+
+    def _setup(self):
+        """连接池和线程池不能跨进程使用, fork之后重新创建"""
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(self.max_workers)
+        self._pending = {}
+
+    @staticmethod
+    def request_body(video_ids):
+        return {
+            'resources': [{'res_type': 'video', 'res_id': x} for x in video_ids]
+        }
+
+    def lookup(self, video_ids):
+        """查缓存, 返回(视频id -> 发布id, 未缓存的视频id列表), 没有发布id的视频两边都不返回
+
+        Args:
+            video_ids (list): 视频id列表
+        """
+        found, misses = {}, []
+        for video_id in video_ids:
+            pub_id = self._cache.get(video_id)
+            if pub_id is missing:
+                misses.append(video_id)
+            elif pub_id is not None:
+                found[video_id] = pub_id
+        return found, misses
+
+    def store(self, video_ids, res):
+        """解析发布服务的返回并写入缓存, 返回 视频id -> 发布id
+
+        Args:
+            video_ids (list): 请求的视频id列表
+            res (dict): 发布服务返回的json
+        """
+        result = {}
+        if res['data']:
+            for item in res['data']:
+                if item['pub_ids']:
+                    result[item['res_id']] = item['pub_ids'][0]
+            for video_id in video_ids:
+                pub_id = result.get(video_id)
+                if pub_id is None:
+                    self._cache.set(video_id, None, self.negative_ttl)
+                else:
+                    self._cache.set(video_id, pub_id)
+        return result
+
+    def claim(self, misses, pending, create_future):
+        """把未缓存的视频分块并登记到pending里, 已经有请求在查询的视频直接等那个请求, 同步和asyncio版本共用
+        返回(需要等待的Future集合, 需要请求的(分块, Future)列表)
+
+        Args:
+            misses (list): 未缓存的视频id列表
+            pending (dict): 视频id -> 正在查询该视频的Future
+            create_future (callable): 创建Future
+        """
+        futures, todo = set(), []
+        for video_id in dict.fromkeys(misses):
+            future = pending.get(video_id)
+            if future is None:
+                todo.append(video_id)
+            else:
+                futures.add(future)
+
+        chunks = []
+        for i in range(0, len(todo), self.chunk_size):
+            chunk = todo[i: i + self.chunk_size]
+            future = create_future()
+            for video_id in chunk:
+                pending[video_id] = future
+            chunks.append((chunk, future))
+            futures.add(future)
+        return futures, chunks
+
+    @staticmethod
+    def release(pending, video_ids, future):
+        """分块请求结束, 从pending里删除这个分块登记的视频"""
+        for video_id in video_ids:
+            if pending.get(video_id) is future:
+                del pending[video_id]
+
+    @staticmethod
+    def select(video_ids, found):
+        """按请求的顺序返回 视频id -> 发布id, 没有发布id的视频不返回"""
+        return {x: found[x] for x in video_ids if x in found}
+
+    def _fetch(self, video_ids, future):
+        """请求一个分块, 结果写入缓存"""
+        result = {}
+        try:
+            res = self._session.post(
+                configure.get('PUBLISH_QUERY_URL'), json=self.request_body(video_ids),
+                timeout=self.timeout).json()
+            result = self.store(video_ids, res)
+        except Exception as e:
+            logger.warning('query publish id failed: {}'.format(e))
+        finally:
+            with self._lock:
+                self.release(self._pending, video_ids, future)
+            future.set_result(result)
+
+    def query(self, video_ids):
+        """查询视频的发布id, 返回 视频id -> 发布id, 没有发布id的视频不返回
+
+        Args:
+            video_ids (list): 视频id列表
+        """
+        if not video_ids:
+            return {}
+
+        found, misses = self.lookup(video_ids)
+        if misses:
+            with self._lock:
+                self._setup()
+                futures, chunks = self.claim(misses, self._pending, Future)
+            for chunk, future in chunks:
+                self._executor.submit(self._fetch, chunk, future)
+
+            done, _ = wait(futures, timeout=self.timeout)
+            for future in done:
+                found.update(future.result())
+        return self.select(video_ids, found)
+
+
+publish_client = PublishClient()
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+"""按权重抽样
+
+建表时用Walker别名法预处理权重, 之后每次抽一个元素是O(1), 和元素总数无关
+"""
+import os
+
+import numpy as np
+
+
+class AliasTable(object):
+    """别名表, 按权重有放回抽样"""
+
+    def __init__(self, weights):
+        """
+        Args:
+            weights (array): 非负权重
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        size = len(weights)
+        prob = weights * size / weights.sum()
+        alias = np.arange(size)
+        small = np.flatnonzero(prob < 1.0).tolist()
+        large = np.flatnonzero(prob >= 1.0).tolist()
+        while small and large:
+            less, more = small.pop(), large.pop()
+            alias[less] = more
+            prob[more] -= 1.0 - prob[less]
+            if prob[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # 浮点误差剩下的都是概率1
+        prob[small + large] = 1.0
+        self.size = size
+        self.prob = prob
+        self.alias = alias
+
+    def draw(self, count, random_state):
+        """有放回地抽取count个下标
+
+        Args:
+            count (int): 个数
+            random_state (RandomState): 随机数生成器
+        """
+        index = random_state.randint(0, self.size, count)
+        accept = random_state.random_sample(count) < self.prob[index]
+        return np.where(accept, index, self.alias[index])
+
+
+class WeightedSampler(object):
+    """按权重无放回抽取多个不同元素, 支持按分组配额抽取和排除指定元素"""
+
+    def __init__(self, items, weights, groups=None):
+        """
+        Args:
+            items (list): 元素列表
+            weights (list): 元素的权重
+            groups (list): 元素所属的分组, 为空时不能按分组抽取
+        """
+        self.items = np.empty(len(items), dtype=object)
+        self.items[:] = list(items)
+        self.index = {x: i for i, x in enumerate(self.items)}
+        self.table = AliasTable(weights) if len(self.items) else None
+        self.groups = {}
+        if groups is not None and len(self.items):
+            weights = np.asarray(weights, dtype=np.float64)
+            members = {}
+            for i, group in enumerate(groups):
+                members.setdefault(group, []).append(i)
+            for group, indexes in members.items():
+                indexes = np.array(indexes)
+                self.groups[group] = (indexes, AliasTable(weights[indexes]))
+        self._pid = None
+        self._random_state = None
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def random_state(self):
+        """fork之后重新播种, 否则所有子进程抽到一样的结果"""
+        if self._pid != os.getpid():
+            self._random_state = np.random.RandomState()
+            self._pid = os.getpid()
+        return self._random_state
+
+    def _sample_table(self, table, members, count, excluded, max_rounds=4):
+        """从一张别名表中抽取count个不在excluded中的不同下标
+        每轮多抽一些然后去重, 被排除的太多时抽够max_rounds轮就停止
+
+        Returns:
+            (抽到的下标, 加上抽到的下标之后的excluded)
+        """
+        chosen = np.empty(0, dtype=np.int64)
+        for _ in range(max_rounds):
+            need = count - len(chosen)
+            if need <= 0:
+                break
+
+            drawn = table.draw(need * 2 + 16, self.random_state)
+            if members is not None:
+                drawn = members[drawn]
+            # 去重并保留抽到的先后顺序, 权重大的更可能排在前面
+            _, first = np.unique(drawn, return_index=True)
+            drawn = drawn[np.sort(first)]
+            if len(excluded):
+                drawn = drawn[~np.isin(drawn, excluded)]
+            drawn = drawn[:need]
+            chosen = np.concatenate([chosen, drawn])
+            excluded = np.concatenate([excluded, drawn])
+        return chosen, excluded
+
+    def sample(self, count, exclude=None, quotas=None):
+        """按权重抽取最多count个不同元素
+
+        Args:
+            count (int): 个数
+            exclude (iterable): 不能抽到的元素
+            quotas (dict): 分组 -> 个数, 先按配额从各分组抽取, 不足count个的部分从所有元素中抽取
+        """
+        if not len(self.items):
+            return []
+
+        excluded = [self.index[x] for x in exclude or () if x in self.index]
+        excluded = np.array(excluded, dtype=np.int64)
+        parts, total = [], 0
+        for group, group_count in (quotas or {}).items():
+            if group not in self.groups or total >= count:
+                continue
+            members, table = self.groups[group]
+            chosen, excluded = self._sample_table(
+                table, members, min(group_count, count - total), excluded)
+            parts.append(chosen)
+            total += len(chosen)
+
+        chosen = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        if len(chosen) < count:
+            rest, _ = self._sample_table(self.table, None, count - len(chosen), excluded)
+            chosen = np.concatenate([chosen, rest])
+        if quotas:
+            # 配额抽到的结果是按分组排列的, 打乱顺序
+            self.random_state.shuffle(chosen)
+        return self.items[chosen[:count]].tolist()
@@ -1,8 +1,17 @@
 # -*- coding: utf8 -*-
-"""中间件"""
+"""中间件和分阶段耗时统计
+
+多进程模式: 启动gunicorn和celery worker之前把环境变量 prometheus_multiproc_dir 设为同一个空目录(每次部署前清空),
+每个进程把指标写到该目录下自己的mmap文件, /recommend/metrics 汇总目录下所有进程的指标, 包括同一台机器上的celery worker
+只部署celery worker的机器上用 python -m recommend.tools.trace <端口> 提供汇总的指标
+子指标在进程第一次记录时才创建(会打开当前进程的mmap文件), 所以fork之前的master进程里不能记录指标
+"""
 import os
+import sys
 import time
+import socket
 import logging
+from functools import wraps
 
 import requests
 from flask import (
@@ -10,21 +19,104 @@ from flask import (
     g,
 )
 from prometheus_client import (
+    CollectorRegistry,
     Counter,
     Histogram,
     generate_latest,
+    multiprocess,
+    start_http_server,
 )
 from werkzeug.contrib.fixers import ProxyFix
+from recommend.tools.lazy import lazy_property
 
 logger = logging.getLogger('recommend.file')
 
+multiprocess_dir = os.environ.get('prometheus_multiproc_dir')
+
+stage_latency = Histogram(
+    'recommend_stage_latency_millisecond',
+    'Stage latency (millisecond)',
+    ['stage', 'backend'],
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000))
+stage_exceptions = Counter(
+    'recommend_stage_exceptions_total',
+    'Total exceptions raised in stages',
+    ['stage', 'backend'])
+
+_stage_metrics = {}
+
+
+def _get_stage_metrics(stage, backend):
+    """取出(耗时直方图, 异常计数)的子指标, labels()要加锁查字典, 结果缓存起来
+    第一次记录时才创建, 不能在import时创建(见模块说明)
+    """
+    key = (stage, backend)
+    metrics = _stage_metrics.get(key)
+    if metrics is None:
+        metrics = _stage_metrics[key] = (
+            stage_latency.labels(stage, backend),
+            stage_exceptions.labels(stage, backend),
+        )
+    return metrics
+
+
+class span(object):
+    """记录一个阶段的耗时(毫秒)和异常次数, 可以作为上下文管理器或装饰器
+
+        with span('recommend_list.pop', 'redis'):
+            ...
+
+        @span('query_publish_id', 'publish')
+        def query_publish_id(video_ids):
+            ...
+
+    每次调用只多两次perf_counter和一次observe, 可以在线上一直开着
+
+    Args:
+        stage (str): 阶段名
+        backend (str): 耗时花在哪里: redis, es, publish, youtube, python, 包含多个后端的阶段用mixed
+    """
+
+    __slots__ = ('_key', '_start')
+
+    def __init__(self, stage, backend='python'):
+        self._key = (stage, backend)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = (time.perf_counter() - self._start) * 1000
+        latency, exceptions = _get_stage_metrics(*self._key)
+        latency.observe(elapsed)
+        if exc_type is not None:
+            exceptions.inc()
+
+    def __call__(self, func):
+        key = self._key
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 开始时间放在局部变量里, 多线程同时调用互不影响
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                latency, exceptions = _get_stage_metrics(*key)
+                latency.observe((time.perf_counter() - start) * 1000)
+                if failed:
+                    exceptions.inc()
+        return wrapper
+
 
 class MonitorMiddleware(object):
 
     def __init__(self, flask_app, metric_url):
         self.metric_url = metric_url
-        self.process_id = str(os.getpid())
-        self.instance_id = requests.get('http://169.254.169.254/latest/meta-data/instance-id').text
 
         flask_app.add_url_rule(metric_url, view_func=metrics, methods=['GET'])
 
@@ -33,23 +125,31 @@ class MonitorMiddleware(object):
         self.req_counter = Counter(
             'recommend_requests_total',
             'Total request counts',
-            ['method', 'endpoint', 'instance', 'process'])
+            ['method', 'endpoint', 'instance'])
         self.err_counter = Counter(
             'recommend_error_total',
             'Total error counts',
-            ['method', 'endpoint', 'instance', 'process'])
+            ['method', 'endpoint', 'instance'])
         self.resp_latency = Histogram(
             'recommend_response_latency_millisecond',
             'Response latency (millisecond)',
-            ['method', 'endpoint', 'instance', 'process'],
+            ['method', 'endpoint', 'instance'],
             buckets=(10, 20, 30, 50, 80, 100, 200, 300, 500, 1000, 2000, 3000))
 
+    @lazy_property
+    def instance_id(self):
+        """ec2实例id, 第一次使用时才查询, 查询失败时使用主机名"""
+        try:
+            return requests.get(
+                'http://169.254.169.254/latest/meta-data/instance-id', timeout=1).text
+        except requests.RequestException:
+            return socket.gethostname()
+
     def _label(self):
         return {
             'method': request.method,
             'endpoint': request.url_rule.rule,
             'instance': self.instance_id,
-            'process': self.process_id,
         }
 
     def log_response(self, response):
@@ -68,6 +168,32 @@ class MonitorMiddleware(object):
         self.err_counter.labels(**self._label()).inc()
 
 
+def collect_registry():
+    """多进程模式下汇总目录中所有进程的指标, 否则只有当前进程的指标"""
+    if not multiprocess_dir:
+        return None
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, multiprocess_dir)
+    return registry
+
+
 def metrics():
-    data = generate_latest()
+    registry = collect_registry()
+    data = generate_latest(registry) if registry else generate_latest()
     return data, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+
+def main():
+    """只部署celery worker的机器上单独提供汇总的指标
+
+        prometheus_multiproc_dir=/data/recommend/metrics python -m recommend.tools.trace 9101
+    """
+    if not multiprocess_dir:
+        sys.exit('prometheus_multiproc_dir is not set')
+    start_http_server(int(sys.argv[1]), registry=collect_registry())
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
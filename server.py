@@ -1,24 +1,32 @@
 # -*- coding: utf8 -*-
 """用户接口"""
-from flask import jsonify
+import ujson
+from flask import (
+    jsonify,
+    request,
+)
 from webargs import fields
+from marshmallow import validate
 
 from recommend import (
     flask_app,
     tasks,
 )
-from recommend.const import ReturnCode
-from recommend.tools.args import parser
+from recommend.const import (
+    ReturnCode,
+    valid_operations,
+)
+from recommend.tools.args import (
+    parser,
+    behavior_args,
+    recommend_args,
+)
 from recommend.algorithm.video.v1 import algorithm1
 from recommend.models import redis_client
 
 
 @flask_app.route('/recommend/device/video/behavior', methods=['POST'])
-@parser.use_args({
-    'device': fields.Str(required=True, location='json'),
-    'video_id': fields.Str(required=True, location='json'),
-    'operation': fields.Int(required=True, location='json'),
-})
+@parser.use_args(behavior_args)
 def device_video_behavior(args):
     device = args['device']
     video_id = args['video_id']
@@ -26,7 +34,7 @@ def device_video_behavior(args):
     if video_id:
         redis_key = 'operation|{}|{}|{}'.format(device, video_id, operation)
         if not redis_client.get(redis_key):
-            tasks.update_video_recommendation.delay(device, video_id, operation)
+            tasks.enqueue_video_recommendation(device, video_id, operation)
             redis_client.set(redis_key, 1, ex=300)
     return jsonify({
         "code": ReturnCode.success,
@@ -34,12 +42,82 @@ def device_video_behavior(args):
     })
 
 
+def parse_behavior_events(items, max_events=1000):
+    """校验批量上传的行为, 丢弃不合法的行为(包括不认识的操作类型)
+
+    Args:
+        items (iterable): 行为列表
+        max_events (int): 最多接受的行为个数
+    """
+    events, rejected = [], 0
+    for item in items:
+        if len(events) >= max_events:
+            rejected += 1
+            continue
+
+        try:
+            device = item['device']
+            video_id = item['video_id']
+            operation = int(item['operation'])
+        except (KeyError, TypeError, ValueError):
+            rejected += 1
+            continue
+
+        if not isinstance(device, str) or not isinstance(video_id, str) or not device:
+            rejected += 1
+            continue
+
+        if operation not in valid_operations:
+            rejected += 1
+            continue
+
+        if video_id:
+            events.append((device, video_id, operation))
+    return events, rejected
+
+
+def iter_ndjson(stream):
+    """逐行解析ndjson请求体
+
+    Args:
+        stream: 请求体
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield ujson.loads(line)
+        except ValueError:
+            yield None
+
+
+@flask_app.route('/recommend/device/video/behavior/bulk', methods=['POST'])
+def device_video_behavior_bulk():
+    if request.mimetype == 'application/x-ndjson':
+        items = iter_ndjson(request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return jsonify({'ret': -1, 'msg': 'params error'}), 400
+    events, rejected = parse_behavior_events(items)
+
+    # 一次pipeline完成所有行为的去重
+    pipe = redis_client.pipeline(transaction=False)
+    for device, video_id, operation in events:
+        redis_key = 'operation|{}|{}|{}'.format(device, video_id, operation)
+        pipe.set(redis_key, 1, ex=300, nx=True)
+    events = [x for x, is_new in zip(events, pipe.execute()) if is_new]
+    tasks.enqueue_video_recommendations(events)
+    return jsonify({
+        "code": ReturnCode.success,
+        "result": "ok",
+        "data": {'accepted': len(events), 'rejected': rejected},
+    })
+
+
 @flask_app.route('/recommend/device/video/recommend', methods=['GET'])
-@parser.use_args({
-    'device': fields.Str(required=True, location='query'),
-    'size': fields.Int(location='query'),
-    'version': fields.Int(location='query'),
-})
+@parser.use_args(recommend_args)
 def device_video_recommend(args):
     device = args['device']
     size = args.get('size', 10)
@@ -54,5 +132,32 @@ def device_video_recommend(args):
         "data": videos,
     })
 
+
+@flask_app.route('/recommend/device/video/recommend/batch', methods=['POST'])
+@parser.use_args({
+    'devices': fields.List(fields.Nested({
+        'device': fields.Str(required=True),
+        'size': fields.Int(missing=10),
+    }), required=True, location='json', validate=validate.Length(min=1, max=500)),
+    'version': fields.Int(location='json'),
+})
+def device_video_recommend_batch(args):
+    devices = [(x['device'], x['size']) for x in args['devices']]
+    version = args.get('version', 0)
+    results = algorithm1.batch_get_recommend_videos(devices)
+    if version >= 11300:
+        pub_map = algorithm1.query_publish_id(list({x for videos in results for x in videos}))
+        results = [
+            [{'video_id': x, 'publish_id': pub_map[x]} for x in videos if x in pub_map]
+            for videos in results
+        ]
+    return jsonify({
+        "code": ReturnCode.success,
+        "result": "ok",
+        "data": [{'device': device, 'videos': videos}
+                 for (device, _), videos in zip(devices, results)],
+    })
+
+
 if __name__ == '__main__':
     flask_app.run(host='0.0.0.0', port=30001)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""单元测试的公共配置, 不连接consul/redis/es/mysql
+
+    pip install -r requirements.txt -r tests/requirements.txt
+    python -m pytest tests
+"""
+import fakeredis
+import pytest
+
+from recommend import configure
+
+# 配置直接写入缓存, 不会访问consul
+configure.config_handler._values.update({
+    'MYSQL_URL': 'sqlite://',
+    'REDIS_URL': 'redis://127.0.0.1:6379/0',
+    'AMQP_URL': 'memory://',
+    'ES_HOSTS': '[]',
+    'PUBLISH_QUERY_URL': 'http://127.0.0.1:1/',
+})
+
+
+def lua_scripts():
+    from recommend.algorithm.video import lua
+    from recommend.tools import cache
+    return (lua.update_recommend_script, lua.pop_recommend_script, lua.coalesce_events_script,
+            cache.release_lock_script)
+
+
+@pytest.fixture
+def redis_client():
+    """把 recommend.models.redis_client 换成空的fakeredis, lua脚本重新注册到fakeredis上"""
+    from recommend import models
+    client = fakeredis.FakeStrictRedis()
+    client.flushall()
+    wrapped = models.redis_client._wrapped
+    object.__setattr__(models.redis_client, '_wrapped', client)
+    for script in lua_scripts():
+        object.__setattr__(script, '_wrapped', None)
+    yield client
+    object.__setattr__(models.redis_client, '_wrapped', wrapped)
+    for script in lua_scripts():
+        object.__setattr__(script, '_wrapped', None)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend.tools.args import (
+    ParamException,
+    load_args,
+    behavior_args,
+    recommend_args,
+)
+
+
+def test_load_args():
+    assert load_args(recommend_args, {'device': 'd1', 'size': '5'}) == {'device': 'd1', 'size': 5}
+    assert load_args(behavior_args, {'device': 'd1', 'video_id': 'v1', 'operation': 3})['operation'] == 3
+
+
+@pytest.mark.parametrize('data', [
+    {'device': 'd1', 'video_id': 'v1'},
+    {'device': 'd1', 'video_id': 'v1', 'operation': 'watch'},
+    {'device': 'd1', 'video_id': 'v1', 'operation': 99},
+])
+def test_load_args_raises_param_exception(data):
+    with pytest.raises(ParamException):
+        load_args(behavior_args, data)
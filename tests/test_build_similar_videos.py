@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from recommend.algorithm.video.similar_table import (
+    encode_similar_videos,
+    tag_digest,
+)
+from recommend.jobs.build_similar_videos import (
+    parse_digest,
+    plan_updates,
+)
+
+day = 86400
+
+
+def encoded(video_map):
+    """和redis中读出来的一样是bytes"""
+    return encode_similar_videos(video_map).encode('utf8')
+
+
+def make_state(docs, built_at):
+    return {video_id: (tag_digest(tags), built_at) for video_id, tags, _ in docs}
+
+
+def test_parse_digest():
+    assert parse_digest(b'0123456789abcdef 1530000000') == ('0123456789abcdef', 1530000000)
+    assert parse_digest(b'0123456789abcdef') == ('0123456789abcdef', 0)
+
+
+def test_unchanged_videos_are_skipped():
+    docs = [('v1', {'song'}, 10), ('v2', {'song'}, 20)]
+    neighbours = {b'v1': encoded({'v2': 20}), b'v2': encoded({'v1': 10})}
+    todo, removed = plan_updates(docs, make_state(docs, 0), lambda: neighbours.items(), day, 7 * day)
+    assert todo == [] and removed == set()
+
+
+def test_neighbours_of_changed_and_removed_videos_are_recomputed():
+    old = [('v1', {'song'}, 10), ('v2', {'song'}, 20), ('v3', {'funny'}, 30), ('v4', {'news'}, 40)]
+    neighbours = {
+        b'v1': encoded({'v2': 20}),
+        b'v2': encoded({'v1': 10}),
+        b'v3': encoded({'v4': 40}),
+        b'v4': encoded({}),
+    }
+    # v1的标签变了, v4不再可推荐
+    docs = [('v1', {'song', 'hd'}, 10), ('v2', {'song'}, 20), ('v3', {'funny'}, 30)]
+    todo, removed = plan_updates(docs, make_state(old, 0), lambda: neighbours.items(), day, 7 * day)
+    assert [x for x, _ in todo] == ['v1', 'v2', 'v3']
+    assert removed == {'v4'}
+
+
+def test_old_entries_and_full_rebuild():
+    docs = [('v1', {'song'}, 10), ('v2', {'funny'}, 20)]
+    state = make_state(docs, 0)
+    state['v2'] = (state['v2'][0], 7 * day)
+    todo, _ = plan_updates(docs, state, lambda: [], 8 * day + 1, 7 * day)
+    assert [x for x, _ in todo] == ['v1']
+
+    todo, _ = plan_updates(docs, state, lambda: [], 8 * day + 1, 7 * day, full=True)
+    assert [x for x, _ in todo] == ['v1', 'v2']
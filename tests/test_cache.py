@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import time
+
+from recommend.tools.cache import (
+    TTLCache,
+    TieredCache,
+    RefreshingCache,
+)
+
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=-1)
+    assert cache.get('b', None) is None
+
+    cache.set('c', 3)
+    cache.get('a')
+    cache.set('d', 4)
+    assert cache.get('c', None) is None
+    assert (cache.get('a'), cache.get('d')) == (1, 4)
+
+
+def test_tiered_cache_reads_through_redis(redis_client):
+    writer = TieredCache('test', ttl=60)
+    reader = TieredCache('test', ttl=60)
+    writer.set('k', {'v': 1})
+    assert reader.get_many(['k', 'missing']) == {'k': {'v': 1}}
+
+
+def test_get_or_create_caches_value_and_releases_lock(redis_client):
+    cache = RefreshingCache('test', redis_ttl=3600)
+    calls = []
+
+    def creator(x):
+        calls.append(x)
+        return {'x': x}
+
+    assert cache.get_or_create('k', creator, 1) == {'x': 1}
+    assert cache.get_or_create('k', creator, 2) == {'x': 1}
+    assert calls == [1]
+    assert not redis_client.exists(cache._lock_key('k'))
+
+
+def test_release_keeps_lock_taken_by_another_worker(redis_client):
+    cache = RefreshingCache('test', lock_timeout=10)
+    lock_key = cache._lock_key('k')
+    token = cache._acquire(lock_key)
+    assert token is not None
+    assert cache._acquire(lock_key) is None
+
+    # 计算超过了锁的过期时间, 其它进程重新加了锁
+    redis_client.delete(lock_key)
+    other = cache._acquire(lock_key)
+    cache._release(lock_key, token)
+    assert redis_client.get(lock_key) == other.encode('utf8')
+
+    cache._release(lock_key, other)
+    assert not redis_client.exists(lock_key)
+
+
+def test_stale_value_is_refreshed_in_background(redis_client):
+    cache = RefreshingCache('test', redis_ttl=100, refresh_ratio=0.5)
+    cache.set('k', ({'x': 1}, time.time() - 60))
+    assert cache.get_or_create('k', lambda: {'x': 2}) == {'x': 1}
+
+    cache._executor.shutdown(wait=True)
+    cache._local.delete('k')
+    assert cache.get('k')[0] == {'x': 2}
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from recommend.algorithm.video.crawler import VideoCrawler
+
+
+def test_request_submits_once_and_pops_waiting(redis_client):
+    crawler = VideoCrawler(extractor_factory=object)
+    assert crawler.request('v1', 'd1', 1)
+    assert not crawler.request('v1', 'device with spaces', 3)
+
+    assert crawler._pop_waiting('v1') == [('d1', 1), ('device with spaces', 3)]
+    assert crawler._pop_waiting('v1') == []
+    assert crawler.request('v1')
+
+
+def test_failed_crawl_is_not_retried(redis_client):
+    crawler = VideoCrawler(extractor_factory=object)
+    crawler.request('v1', 'd1', 1)
+    crawler._pop_waiting('v1', failed=True)
+    assert crawler.is_failed('v1')
+    assert not crawler.request('v1', 'd2', 1)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend.algorithm.video import hot_pool
+from recommend.algorithm.video.hot_pool import HotVideoPool
+
+
+@pytest.fixture
+def pool(redis_client, tmpdir):
+    pool = HotVideoPool('test_hot_video', [(None, 10)], refresh_interval=86400, retry_interval=0)
+    pool.snapshot_path = str(tmpdir.join('test_hot_video.json'))
+    return pool
+
+
+def test_empty_first_load_is_retried(pool, monkeypatch):
+    monkeypatch.setattr(hot_pool, 'query_hot_videos', lambda tags: ({}, {}))
+    assert pool.get_videos() == {}
+    assert pool.sample(5) == []
+
+    videos = {'v1': 8.0, 'v2': 7.5}
+    monkeypatch.setattr(hot_pool, 'query_hot_videos', lambda tags: (videos, {'v1': '', 'v2': ''}))
+    assert pool.get_videos() == videos
+    assert sorted(pool.sample(5)) == ['v1', 'v2']
+
+
+def test_failed_load_waits_for_retry_interval(pool, monkeypatch):
+    calls = []
+
+    def query(tags):
+        calls.append(tags)
+        raise IOError('es unavailable')
+
+    monkeypatch.setattr(hot_pool, 'query_hot_videos', query)
+    pool.retry_interval = 60
+    assert pool.sample(5) == []
+    assert pool.sample(5) == []
+    assert len(calls) == 1
+
+
+def test_load_from_snapshot(pool, monkeypatch):
+    monkeypatch.setattr(hot_pool, 'query_hot_videos', lambda tags: ({'v1': 8.0}, {'v1': ''}))
+    pool.get_videos()
+
+    other = HotVideoPool('test_hot_video', [(None, 10)], refresh_interval=86400)
+    other.snapshot_path = pool.snapshot_path
+    monkeypatch.setattr(hot_pool, 'query_hot_videos', lambda tags: pytest.fail('should use snapshot'))
+    assert other.get_videos() == {'v1': 8.0}
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend.algorithm.video.v1 import algorithm1
+from recommend.algorithm.video.v2 import algorithm2
+
+
+@pytest.fixture(params=[algorithm1, algorithm2], ids=['v1', 'v2'])
+def algorithm(request, redis_client, monkeypatch):
+    """热门视频池固定为 hot0...hot9, 记录抽取次数"""
+    algorithm = request.param
+    algorithm.samples = []
+
+    def sample(size):
+        algorithm.samples.append(size)
+        return ['hot{}'.format(i) for i in range(10)]
+
+    monkeypatch.setattr(algorithm.hot_pool, 'sample', sample)
+    yield algorithm
+    del algorithm.samples
+
+
+def test_pop_from_warm_list_does_not_sample_hot_videos(algorithm, redis_client):
+    redis_client.zadd('device|d1|recommend', 3, 'a', 2, 'b', 1, 'c')
+    assert algorithm.get_recommend_videos('d1', 2) == ['a', 'b']
+    assert algorithm.get_recommend_videos('d1', 2) == ['c']
+    assert algorithm.samples == []
+
+
+def test_empty_list_is_filled_with_unseen_hot_videos(algorithm, redis_client):
+    assert algorithm.get_recommend_videos('d1', 4) == ['hot0', 'hot1', 'hot2', 'hot3']
+    assert len(algorithm.samples) == 1
+    assert redis_client.zcard('device|d1|recommend') == 6
+
+    redis_client.delete('device|d1|recommend')
+    assert algorithm.get_recommend_videos('d1', 4) == ['hot4', 'hot5', 'hot6', 'hot7']
+
+
+def test_batch_fills_only_empty_lists(algorithm, redis_client):
+    redis_client.zadd('device|d1|recommend', 2, 'a', 1, 'b')
+    assert algorithm.batch_get_recommend_videos([('d1', 5), ('d2', 2), ('d3', 0)]) == [
+        ['a', 'b'], ['hot0', 'hot1'], []]
+    assert len(algorithm.samples) == 2
+
+
+def test_empty_hot_pool_returns_nothing(algorithm, redis_client, monkeypatch):
+    """热门视频池为空(没有加载到)时, 带上热门视频的第二次调用也返回0, 不推荐视频"""
+    monkeypatch.setattr(algorithm.hot_pool, 'sample', lambda size: [])
+    redis_client.zadd('device|d1|recommend', 1, 'a')
+    assert algorithm.get_recommend_videos('d2', 4) == []
+    assert algorithm.batch_get_recommend_videos([('d1', 2), ('d2', 2)]) == [['a'], []]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+
+from recommend.tools.publish import PublishClient
+
+
+def test_claim_chunks_misses_and_waits_for_pending_requests():
+    client = PublishClient(chunk_size=2)
+    running = Future()
+    pending = {'v1': running}
+
+    futures, chunks = client.claim(['v1', 'v2', 'v3', 'v2', 'v4'], pending, Future)
+    assert [chunk for chunk, _ in chunks] == [['v2', 'v3'], ['v4']]
+    assert futures == {running} | {future for _, future in chunks}
+    assert pending['v2'] is pending['v3'] is chunks[0][1]
+
+    client.release(pending, ['v2', 'v3'], chunks[0][1])
+    assert sorted(pending) == ['v1', 'v4']
+
+
+def test_store_caches_missing_publish_ids():
+    client = PublishClient()
+    res = {'data': [{'res_id': 'v1', 'pub_ids': ['p1']}, {'res_id': 'v2', 'pub_ids': []}]}
+    assert client.store(['v1', 'v2'], res) == {'v1': 'p1'}
+    assert client.lookup(['v1', 'v2', 'v3']) == ({'v1': 'p1'}, ['v3'])
+    assert client.select(['v3', 'v1'], {'v1': 'p1'}) == {'v1': 'p1'}
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+
+import numpy as np
+
+from recommend.tools.sampler import (
+    AliasTable,
+    WeightedSampler,
+)
+
+
+def test_alias_table_follows_weights():
+    weights = [1.0, 2.0, 3.0, 4.0]
+    drawn = AliasTable(weights).draw(100000, np.random.RandomState(1))
+    counts = np.bincount(drawn, minlength=len(weights)) / 100000.0
+    assert np.allclose(counts, np.array(weights) / sum(weights), atol=0.01)
+
+
+def test_alias_table_skips_zero_weight():
+    drawn = AliasTable([0.0, 1.0, 0.0, 1.0]).draw(10000, np.random.RandomState(1))
+    assert set(drawn.tolist()) == {1, 3}
+
+
+def test_sample_distinct_and_excluded():
+    items = ['v{}'.format(i) for i in range(50)]
+    sampler = WeightedSampler(items, range(1, 51))
+    for _ in range(20):
+        result = sampler.sample(10, exclude=['v49', 'v48', 'unknown'])
+        assert len(result) == len(set(result)) == 10
+        assert not {'v49', 'v48'} & set(result)
+
+
+def test_sample_more_than_available():
+    sampler = WeightedSampler(['a', 'b', 'c'], [1, 1, 1])
+    assert sorted(sampler.sample(10, exclude=['a'])) == ['b', 'c']
+    assert WeightedSampler([], []).sample(3) == []
+
+
+def test_sample_prefers_heavy_items():
+    sampler = WeightedSampler(['light', 'heavy'], [1, 99])
+    counts = Counter(sampler.sample(1)[0] for _ in range(1000))
+    assert counts['heavy'] > counts['light'] * 10
+
+
+def test_sample_with_quotas():
+    items = ['a{}'.format(i) for i in range(10)] + ['b{}'.format(i) for i in range(10)]
+    groups = ['a'] * 10 + ['b'] * 10
+    sampler = WeightedSampler(items, [1] * 10 + [100] * 10, groups)
+    for _ in range(20):
+        result = sampler.sample(6, quotas={'a': 4, 'unknown': 3})
+        assert len(set(result)) == 6
+        assert sum(x.startswith('a') for x in result) >= 4
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from math import log10
+
+import numpy as np
+import pytest
+
+from recommend.algorithm.video.scoring import (
+    collect_scores,
+    merge_scores,
+    top_k,
+)
+
+
+def reference_scores(similar_maps, weights, exclude=()):
+    """逐个视频累加的写法, 和 collect_scores 的定义一致"""
+    init, incr = {}, {}
+    for weight, video_map in zip(weights, similar_maps):
+        for video, hot in video_map.items():
+            if video not in init:
+                init[video] = log10(hot)
+            else:
+                init[video] += weight * log10(hot)
+            incr[video] = incr.get(video, 0) + weight * log10(hot)
+    return {x: (init[x], incr[x]) for x in init if x not in exclude}
+
+
+def as_dict(ids, init, incr):
+    return {x: (a, b) for x, a, b in zip(ids.tolist(), init.tolist(), incr.tolist())}
+
+
+def test_collect_scores_matches_reference():
+    similar_maps = [{'a': 1000, 'b': 100}, {'b': 10000, 'c': 10}, {'a': 100, 'd': 1000}]
+    weights = [1, 2, 0.5]
+    ids, init, incr = collect_scores(similar_maps, weights, exclude=['d'])
+    expected = reference_scores(similar_maps, weights, exclude=['d'])
+
+    assert ids.tolist() == ['a', 'b', 'c']
+    result = as_dict(ids, init, incr)
+    for video, (a, b) in expected.items():
+        assert result[video] == (pytest.approx(a), pytest.approx(b))
+
+
+def test_collect_scores_empty():
+    ids, init, incr = collect_scores([{}, {}], [1, 2])
+    assert len(ids) == len(init) == len(incr) == 0
+
+
+def test_merge_scores():
+    ids = np.array(['b', 'c', 'd'], dtype=object)
+    init = np.array([5.0, 6.0, 7.0])
+    incr = np.array([1.0, 2.0, 3.0])
+    merged_ids, scores = merge_scores(
+        ['a', 'b', 'seed'], [1.0, 2.0, 3.0], ids, init, incr, drop=['seed'], new_excluded=['d'])
+
+    # b已在列表中加增量, c不在列表中用分值, d推荐过不能加入, 种子视频从列表中删除
+    assert dict(zip(merged_ids.tolist(), scores.tolist())) == {'a': 1.0, 'b': 3.0, 'c': 6.0}
+
+
+def test_merge_scores_keeps_excluded_video_already_in_list():
+    merged_ids, scores = merge_scores(
+        ['a'], [1.0], np.array(['a'], dtype=object), np.array([5.0]), np.array([2.0]),
+        new_excluded=['a'])
+    assert dict(zip(merged_ids.tolist(), scores.tolist())) == {'a': 3.0}
+
+
+def test_top_k():
+    ids = np.array(['a', 'b', 'c', 'd', 'e'], dtype=object)
+    scores = np.array([3.0, -1.0, 5.0, 1.0, 4.0])
+    top_ids, top_scores = top_k(ids, scores, 3)
+    assert sorted(zip(top_ids.tolist(), top_scores.tolist())) == [('a', 3.0), ('c', 5.0), ('e', 4.0)]
+
+    top_ids, _ = top_k(ids, scores, 10)
+    assert sorted(top_ids.tolist()) == ['a', 'c', 'd', 'e']
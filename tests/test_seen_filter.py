@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from recommend.algorithm.video.seen_filter import (
+    seen_keys,
+    seen_window,
+    seen_filter_bits,
+    seen_filter_capacity,
+    is_seen,
+    mark_seen,
+    estimate_items,
+    estimate_bit_count,
+)
+from recommend.algorithm.video.lua import pop_recommend_script
+
+
+def test_keys_carry_filter_size_and_window():
+    now = seen_window * 10 + 5
+    assert seen_keys('d1', now) == [
+        'device|d1|seen|{}|10'.format(seen_filter_bits),
+        'device|d1|seen|{}|9'.format(seen_filter_bits),
+    ]
+
+
+def test_marked_videos_are_seen(redis_client):
+    pipe = redis_client.pipeline()
+    mark_seen(pipe, 'd1', ['a', 'b'])
+    pipe.execute()
+
+    bitmaps = redis_client.mget(seen_keys('d1'))
+    assert is_seen(bitmaps, 'a')
+    assert is_seen(bitmaps, 'b')
+    assert not is_seen(bitmaps, 'c')
+    assert not is_seen([None, None], 'a')
+    assert redis_client.ttl(seen_keys('d1')[0]) > seen_window
+
+
+def test_previous_window_is_still_checked(redis_client):
+    pipe = redis_client.pipeline()
+    mark_seen(pipe, 'd1', ['a'])
+    pipe.execute()
+
+    current, _ = seen_keys('d1')
+    bitmaps = [None, redis_client.get(current)]
+    assert is_seen(bitmaps, 'a')
+
+
+def test_lua_and_python_use_the_same_offsets(redis_client):
+    """pop脚本写入的过滤器Python能读, Python写入的过滤器pop脚本会跳过"""
+    keys = ['device|d1|recommend'] + seen_keys('d1')
+    assert pop_recommend_script(keys=keys, args=[2, seen_window * 2, 60, 'a', 'b', 'c']) == [
+        b'a', b'b']
+    bitmaps = redis_client.mget(seen_keys('d1'))
+    assert is_seen(bitmaps, 'a') and is_seen(bitmaps, 'b')
+    assert not is_seen(bitmaps, 'c')
+
+    pipe = redis_client.pipeline()
+    mark_seen(pipe, 'd1', ['d'])
+    pipe.execute()
+    redis_client.delete(keys[0])
+    assert pop_recommend_script(keys=keys, args=[2, seen_window * 2, 60, 'a', 'd', 'e', 'f']) == [
+        b'e', b'f']
+
+
+def test_estimate_items(redis_client):
+    assert estimate_items(None) == 0
+
+    video_ids = ['video{}'.format(i) for i in range(seen_filter_capacity)]
+    pipe = redis_client.pipeline()
+    mark_seen(pipe, 'd1', video_ids)
+    pipe.execute()
+    bitmap = redis_client.get(seen_keys('d1')[0])
+    estimated = estimate_items(bitmap)
+    assert abs(estimated - seen_filter_capacity) < seen_filter_capacity * 0.1
+    assert estimate_bit_count(redis_client.bitcount(seen_keys('d1')[0])) == estimated
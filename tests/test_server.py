@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend import flask_app
+from recommend.const import Operation
+from server import parse_behavior_events
+
+
+def test_parse_behavior_events_rejects_invalid_items():
+    items = [
+        {'device': 'd1', 'video_id': 'v1', 'operation': Operation.watch},
+        {'device': 'd1', 'video_id': 'v2', 'operation': '2'},
+        {'device': 'd1', 'video_id': 'v3', 'operation': 99},
+        {'device': 'd1', 'video_id': 'v4', 'operation': 0},
+        {'device': 'd1', 'video_id': 'v5', 'operation': 'watch'},
+        {'device': '', 'video_id': 'v6', 'operation': 1},
+        {'device': 'd1', 'operation': 1},
+        None,
+        {'device': 'd1', 'video_id': '', 'operation': 1},
+    ]
+    events, rejected = parse_behavior_events(items)
+    assert events == [('d1', 'v1', Operation.watch), ('d1', 'v2', Operation.collect)]
+    assert rejected == 6
+
+
+def test_parse_behavior_events_limits_batch_size():
+    items = [{'device': 'd1', 'video_id': 'v{}'.format(i), 'operation': 1} for i in range(5)]
+    events, rejected = parse_behavior_events(items, max_events=3)
+    assert len(events) == 3
+    assert rejected == 2
+
+
+@pytest.mark.parametrize('operation', [99, 'watch', None])
+def test_behavior_endpoint_rejects_invalid_operation(redis_client, operation):
+    client = flask_app.test_client()
+    resp = client.post('/recommend/device/video/behavior',
+                       json={'device': 'd1', 'video_id': 'v1', 'operation': operation})
+    assert resp.status_code == 400
+    assert resp.get_json() == {'ret': -1, 'msg': 'params error'}
+    assert not redis_client.keys('device|d1|*')
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend.algorithm.video import (
+    v1,
+    v2,
+)
+
+
+class FakeVectorIndex(object):
+
+    def query(self, tags, size, exclude=None):
+        return {'vector': 1.0}
+
+
+@pytest.fixture(params=[(v1, v1.algorithm1), (v2, v2.algorithm2)], ids=['v1', 'v2'])
+def algorithm(request, monkeypatch):
+    """有标签向量索引, 相似视频表由各个测试设置"""
+    module, algorithm = request.param
+    monkeypatch.setattr(module, 'get_tag_vector_index', lambda: FakeVectorIndex())
+    algorithm.module = module
+    yield algorithm
+    del algorithm.module
+
+
+def test_precomputed_table_shadows_vector_index(algorithm, monkeypatch):
+    monkeypatch.setattr(algorithm.module, 'get_precomputed_similar_videos',
+                        lambda video_id, size: {'table': 1.0})
+    assert algorithm._compute_similar_videos('v', 10) == {'table': 1.0}
+
+
+def test_vector_index_is_used_when_table_misses(algorithm, monkeypatch):
+    monkeypatch.setattr(algorithm.module, 'get_precomputed_similar_videos', lambda video_id, size: None)
+    monkeypatch.setattr(algorithm, '_get_video_tag', lambda video_id: ['tag'])
+    assert algorithm._compute_similar_videos('v', 10) == {'vector': 1.0}
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import os
+
+from recommend.algorithm.video.tag_index import swap_index_link
+
+
+def build(path, generation):
+    data_path = '{}.{}'.format(path, generation)
+    os.makedirs(data_path)
+    swap_index_link(data_path, path)
+    return data_path
+
+
+def test_previous_generation_is_kept_until_next_swap(tmpdir):
+    path = str(tmpdir.join('index'))
+    first = build(path, 1)
+    assert os.path.realpath(path) == first
+
+    second = build(path, 2)
+    assert os.path.realpath(path) == second
+    assert os.path.isdir(first)
+
+    third = build(path, 3)
+    assert os.path.realpath(path) == third
+    assert os.path.isdir(second)
+    assert not os.path.exists(first)
+
+
+def test_other_files_in_directory_are_untouched(tmpdir):
+    path = str(tmpdir.join('index'))
+    tmpdir.mkdir('index_other.1')
+    tmpdir.mkdir('other.1')
+    tmpdir.join('index.lock').write('')
+    for generation in range(3):
+        build(path, generation)
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'index', 'index.1', 'index.2', 'index.lock', 'index_other.1', 'other.1']
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from recommend import tasks
+
+
+class RecordingAlgorithm(object):
+
+    def __init__(self, pending=()):
+        self.events = []
+        self.pending = list(pending)
+
+    def update_recommend_events(self, device, events):
+        self.events.append((device, events))
+        return [x for x in events if x in self.pending]
+
+
+class RecordingWriter(object):
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, device, video, operation):
+        self.rows.append((device, video, operation))
+
+
+@pytest.fixture(autouse=True)
+def behavior_writer(monkeypatch):
+    """任务写入的行为记在列表里, 不写数据库"""
+    writer = RecordingWriter()
+    monkeypatch.setattr(tasks, 'behavior_writer', writer)
+    return writer
+
+
+def test_coalesced_events_keep_video_ids_with_spaces(redis_client, monkeypatch):
+    algorithm = RecordingAlgorithm()
+    monkeypatch.setattr(tasks, 'get_algorithm', lambda device: algorithm)
+    redis_client.rpush('device|d1|events', 'v1 1', 'video with spaces 3')
+    redis_client.set('device|d1|events_scheduled', 1)
+
+    tasks.update_video_recommendation_events('d1')
+
+    assert algorithm.events == [('d1', [('v1', 1), ('video with spaces', 3)])]
+    assert not redis_client.exists('device|d1|events')
+    assert not redis_client.exists('device|d1|events_scheduled')
+
+
+def test_group_device_events_keeps_order():
+    events = [('d1', 'v1', 1), ('d2', 'v2', 1), ('d1', 'v3', 2)]
+    assert list(tasks.group_device_events(events).items()) == [
+        ('d1', [('v1', 1), ('v3', 2)]), ('d2', [('v2', 1)])]
+
+
+def test_enqueue_coalesces_events_and_schedules_each_device_once(redis_client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(tasks, 'behavior_coalesce_window', 5)
+    monkeypatch.setattr(tasks, 'schedule_event_tasks', scheduled.extend)
+
+    tasks.enqueue_video_recommendations([('d1', 'v1', 1), ('d2', 'v 2', 2), ('d1', 'v3', 3)])
+    tasks.enqueue_video_recommendations([('d2', 'v4', 1), ('d3', 'v5', 1)])
+
+    assert scheduled == ['d1', 'd2', 'd3']
+    assert redis_client.lrange('device|d1|events', 0, -1) == [b'v1 1', b'v3 3']
+    assert redis_client.lrange('device|d2|events', 0, -1) == [b'v 2 2', b'v4 1']
+    assert 0 < redis_client.ttl('device|d1|events_scheduled') <= 15
+
+
+def test_bulk_task_continues_after_a_failing_device(monkeypatch):
+    algorithm = RecordingAlgorithm()
+    update = algorithm.update_recommend_events
+
+    def update_recommend_events(device, events):
+        if device == 'd1':
+            raise KeyError(events[0][1])
+        return update(device, events)
+
+    algorithm.update_recommend_events = update_recommend_events
+    monkeypatch.setattr(tasks, 'get_algorithm', lambda device: algorithm)
+
+    tasks.update_video_recommendation_bulk({'d1': [('v1', 99)], 'd2': [('v2', 1)]})
+
+    assert algorithm.events == [('d2', [('v2', 1)])]
+
+
+def test_drain_skips_unknown_operations(redis_client, monkeypatch):
+    algorithm = RecordingAlgorithm()
+    monkeypatch.setattr(tasks, 'get_algorithm', lambda device: algorithm)
+    redis_client.rpush('device|d1|events', 'v1 1', 'v2 99', 'v3 x', 'nospace', 'v4 5')
+
+    tasks.update_video_recommendation_events('d1')
+
+    assert algorithm.events == [('d1', [('v1', 1), ('v4', 5)])]
+
+
+def test_tasks_record_behaviors(monkeypatch, redis_client, behavior_writer):
+    algorithm = RecordingAlgorithm()
+    monkeypatch.setattr(tasks, 'get_algorithm', lambda device: algorithm)
+    redis_client.rpush('device|d1|events', 'v1 1', 'v2 2')
+
+    tasks.update_video_recommendation_events('d1')
+    tasks.update_video_recommendation_bulk({'d2': [('v3', 3)]})
+    tasks.update_video_recommendation('d3', 'v4', 4)
+
+    assert behavior_writer.rows == [('d1', 'v1', 1), ('d1', 'v2', 2), ('d2', 'v3', 3), ('d3', 'v4', 4)]
+
+
+def test_pending_behaviors_are_recorded_after_crawl(monkeypatch, behavior_writer):
+    """等待爬取的行为爬取之后会重新提交, 那时才记录"""
+    crawls = []
+    algorithm = RecordingAlgorithm(pending=[('new', 1)])
+    monkeypatch.setattr(tasks, 'get_algorithm', lambda device: algorithm)
+    monkeypatch.setattr(tasks, 'request_crawl', lambda device, events: crawls.append((device, events)))
+
+    tasks.update_video_recommendation_bulk({'d1': [('old', 2), ('new', 1)]})
+    assert behavior_writer.rows == [('d1', 'old', 2)]
+    assert crawls == [('d1', [('new', 1)])]
+
+    algorithm.pending = []
+    tasks.update_video_recommendation_bulk({'d1': [('new', 1)]})
+    assert behavior_writer.rows == [('d1', 'old', 2), ('d1', 'new', 1)]
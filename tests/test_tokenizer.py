@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import re
+import random
+
+import pytest
+
+from recommend.algorithm.video import stop_words_set
+from recommend.algorithm.video.tokenizer import (
+    punctuations,
+    tokenize,
+    tokenize_batch,
+)
+
+# 原来逐个替换的标点, 和 tokenizer.punctuations 分开写, 两边不一致时测试能发现
+legacy_punctuations = ',|#@~\'"\\/_-[]+*{};:`=【】().’?'
+legacy_emoji_pattern = re.compile('[\U0001F300-\U0001F64F\U0001F680-\U0001F6FF\u2600-\u2B55]+')
+
+
+def legacy_tokenize(title, tags):
+    """原来 VideoAlgorithmV1._get_video_tag 的分词逻辑, 原样保留用来对比"""
+    video_tag = list(tags)
+    video_tag.append(title)
+    sentence = ' '.join(video_tag)
+    sentence = sentence.lower()
+    sentence = legacy_emoji_pattern.sub(' ', sentence)
+    sentence = sentence.replace(",", " ").replace("|", " ").replace("#", " "). \
+        replace("@", " ").replace("~", " ").replace("'", " ").replace("\"", " "). \
+        replace("\\", " ").replace("/", " ").replace("_", " ").replace("-", " "). \
+        replace("[", " ").replace("]", " ").replace("+", " ").replace("*", " "). \
+        replace("{", " ").replace("}", " ").replace(";", " ").replace(":", " "). \
+        replace("`", " ").replace("=", " ").replace("【", " ").replace("】", " "). \
+        replace("(", " ").replace(")", " ").replace(".", " ").replace("’", " "). \
+        replace("?", " ")
+    words = sentence.split(' ')
+
+    tags = set()
+    for word in words:
+        if not word:
+            continue
+
+        if len(word) == 1 or len(word) > 30:
+            continue
+
+        if word in stop_words_set:
+            continue
+
+        tags.add(word)
+    return tags
+
+
+def make_corpus(count, seed=1):
+    """随机拼接ascii和非ascii单词, 标点, 停用词和长度边界附近的单词"""
+    rng = random.Random(seed)
+    stop_words = sorted(stop_words_set)[:20]
+    words = ['Bollywood', 'Songs', 'FUNNY', 'Video', 'HD', 'x', 'ab', 'y' * 30, 'z' * 31,
+             'Σίσυφος', 'गाना', 'ΑΒ', 'Ö', '\U0001F600', '❤', '☀sun', 'émoji\U0001F680'] + \
+        stop_words + [x.upper() for x in stop_words[:5]]
+    separators = list(legacy_punctuations) + [' ', ' ', '  ', '\t', '\n', '!', '&']
+    corpus = []
+    for _ in range(count):
+        def text(length):
+            return ''.join(rng.choice(words) + rng.choice(separators) for _ in range(length))
+        ascii_only = rng.random() < 0.5
+        title, tags = text(rng.randint(0, 12)), [text(rng.randint(1, 3)) for _ in range(rng.randint(0, 6))]
+        if ascii_only:
+            title = title.encode('ascii', 'ignore').decode('ascii')
+            tags = [x.encode('ascii', 'ignore').decode('ascii') for x in tags]
+        corpus.append((title, tags))
+    return corpus
+
+
+def test_split_punctuations_and_lower():
+    assert tokenize('Funny-Video|HD', ['Bollywood_Songs', 'Cricket#2018']) == {
+        'funny', 'video', 'hd', 'bollywood', 'songs', 'cricket', '2018'}
+
+
+def test_drop_short_long_and_stop_words():
+    assert tokenize('a the Song {}'.format('x' * 31), ['of']) == {'song'}
+
+
+def test_non_ascii_text():
+    assert tokenize('गाना\U0001F600Song', ['Σίσυφος❤']) == {'गाना', 'song', 'σίσυφος'}
+
+
+def test_ascii_and_non_ascii_paths_agree():
+    """纯ascii文本走转换表, 加上emoji后走正则和逐个替换, 两种方式的结果应该一样"""
+    rng = random.Random(1)
+    words = ['Bollywood', 'Songs', 'Funny', 'Video', 'HD', 'Full', 'Movie', 'The', 'and', 'x' * 31, 'a']
+    separators = list(punctuations.encode('ascii', 'ignore').decode('ascii')) + [' ', '\t']
+    for _ in range(500):
+        title = ''.join(rng.choice(words) + rng.choice(separators) for _ in range(12))
+        tags = [rng.choice(words) + rng.choice(separators) + rng.choice(words)
+                for _ in range(rng.randint(0, 5))]
+        assert tokenize(title + '\U0001F600', tags) == tokenize(title, tags), (title, tags)
+
+
+@pytest.mark.parametrize('title, tags', [
+    ('', []),
+    ('a', ['I', 'of']),
+    ('The Movie', ['THE', 'And']),
+    ('{} {}'.format('y' * 30, 'z' * 31), ['xy']),
+    ('【Official】Trailer’s (HD)?', ['x.y.z', 'a_b-c']),
+    ('Funny\tVideo\nHD', ['  spaced  ']),
+    ('गाना\U0001F600Song', ['Σίσυφος❤', '☀']),
+    ('ÖL', ['ÄB cd']),
+])
+def test_matches_legacy_tokenizer(title, tags):
+    assert tokenize(title, tags) == legacy_tokenize(title, tags)
+
+
+def test_matches_legacy_tokenizer_on_random_corpus():
+    for title, tags in make_corpus(2000):
+        assert tokenize(title, tags) == legacy_tokenize(title, tags), (title, tags)
+
+
+def test_tokenize_batch():
+    docs = [('Funny Video', ['HD']), ('गाना', None), ('', [])]
+    assert tokenize_batch(docs) == [tokenize(title, tags) for title, tags in docs]
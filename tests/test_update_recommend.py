@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import pytest
+from prometheus_client import REGISTRY
+
+from recommend.const import Operation
+from recommend.algorithm.video import (
+    v1,
+    v2,
+)
+from recommend.algorithm.video.seen_filter import (
+    seen_keys,
+    is_seen,
+    mark_seen,
+)
+
+similar_videos = {
+    'seed1': {'a': 1000, 'b': 100, 'c': 10000},
+    'seed2': {'b': 1000, 'd': 100, 'seed1': 10},
+}
+
+
+@pytest.fixture(params=[(v1, v1.algorithm1), (v2, v2.algorithm2)], ids=['v1', 'v2'])
+def algorithm(request, redis_client, monkeypatch):
+    """相似视频固定为 similar_videos, 没有协同过滤, 测试结束后恢复 atomic_update"""
+    module, algorithm = request.param
+    monkeypatch.setattr(algorithm, 'get_similar_videos', lambda video, size: similar_videos[video])
+    monkeypatch.setattr(module, 'get_co_watched_videos', lambda video, size: None)
+    monkeypatch.setattr(algorithm, 'atomic_update', algorithm.atomic_update)
+    return algorithm
+
+
+def update(algorithm, redis_client, atomic_update):
+    """两个种子视频的行为更新设备d1的推荐列表, 返回推荐列表"""
+    redis_client.flushall()
+    redis_client.zadd('device|d1|recommend', 5, 'a', 1, 'old', 2, 'seed1')
+    pipe = redis_client.pipeline()
+    mark_seen(pipe, 'd1', ['d'])
+    pipe.execute()
+
+    algorithm.atomic_update = atomic_update
+    events = [('seed1', Operation.watch), ('seed2', Operation.watch)]
+    assert algorithm.update_recommend_events('d1', events) == []
+    return dict(redis_client.zrange('device|d1|recommend', 0, -1, withscores=True))
+
+
+def test_lua_and_python_merge_agree(algorithm, redis_client):
+    incr = update(algorithm, redis_client, True)
+    merged = update(algorithm, redis_client, False)
+    assert sorted(incr) == sorted(merged) == [b'a', b'b', b'c', b'old']
+    for key in incr:
+        assert incr[key] == pytest.approx(merged[key])
+    # a已在推荐列表中, 只加增量
+    assert incr[b'a'] > 5 and incr[b'a'] < 6
+    assert incr[b'old'] == 1
+
+
+def test_seeds_are_marked_seen(algorithm, redis_client):
+    for atomic_update in (True, False):
+        update(algorithm, redis_client, atomic_update)
+        bitmaps = redis_client.mget(seen_keys('d1'))
+        assert is_seen(bitmaps, 'seed1') and is_seen(bitmaps, 'seed2')
+
+
+def test_new_device_is_not_created(algorithm, redis_client):
+    for atomic_update in (True, False):
+        algorithm.atomic_update = atomic_update
+        algorithm.update_recommend_events('d2', [('seed1', Operation.watch)])
+        assert not redis_client.exists('device|d2|recommend')
+
+
+def test_both_paths_record_seen_filter_fill(algorithm, redis_client):
+    for atomic_update in (True, False):
+        count = REGISTRY.get_sample_value('recommend_seen_filter_items_count') or 0
+        update(algorithm, redis_client, atomic_update)
+        assert REGISTRY.get_sample_value('recommend_seen_filter_items_count') == count + 1
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import pytest
+from sqlalchemy import (
+    create_engine,
+    text,
+)
+from sqlalchemy.pool import StaticPool
+
+from recommend.models.video_model import (
+    VideoBehavior,
+    VideoBehaviorWriter,
+)
+
+
+@pytest.fixture
+def engine():
+    """sqlite内存库, 还没有建表, 写入会失败"""
+    return create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+
+def written_videos(engine):
+    with engine.begin() as conn:
+        return [x for x, in conn.execute(text('SELECT video FROM video_behavior ORDER BY id'))]
+
+
+def test_flush_writes_rows(engine):
+    VideoBehavior.__table__.create(engine)
+    writer = VideoBehaviorWriter(engine=engine, max_size=3, max_delay=60)
+    writer.add('d1', 'v1', 1)
+    writer.add('d1', 'v2', 1)
+    assert written_videos(engine) == []
+    writer.add('d2', 'v3', 2)
+    assert written_videos(engine) == ['v1', 'v2', 'v3']
+    assert writer.flush() == 0
+
+
+def test_failed_flush_keeps_rows_for_retry(engine):
+    writer = VideoBehaviorWriter(engine=engine, max_size=100, max_delay=60, retry_delay=60)
+    writer.add('d1', 'v1', 1)
+    writer.add('d1', 'v2', 1)
+    assert writer.flush() == 0
+    writer.add('d1', 'v3', 1)
+
+    VideoBehavior.__table__.create(engine)
+    assert writer.flush() == 3
+    assert written_videos(engine) == ['v1', 'v2', 'v3']
+
+
+def test_pending_rows_are_capped(engine):
+    writer = VideoBehaviorWriter(engine=engine, max_size=2, max_delay=60, max_pending=3, retry_delay=60)
+    for i in range(5):
+        writer.add('d1', 'v{}'.format(i), 1)
+
+    VideoBehavior.__table__.create(engine)
+    assert writer.flush() == 3
+    assert written_videos(engine) == ['v2', 'v3', 'v4']